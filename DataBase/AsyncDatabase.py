@@ -0,0 +1,190 @@
+from firebase_admin import firestore_async
+from google.cloud.firestore_v1 import FieldFilter, async_transactional
+from user_management.user import User
+from user_management.payment_details import TransferResult
+from DataBase.DataBase import Database, _LegacyDocument, _is_transient, TRANSFER_MAX_ATTEMPTS
+from DataBase.DataBase import DEFAULT_BALANCE_SHARDS, MAX_BALANCE_SHARDS
+from DataBase.AsyncStorage import AsyncStorage
+from DataBase.Storage import USER_FIELDS
+from DataBase.UserCache import NOT_CACHED
+from exceptions import *
+
+class AsyncDatabase(AsyncStorage):
+    """
+    Firestore backend on the asyncio client.
+    Reads, login checks and transfers are native coroutines; the other
+    operations (writes, listeners, index maintenance) run the synchronous
+    Database on the thread pool. Both share the same user cache.
+    """
+    def __init__(self, storage=None, max_workers=None):
+        super().__init__(storage or Database(), max_workers)
+        # the synchronous Database initializes the firebase app
+        self.storage.init_dadabase()
+        self.db = firestore_async.client()
+
+    def _user_ref(self, username):
+        return self.db.collection("Users").document(username)
+
+    async def _read_user(self, username):
+        doc = await self._user_ref(username).get()
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        if "History" in data:
+            data = await self._run(self.storage._migrate_legacy_history, username, data)
+        return await self._add_shards(username, data)
+
+    async def _add_shards(self, username, data):
+        # sharded accounts are rare, their balance and Inbox fold use the synchronous client
+        if data is None or not data.get("Shards"):
+            return data
+        return await self._run(self.storage._add_shards, username, data)
+
+    async def get_user(self, username) -> User:
+        """Raises AccountNotFoundError if the user does not exist."""
+        cache = self.storage.cache
+        data = cache.get(username) if cache is not None else NOT_CACHED
+        if data is NOT_CACHED:
+            generation = cache.generation if cache is not None else None
+            data = await self._read_user(username)
+            if cache is not None:
+                cache.put(username, data, generation)
+
+        if data is None:
+            raise AccountNotFoundError(f"Account '{username}' does not exist.")
+        return self.storage._create_user_from_data(username, data)
+
+    async def get_users(self, usernames) -> list:
+        """
+        Fetches many users with one BatchGetDocuments call for the ones not cached.
+        Returns the users in the order of usernames, with None for the missing accounts.
+        """
+        usernames = list(usernames)
+        cache = self.storage.cache
+        found = {}
+        to_read = []
+        for username in dict.fromkeys(usernames):
+            data = cache.get(username) if cache is not None else NOT_CACHED
+            if data is NOT_CACHED:
+                to_read.append(username)
+            else:
+                found[username] = data
+
+        if to_read:
+            generation = cache.generation if cache is not None else None
+            read = {}
+            async for doc in self.db.get_all([self._user_ref(username) for username in to_read]):
+                if doc.exists:
+                    read[doc.id] = doc.to_dict()
+            for username in to_read:
+                data = read.get(username)
+                if data is not None and "History" in data:
+                    data = await self._run(self.storage._migrate_legacy_history, username, data)
+                found[username] = await self._add_shards(username, data)
+                if cache is not None:
+                    # with the shard totals, like the other reads put it
+                    cache.put(username, found[username], generation)
+
+        return [self.storage._create_user_from_data(username, found[username]) if found[username] is not None else None
+                for username in usernames]
+
+    async def get_fields(self, username, fields) -> dict:
+        """Returns only the requested fields of a user, see Storage.get_fields."""
+        fields = list(fields)
+        unknown = [field for field in fields if field not in USER_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown user fields: {', '.join(unknown)}")
+
+        cache = self.storage.cache
+        data = cache.get(username) if cache is not None else NOT_CACHED
+        if data is NOT_CACHED:
+            field_paths = fields + ["Shards"] if "Sold" in fields and "Shards" not in fields else fields
+            doc = await self._user_ref(username).get(field_paths=field_paths)
+            data = doc.to_dict() if doc.exists else None
+            if data is not None and "Sold" in fields:
+                data = await self._add_shards(username, data)
+        if data is None:
+            raise AccountNotFoundError(f"Account '{username}' does not exist.")
+        return {field: data.get(field) for field in fields}
+
+    async def resolve_iban(self, iban : str) -> str:
+        """Raises AccountNotFoundError if no user owns the IBAN."""
+        cache = self.storage.cache
+        if cache is not None:
+            found = cache.get_by_iban(iban)
+            if found is None:
+                raise AccountNotFoundError(f"Account with IBAN '{iban}' does not exist.")
+            if found is not NOT_CACHED:
+                return found[0]
+
+        doc = await self.db.collection("IbanIndex").document(iban).get()
+        if doc.exists:
+            return doc.get("Username")
+        # not indexed yet: the synchronous lookup repairs the index entry
+        return await self._run(self.storage.resolve_iban, iban)
+
+    async def get_user_by_iban(self, iban : str) -> User:
+        return await self.get_user(await self.resolve_iban(iban))
+
+    async def checkUserLogin(self, username, Password) -> bool:
+        doc = await self._user_ref(username).get(field_paths=["Password_hash"])
+        if not doc.exists:
+            return False
+        # bcrypt is slow on purpose, keep it off the event loop
+        return await self._run(self.storage._check_password, Password, doc.get("Password_hash"))
+
+    async def card_exists(self, card_number) -> bool:
+        """Check if a card number is already used or reserved."""
+        if (await self.db.collection("CardIndex").document(str(card_number)).get()).exists:
+            return True
+        # accounts created before the index existed
+        query = self.db.collection("Users").where(filter=FieldFilter("Card_Number", "==", card_number)).limit(1)
+        return len(await query.get()) > 0
+
+    async def transfer(self, sender, receiver, amount, key=None) -> TransferResult:
+        """Moves money between two accounts in an async Firestore transaction, see Database.transfer."""
+        if sender == receiver:
+            raise SameAccountError(f"Cannot transfer money from '{sender}' to itself.")
+        sender_ref = self._user_ref(sender)
+        receiver_ref = self._user_ref(receiver)
+        if key is not None:
+            self.storage._check_transfer_key(key)
+        key_ref = self.db.collection("Transfers").document(key) if key is not None else None
+
+        @async_transactional
+        async def run(transaction):
+            # both documents (and the transfer key) are read with a single BatchGetDocuments call
+            refs = [sender_ref, receiver_ref] + ([key_ref] if key_ref is not None else [])
+            docs = {doc.reference.path: doc async for doc in self.db.get_all(refs, transaction=transaction)}
+            if key_ref is not None and docs[key_ref.path].exists:
+                return self.storage._replay_transfer(key, docs[key_ref.path].to_dict(), sender, receiver, amount)
+            sender_data = docs[sender_ref.path].to_dict() if docs[sender_ref.path].exists else None
+            receiver_data = docs[receiver_ref.path].to_dict() if docs[receiver_ref.path].exists else None
+            shards_total = 0
+            if sender_data is not None and sender_data.get("Shards"):
+                shards = await sender_ref.collection("BalanceShards").limit(MAX_BALANCE_SHARDS).get(transaction=transaction)
+                shards_total = sum(shard.get("Sold") or 0 for shard in shards)
+            result = self.storage._write_transfer(transaction, sender_ref, receiver_ref, sender_data, receiver_data,
+                                                  amount, shards_total)
+            if key_ref is not None:
+                transaction.set(key_ref, self.storage._transfer_record(sender, receiver, amount, result))
+            return result
+
+        while True:
+            transaction = self.db.transaction(max_attempts=TRANSFER_MAX_ATTEMPTS)
+            try:
+                result = await run(transaction)
+            except _LegacyDocument as legacy:
+                await self._run(self.storage._migrate_legacy_history, legacy.username, legacy.data)
+                continue
+            except Exception as error:
+                if _is_transient(error):
+                    raise TransientStorageError(f"Transfer could not be committed: {error}") from error
+                raise
+            if result.replayed:
+                return result
+            result.payment.date = transaction.commit_time
+            self.storage._invalidate(sender, receiver)
+            if await self._run(self.storage._record_credit, receiver):
+                await self._run(self.storage.set_balance_shards, receiver, DEFAULT_BALANCE_SHARDS)
+            return result
@@ -0,0 +1,40 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+class AsyncStorage:
+    """
+    Asyncio front end of a synchronous Storage.
+    Every public method of the storage is available as a coroutine that runs it
+    on a thread pool, so callers on an event loop can run independent operations
+    concurrently (asyncio.gather) without blocking the loop.
+    """
+    def __init__(self, storage, max_workers=None):
+        self.storage = storage
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage")
+
+    @property
+    def cache(self):
+        return self.storage.cache
+
+    async def _run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    def __getattr__(self, name):
+        # only called for the methods not defined here (or natively in AsyncDatabase)
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attribute = getattr(self.storage, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def call(*args, **kwargs):
+            return await self._run(attribute, *args, **kwargs)
+        return call
+
+    async def close(self):
+        self._executor.shutdown(wait=True)
+        if hasattr(self.storage, "close"):
+            self.storage.close()
@@ -1,88 +1,356 @@
-import bcrypt
 import os
-import bcrypt
 import random
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
-from google.cloud.firestore_v1 import FieldFilter
-from faker import Faker
-from datetime import datetime
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
 from user_management.user import User
 from user_management.credit_card import Card
 from user_management.user_credentials import UserCredentials
-from user_management.payment_details import PaymentsHistory
+from user_management.payment_details import PaymentsHistory, HISTORY_PAGE_SIZE, TransferResult
 from user_management.payment_details import Payment
 from user_management.request import Request
+from user_management.scheduled_payment import ScheduledPayment
+from user_management.money import to_bani
+from DataBase.Storage import Storage, LocalSnapshot
 from exceptions import *
 
-class Database:
-    def __init__(self):
-        self.init_dadabase()
+# firebase_admin and the Firestore client library take most of the startup time;
+# they are imported by _load_firestore, on the warm-up thread when warm_up() is used
+firebase_admin = credentials = firestore = FieldFilter = api_exceptions = None
+
+def _load_firestore():
+    global firebase_admin, credentials, firestore, FieldFilter, api_exceptions
+    if firestore is None:
+        import firebase_admin
+        from firebase_admin import credentials
+        from google.cloud.firestore_v1 import FieldFilter
+        from google.api_core import exceptions as api_exceptions
+        from firebase_admin import firestore
+
+def _is_transient(error) -> bool:
+    """True for the Firestore errors worth retrying: contention, timeouts, unavailability."""
+    transient = (api_exceptions.Aborted, api_exceptions.DeadlineExceeded, api_exceptions.ServiceUnavailable,
+                 api_exceptions.ResourceExhausted, api_exceptions.InternalServerError)
+    # a transaction that keeps conflicting ends with a ValueError caused by Aborted
+    return isinstance(error, transient) or (isinstance(error, ValueError) and isinstance(error.__cause__, transient))
+
+# attempts of a transfer transaction before the contention error is raised
+TRANSFER_MAX_ATTEMPTS = 10
+
+# transfers per transfer_batch transaction: up to 9 writes each (2 ledger entries,
+# or a shard and an Inbox entry, the transfer key, and per account its document and
+# rollup), within the 500 writes limit of a transaction
+TRANSFER_BATCH_MAX = 50
+
+# Sharded balances, for accounts receiving more credits than a document can take
+# (about one write per second): credits land on one of the BalanceShards counters
+# and in the Inbox subcollection instead of the user document. The balance is
+# Sold plus the shards; the Inbox is folded into the Ledger by the account's reads.
+DEFAULT_BALANCE_SHARDS = 10
+MAX_BALANCE_SHARDS = 100
+# credits per second, over the window (seconds), that promote an account to sharded mode
+SHARD_PROMOTION_RATE = 1.0
+SHARD_PROMOTION_WINDOW = 10.0
+# seconds between two folds of the same account's Inbox
+SHARD_FOLD_INTERVAL = 5.0
+# Inbox entries folded per transaction: 2 writes each plus one per shard and the
+# user document, within the 500 writes limit of a transaction
+SHARD_FOLD_BATCH = 150
+
+# Meta/schema "Money" value of a database storing amounts as integer bani;
+# databases without it hold lei floats, see migrate_money_units
+MONEY_UNIT = "bani"
+# money fields of the documents converted by migrate_money_units
+LEI_FIELDS = {
+    "Users": ["Sold"],
+    "BalanceShards": ["Sold"],
+    "Transfers": ["Amount", "Sender_balance", "Receiver_balance"],
+    "Rollups": ["In", "Out"],
+}
+
+# lower bound of the Next_run filter, which leaves out the finished schedules (null)
+SCHEDULE_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# getData codes -> user document field (6 is the payment history)
+GETDATA_FIELDS = {1: "Card_Number", 2: "CVV", 3: "Expiry_date", 4: "Sold", 5: "Email", 7: "Iban"}
+
+class _LegacyDocument(Exception):
+    """Aborts a transaction that read a user document which still embeds its History."""
+    def __init__(self, username, data):
+        self.username = username
+        self.data = data
+
+class _UserWatch:
+    """
+    Listener of a user document that, once the account is sharded, also listens
+    to its balance shards and reports Sold as the full balance.
+    """
+    def __init__(self, database, username, callback):
+        self._database = database
+        self._username = username
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._data = None
+        self._shards = None
+        self._shards_watch = None
+        self._user_watch = database.db.collection("Users").document(username).on_snapshot(self._on_user)
+
+    def _on_user(self, doc_snapshot, changes, read_time):
+        for doc in doc_snapshot:
+            with self._lock:
+                self._data = doc.to_dict() if doc.exists else None
+                if self._data and self._data.get("Shards") and self._shards_watch is None:
+                    # the shards' first snapshot reports the balance
+                    self._shards_watch = self._database._shards_ref(self._username).on_snapshot(self._on_shards)
+                    return
+            self._emit(read_time)
+
+    def _on_shards(self, doc_snapshot, changes, read_time):
+        with self._lock:
+            self._shards = [doc.to_dict() for doc in doc_snapshot]
+        if any(shard.get("Count", 0) for shard in self._shards):
+            # move the pending credits to the ledger; the user document snapshot follows
+            threading.Thread(target=self._database._maybe_fold, args=(self._username,), daemon=True).start()
+        self._emit(read_time)
+
+    def _emit(self, read_time):
+        with self._lock:
+            data = self._data
+            if data is not None and self._shards is not None:
+                data = dict(data, Sold=data.get("Sold", 0) + sum(shard.get("Sold", 0) for shard in self._shards))
+        self._callback([LocalSnapshot(self._username, data)], [], read_time)
+
+    def unsubscribe(self):
+        self._user_watch.unsubscribe()
+        if self._shards_watch is not None:
+            self._shards_watch.unsubscribe()
+
+class Database(Storage):
+    """Firestore storage backend."""
+    transfer_batch_max = TRANSFER_BATCH_MAX
+
+    def __init__(self, check_money_unit=True):
+        # the client is created on first use, or in the background by warm_up()
+        self._client = None
+        # refuse to run on a database still storing lei floats (off for the migration)
+        self._check_money_unit = check_money_unit
+        self._client_lock = threading.Lock()
+        self.warm_up_seconds = None
+        # sharded balances: recent credit times per receiver and last Inbox fold per account
+        self._shard_lock = threading.Lock()
+        self._credit_times = defaultdict(deque)
+        self._last_fold = {}
+
+    @property
+    def db(self):
+        if self._client is None:
+            self.init_dadabase()
+        return self._client
 
     def init_dadabase(self):
-        key_path = os.path.join(os.path.dirname(__file__),"edmbank-7fd19-firebase-adminsdk-fbsvc-5f69e38cab.json")
-        if not firebase_admin._apps:
-            cred = credentials.Certificate(key_path)
-            firebase_admin.initialize_app(cred)
-        self.db = firestore.client()
-
-    def history_to_databse_format(self, history : PaymentsHistory):
-        hist = []
-        for payment in history.history:
-            amount = payment.amount
-            rec = payment.receiver
-            send = payment.sender
-            sentence = (f"{send} -> {amount} -> {rec}")
-            hist.append(sentence)
-        return hist
-    
-    def database_to_class_format(self, history_sentence : list[str]) -> PaymentsHistory:
-        history = PaymentsHistory()
-        for sentence in history_sentence:
-            try:
-                sender, amount, receiver = sentence.split(" -> ")
-                payment = Payment(
-                    amount = float(amount),
-                    sender = sender,
-                    receiver = receiver
-                )
-                history.add_payment(payment)
-            except ValueError:
+        # other threads wait here while the warm-up thread creates the client
+        with self._client_lock:
+            if self._client is not None:
+                return
+            _load_firestore()
+            key_path = os.path.join(os.path.dirname(__file__),"edmbank-7fd19-firebase-adminsdk-fbsvc-5f69e38cab.json")
+            if not firebase_admin._apps:
+                cred = credentials.Certificate(key_path)
+                firebase_admin.initialize_app(cred)
+            client = firestore.client()
+            if self._check_money_unit:
+                self._verify_money_unit(client)
+            self._client = client
+
+    def _verify_money_unit(self, client):
+        """
+        Amounts are stored as integer bani. Marks a new, empty database as such and
+        raises StorageSchemaError for one still holding lei (run tools/migrate_money_units.py).
+        """
+        schema_ref = client.collection("Meta").document("schema")
+        schema = schema_ref.get()
+        if schema.exists and schema.to_dict().get("Money") == MONEY_UNIT:
+            return
+        if client.collection("Users").limit(1).get():
+            raise StorageSchemaError("The database stores amounts in lei: run tools/migrate_money_units.py first.")
+        schema_ref.set({"Money": MONEY_UNIT}, merge=True)
+
+    def migrate_money_units(self) -> dict:
+        """
+        Converts every stored amount from lei floats to integer bani: balances,
+        balance shards, transfer records, rollups, and the ledger and Inbox payloads.
+        Each converted document is tagged, so an interrupted run can be resumed;
+        the app must be stopped meanwhile. Returns the documents converted per collection.
+        """
+        schema_ref = self.db.collection("Meta").document("schema")
+        schema = schema_ref.get()
+        if schema.exists and schema.to_dict().get("Money") == MONEY_UNIT:
+            return {}
+
+        def convert(data, fields):
+            update = {field: to_bani(data[field]) for field in fields if data.get(field) is not None}
+            if "Payment" in data and self._payload_outdated(data["Payment"]):
+                update["Payment"] = self._pack_payment(self._unpack_payment(data["Payment"]))
+            if "Counterparties" in data:
+                update["Counterparties"] = {name: to_bani(amount) for name, amount in data["Counterparties"].items()}
+            return update
+
+        report = {}
+        batch, pending = self.db.batch(), 0
+        collections = [(self.db.collection("Users"), "Users"), (self.db.collection("Transfers"), "Transfers")]
+        collections += [(self.db.collection_group(name), name) for name in ("BalanceShards", "Rollups", "Ledger", "Inbox")]
+        for query, name in collections:
+            report[name] = 0
+            tagged = name in LEI_FIELDS
+            for doc in query.stream():
+                data = doc.to_dict()
+                if tagged and data.get("Money") == MONEY_UNIT:
+                    continue
+                try:
+                    update = convert(data, LEI_FIELDS.get(name, []))
+                except ValueError:
+                    continue
+                if tagged:
+                    update["Money"] = MONEY_UNIT
+                if not update:
+                    continue
+                batch.update(doc.reference, update)
+                report[name] += 1
+                pending += 1
+                if pending == 500:
+                    batch.commit()
+                    batch, pending = self.db.batch(), 0
+        batch.commit()
+        schema_ref.set({"Money": MONEY_UNIT}, merge=True)
+        return report
+
+    def warm_up(self):
+        """
+        Imports the Firestore libraries, creates the client and opens its gRPC
+        channel on a background thread, so the first window does not wait for them.
+        """
+        threading.Thread(target=self._warm_up, name="firestore-warm-up", daemon=True).start()
+
+    def _warm_up(self):
+        started = time.perf_counter()
+        try:
+            # any small read opens the channel; the document does not need to exist
+            self.db.collection("Users").document("_warm_up").get(field_paths=["Name"])
+        except Exception:
+            # the first real call reports the problem to the user
+            return
+        self.warm_up_seconds = time.perf_counter() - started
+
+    def _timestamp(self):
+        # resolved by Firestore to the commit time
+        return firestore.SERVER_TIMESTAMP
+
+    def _ledger_ref(self, username):
+        return self.db.collection("Users").document(username).collection("Ledger")
+
+    def _rollups_ref(self, username):
+        return self.db.collection("Users").document(username).collection("Rollups")
+
+    def _rollup_increments(self, user_ref, payments):
+        """(document, data) pairs adding payments to the account's monthly rollups, to set with merge=True."""
+        return [(user_ref.collection("Rollups").document(month), {
+                    "Month": month,
+                    "In": firestore.Increment(delta["In"]),
+                    "Out": firestore.Increment(delta["Out"]),
+                    "Count": firestore.Increment(delta["Count"]),
+                    "Counterparties": {name: firestore.Increment(amount) for name, amount in delta["Counterparties"].items()}
+                }) for month, delta in self._rollup_deltas(user_ref.id, payments).items()]
+
+    def _checkpoints_ref(self, username):
+        return self.db.collection("Users").document(username).collection("Checkpoints")
+
+    def _iban_ref(self, iban):
+        return self.db.collection("IbanIndex").document(iban)
+
+    def _card_ref(self, card_number):
+        return self.db.collection("CardIndex").document(str(card_number))
+
+    def _shards_ref(self, username):
+        return self.db.collection("Users").document(username).collection("BalanceShards")
+
+    def _inbox_ref(self, username):
+        return self.db.collection("Users").document(username).collection("Inbox")
+
+    def _move_identifiers(self, batch, username, old_data, user_data):
+        """Points the IBAN and card indexes to the new identifiers of the user when they changed."""
+        for field, index_ref in (("Iban", self._iban_ref), ("Card_Number", self._card_ref)):
+            if field not in user_data or old_data.get(field) == user_data[field]:
                 continue
-        return history
+            if old_data.get(field):
+                batch.delete(index_ref(old_data[field]))
+            batch.set(index_ref(user_data[field]), {"Username": username})
+
+    def _append_ledger(self, batch, username, history, seq):
+        """
+        Adds the pending payments of the history to the batch (a batch or a transaction),
+        numbered after seq, the stored History_seq. Returns how many were added.
+        """
+        ledger_ref = self._ledger_ref(username)
+        for index, payment in enumerate(history.pending):
+            batch.set(ledger_ref.document(), self._ledger_entry(payment, seq + index + 1))
+        for rollup_ref, increments in self._rollup_increments(self.db.collection("Users").document(username), history.pending):
+            batch.set(rollup_ref, increments, merge=True)
+        return len(history.pending)
 
     def add_user(self, user : User):
         """Add a new user to the database."""
-        password = user.credentials.password
         username = user.credentials.username
-        CardDigit = user.card.number
-        CVV = user.card.cvv
-        IBAN = user.card.IBAN
-        email = user.credentials.email
-        history = user.payment_history
-        history = self.history_to_databse_format(history)
-        sum = user.balance
-    
-        Password_bytes = str(password).encode()
-        salt = bcrypt.gensalt()
-        Password = bcrypt.hashpw(Password_bytes, salt)
-        Password = Password.decode()
-        expiry_date = user.card.expiry_date
-
-
-        user_data = {
-             "Name" : username,
-             "Password_hash" : Password,
-             "Card_Number" : CardDigit,
-             "CVV" : CVV,
-             "Expiry_date" : expiry_date,
-             "Sold" : sum,
-             "Email" : email,
-             "Iban" : IBAN,
-             "History" : history
-         }
-        self.db.collection("Users").document(username).set(user_data)
+        user_data = self._new_user_data(user)
+        iban_ref = self._iban_ref(user_data["Iban"])
+        card_ref = self._card_ref(user_data["Card_Number"])
+
+        @firestore.transactional
+        def run(transaction):
+            # a reservation (Username None) is claimed, an entry of another account is not overwritten
+            for doc in transaction.get_all([card_ref, iban_ref]):
+                owner = doc.get("Username") if doc.exists else None
+                if owner is not None and owner != username:
+                    raise IdentifierInUseError(f"The card number or IBAN of '{username}' belongs to '{owner}'.")
+            transaction.set(self._checkpoints_ref(username).document("0"),
+                            self._opening_checkpoint(username, user_data["Sold"], user.payment_history.pending))
+            user_data["History_seq"] = self._append_ledger(transaction, username, user.payment_history, 0)
+            transaction.set(self.db.collection("Users").document(username), user_data)
+            transaction.set(iban_ref, {"Username": username})
+            transaction.set(card_ref, {"Username": username})
+
+        try:
+            run(self.db.transaction(max_attempts=TRANSFER_MAX_ATTEMPTS))
+        except Exception as error:
+            if _is_transient(error):
+                raise TransientStorageError(f"User '{username}' could not be added: {error}") from error
+            raise
+        self._invalidate(username)
+        user.payment_history.mark_saved()
+
+    def add_users_bulk(self, users):
+        writes = []
+        for user_data, payments in users:
+            username = user_data["Name"]
+            ledger_ref = self._ledger_ref(username)
+            writes.extend((ledger_ref.document(), self._ledger_entry(payment, seq))
+                          for seq, payment in enumerate(payments, start=1))
+            # new accounts: the rollups are written whole
+            writes.extend((self._rollups_ref(username).document(month), dict(rollup, Month=month))
+                          for month, rollup in self._rollup_deltas(username, payments).items())
+            writes.append((self._checkpoints_ref(username).document("0"),
+                           self._opening_checkpoint(username, user_data["Sold"], payments)))
+            writes.append((self.db.collection("Users").document(username), dict(user_data, History_seq=len(payments))))
+            writes.append((self._iban_ref(user_data["Iban"]), {"Username": username}))
+            writes.append((self._card_ref(user_data["Card_Number"]), {"Username": username}))
+
+        # a batch holds at most 500 writes
+        for start in range(0, len(writes), 500):
+            batch = self.db.batch()
+            for ref, data in writes[start:start + 500]:
+                batch.set(ref, data)
+            batch.commit()
+        self._invalidate(*(user_data["Name"] for user_data, _ in users))
 
     def checkUserLogin(self, username, Password):
         doc_ref = self.db.collection("Users").document(username)
@@ -91,125 +359,693 @@ class Database:
         if not doc.exists:
             return False
         stored_hash = doc.to_dict().get("Password_hash")
-        if bcrypt.checkpw(Password.encode(), stored_hash.encode()):
-            return True
-        else:
-            return False
+        return self._check_password(Password, stored_hash)
 
     def getData(self, username, date):
-        doc_ref = self.db.collection("Users").document(username)
-        doc = doc_ref.get()
-        
-        if date == 1:
-            return doc.get("Card_Number")
-        elif date == 2:
-            return doc.get("CVV")
-        elif date == 3:
-            return doc.get("Expiry_date")
-        elif date == 4:
-            return doc.get("Sold")
-        elif date == 5:
-            return doc.get("Email")
-        elif date == 6:
-            return doc.get("History")
-        elif date == 7:
-            return doc.get("Iban")   
-        else:
+        """Deprecated: use get_fields, which reads only the requested fields."""
+        if date == 6:
+            # the history lives in the Ledger subcollection, return its most recent page
+            payments, _ = self.get_history_page(username)
+            return [self._encode_payment(payment) for payment in payments]
+        field = GETDATA_FIELDS.get(date)
+        if field is None:
+            return None
+        try:
+            return self.get_fields(username, [field])[field]
+        except AccountNotFoundError:
             return None
-        
 
     def delete_user(self, username):
         """Delete the user from the database."""
         doc_ref = self.db.collection("Users").document(username)
-        doc = doc_ref.get()
-        doc_ref.delete()
+        identifiers = doc_ref.get(field_paths=["Iban", "Card_Number"])
+        iban = identifiers.get("Iban") if identifiers.exists else None
+        card_number = identifiers.get("Card_Number") if identifiers.exists else None
+        # Firestore does not delete subcollections with their parent
+        batch = self.db.batch()
+        subcollections = (self._ledger_ref(username), self._shards_ref(username), self._inbox_ref(username),
+                          self._rollups_ref(username), self._checkpoints_ref(username))
+        entries = (entry_ref for collection in subcollections for entry_ref in collection.list_documents())
+        for index, entry_ref in enumerate(entries, start=1):
+            batch.delete(entry_ref)
+            if index % 500 == 0:
+                batch.commit()
+                batch = self.db.batch()
+        batch.delete(doc_ref)
+        if iban:
+            batch.delete(self._iban_ref(iban))
+        if card_number:
+            batch.delete(self._card_ref(card_number))
+        batch.commit()
+        self._invalidate(username)
 
     def modify_user(self, user: User):
-        """Update existing user fields safely."""
-        user_data = {
-            "Name": user.credentials.username,
-            "Password_hash": user.credentials.password,
-            "Card_Number": user.card.number,
-            "CVV": user.card.cvv,
-            "Expiry_date": user.card.expiry_date,
-            "Sold": user.balance,
-            "Email": user.credentials.email,
-            "Iban": user.card.IBAN,
-            "History": self.history_to_databse_format(user.payment_history)
-        }
-        self.db.collection("Users").document(user.credentials.username).update(user_data)
+        """
+        Update existing user fields safely.
+        Only the modified fields are written, in a transaction that reads the
+        stored document: the balance moves by the change made to the user, and
+        the new payments become Ledger entries numbered after the stored
+        History_seq, whichever session or transfer wrote the previous ones.
+        """
+        username = user.credentials.username
+        fields, balance_delta = self._changed_fields(user)
+        history = user.payment_history
+        if not fields and balance_delta is None and not history.pending:
+            return
+        user_ref = self.db.collection("Users").document(username)
+
+        @firestore.transactional
+        def run(transaction):
+            doc = next(iter(transaction.get_all([user_ref])))
+            if not doc.exists:
+                raise AccountNotFoundError(f"Account '{username}' does not exist.")
+            stored = doc.to_dict()
+            if "History" in stored:
+                raise _LegacyDocument(username, stored)
+            user_data = dict(fields)
+            if balance_delta is not None:
+                shards_total = 0
+                if balance_delta < 0 and stored.get("Shards"):
+                    # like a transfer, a debit reads every shard so the check sees all the credits
+                    shards = user_ref.collection("BalanceShards").limit(MAX_BALANCE_SHARDS).get(transaction=transaction)
+                    shards_total = sum(shard.get("Sold") or 0 for shard in shards)
+                self._check_debit(username, (stored.get("Sold") or 0) + shards_total, balance_delta)
+                # the user document keeps the part of a sharded balance that is not in the shards
+                user_data["Sold"] = (stored.get("Sold") or 0) + balance_delta
+            seq = stored.get("History_seq") or 0
+            added = self._append_ledger(transaction, username, history, seq)
+            if added:
+                user_data["History_seq"] = seq + added
+            if "Iban" in user_data or "Card_Number" in user_data:
+                self._move_identifiers(transaction, username, stored, user_data)
+            if user_data:
+                transaction.update(user_ref, user_data)
+
+        while True:
+            try:
+                run(self.db.transaction(max_attempts=TRANSFER_MAX_ATTEMPTS))
+            except _LegacyDocument as legacy:
+                # the ledger numbering starts after the embedded history, migrate it first
+                self._migrate_legacy_history(legacy.username, legacy.data)
+                continue
+            except Exception as error:
+                if _is_transient(error):
+                    raise TransientStorageError(f"User '{username}' could not be saved: {error}") from error
+                raise
+            break
+        history.mark_saved()
+        user.mark_clean()
+        self._invalidate(username)
+
+    def transfer(self, sender, receiver, amount, key=None) -> TransferResult:
+        """
+        Moves money between two accounts in a Firestore transaction.
+        Firestore retries the transaction when another write touches one of the
+        two documents between the reads and the commit.
+        Credits to a sharded account do not write its user document.
+        """
+        if sender == receiver:
+            raise SameAccountError(f"Cannot transfer money from '{sender}' to itself.")
+        users_ref = self.db.collection("Users")
+        sender_ref = users_ref.document(sender)
+        receiver_ref = users_ref.document(receiver)
+        if key is not None:
+            self._check_transfer_key(key)
+        key_ref = self.db.collection("Transfers").document(key) if key is not None else None
+
+        @firestore.transactional
+        def run(transaction):
+            refs = [sender_ref, receiver_ref] + ([key_ref] if key_ref is not None else [])
+            docs = {doc.reference.path: doc for doc in transaction.get_all(refs)}
+            if key_ref is not None and docs[key_ref.path].exists:
+                return self._replay_transfer(key, docs[key_ref.path].to_dict(), sender, receiver, amount)
+            sender_data = docs[sender_ref.path].to_dict() if docs[sender_ref.path].exists else None
+            receiver_data = docs[receiver_ref.path].to_dict() if docs[receiver_ref.path].exists else None
+            shards_total = 0
+            if sender_data is not None and sender_data.get("Shards"):
+                # a debit reads every shard so the balance check sees all the credits
+                shards = sender_ref.collection("BalanceShards").limit(MAX_BALANCE_SHARDS).get(transaction=transaction)
+                shards_total = sum(shard.get("Sold") or 0 for shard in shards)
+            result = self._write_transfer(transaction, sender_ref, receiver_ref, sender_data, receiver_data,
+                                          amount, shards_total)
+            if key_ref is not None:
+                transaction.set(key_ref, self._transfer_record(sender, receiver, amount, result))
+            return result
+
+        while True:
+            transaction = self.db.transaction(max_attempts=TRANSFER_MAX_ATTEMPTS)
+            try:
+                result = run(transaction)
+            except _LegacyDocument as legacy:
+                # the ledger numbering starts after the embedded history, migrate it first
+                self._migrate_legacy_history(legacy.username, legacy.data)
+                continue
+            except Exception as error:
+                if _is_transient(error):
+                    raise TransientStorageError(f"Transfer could not be committed: {error}") from error
+                raise
+            if result.replayed:
+                return result
+            # the ledger entries were stamped with the commit time
+            result.payment.date = transaction.commit_time
+            self._invalidate(sender, receiver)
+            if self._record_credit(receiver):
+                self.set_balance_shards(receiver, DEFAULT_BALANCE_SHARDS)
+            return result
+
+    def _credit_shard(self, transaction, ref, shards, payment):
+        """
+        Credits a sharded account: one of its shards and an Inbox entry queuing
+        the payment for the account's next fold; the user document is not written.
+        """
+        shard = random.randrange(shards)
+        transaction.set(ref.collection("BalanceShards").document(str(shard)),
+                        {"Sold": firestore.Increment(payment.amount), "Count": firestore.Increment(1)}, merge=True)
+        transaction.set(ref.collection("Inbox").document(),
+                        {"Payment": self._pack_payment(payment), "Shard": shard, "Created": firestore.SERVER_TIMESTAMP})
+
+    def _write_transfer(self, transaction, sender_ref, receiver_ref, sender_data, receiver_data, amount, shards_total):
+        """
+        Checks a transfer read inside a transaction and adds its writes.
+        shards_total is the sum of the sender's balance shards (0 if not sharded).
+        Shared with AsyncDatabase: the references may belong to either client.
+        """
+        sender, receiver = sender_ref.id, receiver_ref.id
+        if sender_data is not None:
+            sender_data["Sold"] += shards_total
+        payment = self._check_transfer(sender, receiver, sender_data, receiver_data, amount)
+        for username, data in ((sender, sender_data), (receiver, receiver_data)):
+            if "History" in data:
+                raise _LegacyDocument(username, data)
+
+        receiver_balance = None
+        for ref, data, delta in ((sender_ref, sender_data, -amount), (receiver_ref, receiver_data, amount)):
+            if delta > 0 and data.get("Shards"):
+                self._credit_shard(transaction, ref, data["Shards"], payment)
+                continue
+            data["Sold"] += delta
+            data["History_seq"] = data.get("History_seq", 0) + 1
+            transaction.set(ref.collection("Ledger").document(), self._ledger_entry(payment, data["History_seq"]))
+            for rollup_ref, increments in self._rollup_increments(ref, [payment]):
+                transaction.set(rollup_ref, increments, merge=True)
+            # the user document keeps the part of the balance that is not in the shards
+            stored = data["Sold"] - (shards_total if ref is sender_ref else 0)
+            transaction.update(ref, {"Sold": stored, "History_seq": data["History_seq"]})
+            if ref is receiver_ref:
+                receiver_balance = data["Sold"]
+        # the balance of a sharded receiver is not read, so it is not known here
+        return TransferResult(payment, sender_data["Sold"], receiver_balance)
+
+    def transfer_batch(self, items) -> list:
+        """
+        Commits the accepted transfers of the batch in one Firestore transaction,
+        after one BatchGetDocuments call for the accounts and transfer keys involved.
+        """
+        items = list(items)
+        if len(items) > self.transfer_batch_max:
+            raise ValueError(f"At most {self.transfer_batch_max} transfers per batch, got {len(items)}.")
+        users_ref = self.db.collection("Users")
+        usernames = {username for sender, receiver, _, _ in items for username in (sender, receiver)}
+        keys = set()
+        for _, _, _, key in items:
+            if key is not None:
+                try:
+                    self._check_transfer_key(key)
+                except ValueError:
+                    # rejected by the plan, without a read
+                    continue
+                keys.add(key)
+        refs = [users_ref.document(username) for username in usernames]
+        refs += [self.db.collection("Transfers").document(key) for key in keys]
+
+        @firestore.transactional
+        def run(transaction):
+            accounts, records = {}, {}
+            for doc in transaction.get_all(refs):
+                if not doc.exists:
+                    continue
+                if doc.reference.parent.id == "Transfers":
+                    records[doc.id] = doc.to_dict()
+                    continue
+                data = doc.to_dict()
+                if "History" in data:
+                    raise _LegacyDocument(doc.id, data)
+                accounts[doc.id] = data
+            senders = {sender for sender, _, _, _ in items}
+            shards_totals = {}
+            for username, data in accounts.items():
+                if data.get("Shards") and username in senders:
+                    # a debit reads every shard so the balance check sees all the credits
+                    shards = users_ref.document(username).collection("BalanceShards").limit(MAX_BALANCE_SHARDS).get(transaction=transaction)
+                    shards_totals[username] = sum(shard.get("Sold") or 0 for shard in shards)
+                    data["Sold"] += shards_totals[username]
+            inboxed = {username for username, data in accounts.items() if data.get("Shards")}
+            results, transfers = self._plan_batch(items, accounts, records, inboxed)
+
+            payments = defaultdict(list)
+            for key, payment, sender_seq, receiver_seq in transfers:
+                sender_ref = users_ref.document(payment.sender)
+                transaction.set(sender_ref.collection("Ledger").document(), self._ledger_entry(payment, sender_seq))
+                payments[payment.sender].append(payment)
+                receiver_ref = users_ref.document(payment.receiver)
+                if receiver_seq is None:
+                    self._credit_shard(transaction, receiver_ref, accounts[payment.receiver]["Shards"], payment)
+                else:
+                    transaction.set(receiver_ref.collection("Ledger").document(), self._ledger_entry(payment, receiver_seq))
+                    payments[payment.receiver].append(payment)
+                if key is not None:
+                    transaction.set(self.db.collection("Transfers").document(key), records[key])
+            for username, account_payments in payments.items():
+                user_ref = users_ref.document(username)
+                for rollup_ref, increments in self._rollup_increments(user_ref, account_payments):
+                    transaction.set(rollup_ref, increments, merge=True)
+                # the user document keeps the part of the balance that is not in the shards
+                data = accounts[username]
+                transaction.update(user_ref, {"Sold": data["Sold"] - shards_totals.get(username, 0),
+                                              "History_seq": data["History_seq"]})
+            return results, transfers
+
+        while True:
+            transaction = self.db.transaction(max_attempts=TRANSFER_MAX_ATTEMPTS)
+            try:
+                results, transfers = run(transaction)
+            except _LegacyDocument as legacy:
+                self._migrate_legacy_history(legacy.username, legacy.data)
+                continue
+            except Exception as error:
+                if _is_transient(error):
+                    raise TransientStorageError(f"Transfer batch could not be committed: {error}") from error
+                raise
+            break
+        for result in results:
+            if isinstance(result, TransferResult) and result.payment.date is firestore.SERVER_TIMESTAMP:
+                # the ledger entries were stamped with the commit time (replays of a key
+                # used earlier in the batch included)
+                result.payment.date = transaction.commit_time
+        self._invalidate(*{username for _, payment, _, _ in transfers for username in (payment.sender, payment.receiver)})
+        for receiver in {payment.receiver for _, payment, _, _ in transfers}:
+            if self._record_credit(receiver):
+                self.set_balance_shards(receiver, DEFAULT_BALANCE_SHARDS)
+        return results
+
+    def _record_credit(self, receiver) -> bool:
+        """
+        Tracks the credits this process sends to each account.
+        Returns True when the receiver crosses the promotion rate.
+        """
+        now = time.monotonic()
+        with self._shard_lock:
+            times = self._credit_times[receiver]
+            times.append(now)
+            while times and times[0] < now - SHARD_PROMOTION_WINDOW:
+                times.popleft()
+            if len(times) < SHARD_PROMOTION_RATE * SHARD_PROMOTION_WINDOW:
+                return False
+            del self._credit_times[receiver]
+        try:
+            return not self.get_fields(receiver, ["Shards"])["Shards"]
+        except AccountNotFoundError:
+            return False
+
+    def set_balance_shards(self, username, shards):
+        """
+        Switches an account to sharded mode with the given number of shards,
+        or back to a single document with 0 (the pending credits are folded first).
+        """
+        if not 0 <= shards <= MAX_BALANCE_SHARDS:
+            raise ValueError(f"Shards must be between 0 and {MAX_BALANCE_SHARDS}.")
+        user_ref = self.db.collection("Users").document(username)
+        previous = user_ref.get(field_paths=["Shards"]).get("Shards") or 0
+        # transfers in flight read the user document, so they retry with the new count
+        user_ref.update({"Shards": shards})
+        self._invalidate(username)
+        if shards < previous:
+            # the shards past the new count must not keep any balance
+            while self._fold_inbox(username):
+                pass
+
+    def _maybe_fold(self, username) -> bool:
+        """
+        Folds the Inbox of a sharded account unless it was folded less than
+        SHARD_FOLD_INTERVAL ago. Returns True if payments were moved.
+        """
+        now = time.monotonic()
+        with self._shard_lock:
+            if now - self._last_fold.get(username, float("-inf")) < SHARD_FOLD_INTERVAL:
+                return False
+            self._last_fold[username] = now
+        try:
+            return self._fold_inbox(username) > 0
+        except Exception:
+            # the next read or shard snapshot folds again
+            with self._shard_lock:
+                self._last_fold.pop(username, None)
+            return False
+
+    def _fold_inbox(self, username) -> int:
+        """
+        Moves the oldest Inbox payments of a sharded account to its Ledger and
+        their amounts from the shards to Sold, in one transaction.
+        Returns the number of payments moved.
+        """
+        user_ref = self.db.collection("Users").document(username)
+        inbox_query = self._inbox_ref(username).order_by("Created").limit(SHARD_FOLD_BATCH)
+
+        @firestore.transactional
+        def run(transaction):
+            user_doc = next(iter(transaction.get_all([user_ref])))
+            entries = inbox_query.get(transaction=transaction)
+            if not user_doc.exists or not entries:
+                return 0
+            seq = user_doc.get("History_seq") or 0
+            amounts = defaultdict(int)
+            counts = defaultdict(int)
+            folded = []
+            for entry in entries:
+                transaction.delete(entry.reference)
+                shard = entry.get("Shard")
+                counts[shard] += 1
+                try:
+                    # keeps the time of the credit, not of the fold
+                    payment = self._entry_to_payment(entry.to_dict())
+                except ValueError:
+                    continue
+                amounts[shard] += payment.amount
+                seq += 1
+                transaction.set(self._ledger_ref(username).document(), self._ledger_entry(payment, seq))
+                folded.append(payment)
+            # credits of a sharded account reach its rollups when they reach its ledger
+            for rollup_ref, increments in self._rollup_increments(user_ref, folded):
+                transaction.set(rollup_ref, increments, merge=True)
+            for shard, count in counts.items():
+                transaction.set(self._shards_ref(username).document(str(shard)),
+                                {"Sold": firestore.Increment(-amounts[shard]), "Count": firestore.Increment(-count)}, merge=True)
+            transaction.update(user_ref, {"Sold": firestore.Increment(sum(amounts.values())), "History_seq": seq})
+            return len(entries)
+
+        moved = run(self.db.transaction())
+        if moved:
+            self._invalidate(username)
+        return moved
+
+    def _add_shards(self, username, data):
+        """
+        Returns the document of a sharded account with Sold as its full balance,
+        folding its Inbox when due. Other documents are returned unchanged.
+        """
+        if data is None or not data.get("Shards"):
+            return data
+        for _ in range(2):
+            # one BatchGetDocuments call reads the document and the shards at the same time
+            user_ref = self.db.collection("Users").document(username)
+            shard_refs = [self._shards_ref(username).document(str(index)) for index in range(data["Shards"])]
+            docs = {doc.reference.path: doc for doc in self.db.get_all([user_ref] + shard_refs)}
+            user_doc = docs[user_ref.path]
+            if not user_doc.exists:
+                return None
+            data = user_doc.to_dict()
+            shards = [docs[ref.path] for ref in shard_refs if docs[ref.path].exists]
+            if not data.get("Shards") or not any(shard.get("Count") for shard in shards):
+                break
+            if not self._maybe_fold(username):
+                break
+        data["Sold"] = data.get("Sold", 0) + sum(shard.get("Sold") or 0 for shard in shards)
+        return data
 
     def listen_to_user(self, username, callback):
-        """Listen to changes on a user document."""
-        doc_ref = self.db.collection("Users").document(username)
-        return doc_ref.on_snapshot(callback)
+        """Listen to changes on a user document (and its balance shards once it is sharded)."""
+        return _UserWatch(self, username, self._caching_callback(username, callback))
 
-    def get_user(self, username):
+    def listen_to_users(self, callback, usernames=None):
+        """
+        Listen to changes on every user document with one collection listener, or
+        on the given usernames with one query listener ("in" on the document ids).
+        The client resumes the stream from its last resume token after transient errors.
+        Sold is the user document's own part: the shards of sharded accounts are not watched.
+        """
+        users_ref = self.db.collection("Users")
+        if usernames is None:
+            return users_ref.on_snapshot(callback)
+        refs = [users_ref.document(username) for username in usernames]
+        return users_ref.where(filter=FieldFilter("__name__", "in", refs)).on_snapshot(callback)
+
+    def _read_user(self, username):
         doc_ref = self.db.collection("Users").document(username)
         doc = doc_ref.get()
 
         if not doc.exists:
-            raise AccountNotFoundError(f"Account '{username}' does not exist.")
+            return None
         
         data = doc.to_dict()
-        return self._create_user_from_data(username, data)
+        if "History" in data:
+            data = self._migrate_legacy_history(username, data)
+        return self._add_shards(username, data)
 
-    def get_user_by_iban(self, iban: str) -> User:
+    def migrate_ledger_encoding(self) -> int:
+        converted = 0
+        batch = self.db.batch()
+        for entry in self.db.collection_group("Ledger").stream():
+            payment = entry.get("Payment")
+            if not self._payload_outdated(payment):
+                continue
+            try:
+                batch.update(entry.reference, {"Payment": self._pack_payment(self._unpack_payment(payment))})
+            except ValueError:
+                continue
+            converted += 1
+            if converted % 500 == 0:
+                batch.commit()
+                batch = self.db.batch()
+        batch.commit()
+        return converted
+
+    def _read_users(self, usernames) -> dict:
         users_ref = self.db.collection("Users")
-        query = users_ref.where(filter=FieldFilter("Iban", "==", iban)).get()
-        
-        if not query:
-            raise AccountNotFoundError(f"Account with IBAN '{iban}' does not exist.")
-        
-        doc = query[0]
+        found = {}
+        # one BatchGetDocuments call; the snapshots do not come back in request order
+        for doc in self.db.get_all([users_ref.document(username) for username in usernames]):
+            if not doc.exists:
+                continue
+            data = doc.to_dict()
+            if "History" in data:
+                data = self._migrate_legacy_history(doc.id, data)
+            found[doc.id] = self._add_shards(doc.id, data)
+        return found
+
+    def _read_fields(self, username, fields) -> dict:
+        # the balance of a sharded account also needs its shards
+        field_paths = fields + ["Shards"] if "Sold" in fields and "Shards" not in fields else fields
+        doc = self.db.collection("Users").document(username).get(field_paths=field_paths)
+        if not doc.exists:
+            return None
         data = doc.to_dict()
-        username = doc.id # or data.get("Name")
-        return self._create_user_from_data(username, data)
-
-    def _create_user_from_data(self, username, data):
-        email = data.get("Email")
-        balance = data.get("Sold")
-        hashed_pass = data.get("Password_hash")
-        cardNr = data.get("Card_Number")
-        cvv = data.get("CVV")
-        IBAN = data.get("Iban")
-        exp_date = data.get("Expiry_date")
-        history = data.get("History")
-        history = self.database_to_class_format(history)
-
-        credentials = UserCredentials(
-            username = username,
-            password = hashed_pass,
-            email = email
-        )
-
-        card = Card(
-            number = cardNr,
-            cvv = cvv,
-            IBAN = IBAN,
-            expiry_date=exp_date
-        )
-
-        user = User(
-            credentials=credentials,
-            balance=balance,
-            payment_history=history,
-            card=card
-        )
-
-        return user
-        
+        if data.get("Shards") and "Sold" in fields:
+            data = self._add_shards(username, data)
+        return data
+
+    def _migrate_legacy_history(self, username, data):
+        """Moves a History array embedded in the user document to the Ledger subcollection."""
+        history = self.database_to_class_format(data.get("History") or [])
+        payments = history.history
+        batch = self.db.batch()
+        for seq, payment in enumerate(payments, start=1):
+            batch.set(self._ledger_ref(username).document(), self._ledger_entry(payment, seq))
+            if seq % 499 == 0:
+                batch.commit()
+                batch = self.db.batch()
+        # undated payments all go to the current month: a single rollup write
+        for rollup_ref, increments in self._rollup_increments(self.db.collection("Users").document(username), payments):
+            batch.set(rollup_ref, increments, merge=True)
+        batch.update(self.db.collection("Users").document(username), {
+            "History": firestore.DELETE_FIELD,
+            "History_seq": len(payments)
+        })
+        batch.commit()
+        self._invalidate(username)
+
+        data = dict(data)
+        data.pop("History")
+        data["History_seq"] = len(payments)
+        return data
+
+    def get_history_page(self, username, limit=HISTORY_PAGE_SIZE, before=None):
+        query = self._ledger_ref(username)
+        if before is not None:
+            query = query.where(filter=FieldFilter("Seq", "<", before))
+        query = query.order_by("Seq", direction=firestore.Query.DESCENDING).limit(limit)
+        entries = [doc.to_dict() for doc in query.get()]
+        return self._entries_to_page(entries, limit)
+
+    def _ledger_entries_after(self, username, after, limit) -> list:
+        query = self._ledger_ref(username).where(filter=FieldFilter("Seq", ">", after))
+        query = query.order_by("Seq").limit(limit)
+        return [doc.to_dict() for doc in query.get()]
+
+    def _ledger_entries_between(self, username, since, until, limit, cursor) -> list:
+        # needs the composite index Ledger (Created desc, Seq desc), see README
+        query = self._ledger_ref(username)
+        if since is not None:
+            query = query.where(filter=FieldFilter("Created", ">=", since))
+        if until is not None:
+            query = query.where(filter=FieldFilter("Created", "<", until))
+        query = query.order_by("Created", direction=firestore.Query.DESCENDING)
+        query = query.order_by("Seq", direction=firestore.Query.DESCENDING)
+        if cursor is not None:
+            query = query.start_after({"Created": cursor[0], "Seq": cursor[1]})
+        return [doc.to_dict() for doc in query.limit(limit).get()]
+
+    def _read_rollups(self, username, since, until) -> list:
+        query = self._rollups_ref(username)
+        if since is not None:
+            query = query.where(filter=FieldFilter("Month", ">=", since))
+        if until is not None:
+            query = query.where(filter=FieldFilter("Month", "<=", until))
+        return [doc.to_dict() for doc in query.order_by("Month").get()]
+
+    def _replace_rollups(self, username, rollups):
+        writes = [(ref, None) for ref in self._rollups_ref(username).list_documents()]
+        writes.extend((self._rollups_ref(username).document(month), dict(rollup, Month=month))
+                      for month, rollup in rollups.items())
+        for start in range(0, len(writes), 500):
+            batch = self.db.batch()
+            for ref, data in writes[start:start + 500]:
+                if data is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, data)
+            batch.commit()
+
+    def _all_usernames(self) -> list:
+        return [ref.id for ref in self.db.collection("Users").list_documents()]
+
+    def _ledger_state(self, username):
+        # the user document without the shards: their credits are not in the ledger until folded
+        doc = self.db.collection("Users").document(username).get()
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        if "History" in data:
+            data = self._migrate_legacy_history(username, data)
+        return data.get("Sold", 0), data.get("History_seq", 0)
+
+    def _read_checkpoint(self, username, seq):
+        query = self._checkpoints_ref(username).where(filter=FieldFilter("Seq", "<=", seq))
+        docs = query.order_by("Seq", direction=firestore.Query.DESCENDING).limit(1).get()
+        return docs[0].to_dict() if docs else None
+
+    def _write_checkpoints(self, username, checkpoints):
+        for start in range(0, len(checkpoints), 500):
+            batch = self.db.batch()
+            for checkpoint in checkpoints[start:start + 500]:
+                batch.set(self._checkpoints_ref(username).document(str(checkpoint["Seq"])), checkpoint)
+            batch.commit()
+
+    def _lookup_iban(self, iban: str):
+        doc = self._iban_ref(iban).get()
+        if doc.exists:
+            return doc.get("Username")
+
+        # accounts created before the index existed: find the owner and repair the entry
+        users_ref = self.db.collection("Users")
+        query = users_ref.where(filter=FieldFilter("Iban", "==", iban)).limit(1).get()
+        if not query:
+            return None
+        username = query[0].id
+        self._iban_ref(iban).set({"Username": username})
+        return username
+
+    def _lookup_card(self, card_number):
+        doc = self._card_ref(card_number).get()
+        if doc.exists:
+            # None while the card number is only reserved
+            return doc.get("Username")
+
+        # accounts created before the index existed: find the owner and repair the entry
+        query = self.db.collection("Users").where(filter=FieldFilter("Card_Number", "==", card_number)).limit(1).get()
+        if not query:
+            return None
+        username = query[0].id
+        self._card_ref(card_number).set({"Username": username})
+        return username
+
+    def verify_iban_index(self) -> dict:
+        owners = [(doc.id, doc.get("Iban")) for doc in self.db.collection("Users").select(["Iban"]).stream()]
+        index = {doc.id: doc.get("Username") for doc in self.db.collection("IbanIndex").stream()}
+        return self._index_report(owners, index)
+
+    def rebuild_iban_index(self) -> dict:
+        report = self.verify_iban_index()
+        self._apply_index_report(report, self._iban_ref)
+        return report
+
+    def verify_card_index(self) -> dict:
+        owners = [(doc.id, doc.get("Card_Number")) for doc in self.db.collection("Users").select(["Card_Number"]).stream()]
+        index = {int(doc.id): doc.get("Username") for doc in self.db.collection("CardIndex").stream()}
+        return self._index_report(owners, index)
+
+    def rebuild_card_index(self) -> dict:
+        report = self.verify_card_index()
+        self._apply_index_report(report, self._card_ref)
+        return report
+
+    def _apply_index_report(self, report, index_ref):
+        batch = self.db.batch()
+        pending = 0
+        writes = [(key, {"Username": username}) for key, username in report["missing"].items()]
+        writes += [(key, None) for key in report["stale"]]
+        for key, entry in writes:
+            if entry is None:
+                batch.delete(index_ref(key))
+            else:
+                batch.set(index_ref(key), entry)
+            pending += 1
+            if pending == 500:
+                batch.commit()
+                batch = self.db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
 
     def card_exists(self, card_number: str) -> bool:
         """
-        Check if a generated card number already exists in the database.
+        Check if a card number is already used or reserved.
         """
+        if self._card_ref(card_number).get().exists:
+            return True
+
+        # accounts created before the index existed
         users_ref = self.db.collection("Users")
-        query = users_ref.where(filter=FieldFilter("Card_Number", "==", card_number)).get()
+        query = users_ref.where(filter=FieldFilter("Card_Number", "==", card_number)).limit(1).get()
 
         # If query is not empty, card exists
         return len(query) > 0
 
+    def reserve_identifiers(self, card_number, iban) -> bool:
+        card_ref = self._card_ref(card_number)
+        iban_ref = self._iban_ref(iban)
+
+        @firestore.transactional
+        def run(transaction):
+            if any(doc.exists for doc in transaction.get_all([card_ref, iban_ref])):
+                return False
+            transaction.create(card_ref, {"Username": None})
+            transaction.create(iban_ref, {"Username": None})
+            return True
+
+        return run(self.db.transaction())
+
+    def release_identifiers(self, card_number, iban):
+        refs = [self._card_ref(card_number), self._iban_ref(iban)]
+
+        @firestore.transactional
+        def run(transaction):
+            # read in the same transaction: an entry claimed by add_user meanwhile is kept
+            for doc in transaction.get_all(refs):
+                if doc.exists and doc.get("Username") is None:
+                    transaction.delete(doc.reference)
+
+        run(self.db.transaction())
+
     def add_request(self, request: Request):
         """
         Adds a support request to the 'Requests' collection in Firestore.
@@ -220,3 +1056,36 @@ class Database:
         except Exception as e:
             raise RequestError(f"Failed to add request to database: {e}")
 
+    def save_schedules(self, schedules):
+        schedules = list(schedules)
+        schedules_ref = self.db.collection("Schedules")
+        # a batch holds at most 500 writes
+        for start in range(0, len(schedules), 500):
+            batch = self.db.batch()
+            for schedule in schedules[start:start + 500]:
+                batch.set(schedules_ref.document(schedule.schedule_id), schedule.to_dict())
+            batch.commit()
+
+    def delete_schedule(self, schedule_id):
+        self.db.collection("Schedules").document(schedule_id).delete()
+
+    def get_schedules(self, username) -> list:
+        docs = self.db.collection("Schedules").where(filter=FieldFilter("Sender", "==", username)).get()
+        return self._sort_schedules(ScheduledPayment.from_dict(doc.to_dict()) for doc in docs)
+
+    def read_schedules(self, schedule_ids) -> dict:
+        schedules_ref = self.db.collection("Schedules")
+        refs = [schedules_ref.document(schedule_id) for schedule_id in schedule_ids]
+        if not refs:
+            return {}
+        # one BatchGetDocuments call
+        return {doc.id: ScheduledPayment.from_dict(doc.to_dict()) for doc in self.db.get_all(refs) if doc.exists}
+
+    def next_schedules(self, after=None, limit=1000) -> list:
+        # needs the composite index Schedules (Next_run asc, Id asc), see README
+        query = self.db.collection("Schedules").where(filter=FieldFilter("Next_run", ">=", SCHEDULE_EPOCH))
+        query = query.order_by("Next_run").order_by("Id")
+        if after is not None:
+            query = query.start_after({"Next_run": after[0], "Id": after[1]})
+        docs = query.select(["Next_run", "Id"]).limit(limit).get()
+        return [(doc.get("Next_run"), doc.get("Id")) for doc in docs]
@@ -0,0 +1,72 @@
+import os
+
+# EDMBANK_STORAGE selects the backend: "firestore" (default), "memory" or "sqlite".
+# EDMBANK_SQLITE_PATH is the database file used by the sqlite backend.
+# EDMBANK_CACHE_SIZE / EDMBANK_CACHE_TTL / EDMBANK_CACHE_NEGATIVE_TTL configure
+# the user cache (size 0 disables it, TTLs are in seconds).
+# EDMBANK_USER_MIRROR=1 replaces the cache with a mirror of the whole Users
+# collection, answering for up to EDMBANK_MIRROR_STALENESS seconds without news from its stream.
+STORAGE_ENV = "EDMBANK_STORAGE"
+SQLITE_PATH_ENV = "EDMBANK_SQLITE_PATH"
+DEFAULT_SQLITE_PATH = "edmbank.sqlite3"
+CACHE_SIZE_ENV = "EDMBANK_CACHE_SIZE"
+CACHE_TTL_ENV = "EDMBANK_CACHE_TTL"
+CACHE_NEGATIVE_TTL_ENV = "EDMBANK_CACHE_NEGATIVE_TTL"
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 30.0
+DEFAULT_CACHE_NEGATIVE_TTL = 5.0
+USER_MIRROR_ENV = "EDMBANK_USER_MIRROR"
+MIRROR_STALENESS_ENV = "EDMBANK_MIRROR_STALENESS"
+
+def create_database(backend=None, cache_size=None, mirror=None, **options):
+    """
+    Creates the storage backend chosen by the argument or by the EDMBANK_STORAGE variable.
+    Backends are imported lazily so the local ones work without firebase installed.
+    With mirror (default: EDMBANK_USER_MIRROR), lookups are served by a started
+    UserMirror instead of the cache; meant for teller and back-office processes.
+    """
+    backend = (backend or os.environ.get(STORAGE_ENV, "firestore")).lower()
+
+    if backend == "firestore":
+        from DataBase.DataBase import Database
+        db = Database(**options)
+    elif backend == "memory":
+        from DataBase.MemoryDatabase import MemoryDatabase
+        db = MemoryDatabase(**options)
+    elif backend == "sqlite":
+        from DataBase.SQLiteDatabase import SQLiteDatabase
+        options.setdefault("path", os.environ.get(SQLITE_PATH_ENV, DEFAULT_SQLITE_PATH))
+        db = SQLiteDatabase(**options)
+    else:
+        raise ValueError(f"Unknown storage backend '{backend}' (expected firestore, memory or sqlite).")
+
+    if mirror is None:
+        mirror = os.environ.get(USER_MIRROR_ENV, "0") == "1"
+    if cache_size is None:
+        cache_size = int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE))
+    if mirror:
+        from DataBase.UserMirror import UserMirror, DEFAULT_MAX_STALENESS
+        db.cache = UserMirror(db, max_staleness=float(os.environ.get(MIRROR_STALENESS_ENV, DEFAULT_MAX_STALENESS)))
+        db.cache.start()
+    elif cache_size > 0:
+        from DataBase.UserCache import UserCache
+        db.cache = UserCache(
+            max_size=cache_size,
+            ttl=float(os.environ.get(CACHE_TTL_ENV, DEFAULT_CACHE_TTL)),
+            negative_ttl=float(os.environ.get(CACHE_NEGATIVE_TTL_ENV, DEFAULT_CACHE_NEGATIVE_TTL))
+        )
+    return db
+
+def create_async_database(backend=None, cache_size=None, max_workers=None, mirror=None, **options):
+    """
+    Creates the asyncio variant of the storage chosen like in create_database:
+    AsyncDatabase (async Firestore client) for firestore, AsyncStorage around
+    the synchronous backend otherwise.
+    """
+    backend = (backend or os.environ.get(STORAGE_ENV, "firestore")).lower()
+    storage = create_database(backend, cache_size, mirror, **options)
+    if backend == "firestore":
+        from DataBase.AsyncDatabase import AsyncDatabase
+        return AsyncDatabase(storage, max_workers)
+    from DataBase.AsyncStorage import AsyncStorage
+    return AsyncStorage(storage, max_workers)
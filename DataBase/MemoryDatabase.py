@@ -0,0 +1,374 @@
+import bisect
+import copy
+import heapq
+import threading
+from user_management.user import User
+from user_management.request import Request
+from user_management.scheduled_payment import ScheduledPayment
+from user_management.payment_details import HISTORY_PAGE_SIZE, TransferResult
+from DataBase.Storage import Storage, LocalListeners
+from exceptions import *
+
+class MemoryDatabase(Storage):
+    """
+    In-process storage backend.
+    Keeps the user documents in a dict, useful for tests and local benchmarks.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.users: dict[str, dict] = {}
+        self.requests: dict[str, dict] = {}
+        # username -> ledger entries, the entry with Seq n is at index n - 1
+        self.ledgers: dict[str, list[dict]] = {}
+        # iban -> username, card number -> username (None while only reserved)
+        self.iban_index: dict[str, str] = {}
+        self.card_index: dict[int, str] = {}
+        # transfer key -> stored transfer record
+        self.transfers: dict[str, dict] = {}
+        # username -> month -> rollup
+        self.rollups: dict[str, dict[str, dict]] = {}
+        # username -> balance checkpoints, sorted by Seq
+        self.checkpoints: dict[str, list[dict]] = {}
+        # schedule id -> scheduled payment document
+        self.schedules: dict[str, dict] = {}
+        self.listeners = LocalListeners()
+
+    def add_user(self, user : User):
+        """Add a new user to the database."""
+        username = user.credentials.username
+        user_data = self._new_user_data(user)
+        with self._lock:
+            for index, key in ((self.card_index, user_data["Card_Number"]), (self.iban_index, user_data["Iban"])):
+                owner = index.get(key)
+                if owner is not None and owner != username:
+                    raise IdentifierInUseError(f"The card number or IBAN of '{username}' belongs to '{owner}'.")
+            self.users[username] = user_data
+            self.iban_index[user_data["Iban"]] = username
+            self.card_index[user_data["Card_Number"]] = username
+            self.ledgers[username] = []
+            self.rollups[username] = {}
+            self.checkpoints[username] = [self._opening_checkpoint(username, user_data["Sold"], user.payment_history.pending)]
+            self._append_ledger(username, user.payment_history)
+            user_data = copy.deepcopy(user_data)
+        self._invalidate(username)
+        self.listeners.notify(username, user_data)
+
+    def add_users_bulk(self, users):
+        with self._lock:
+            for user_data, payments in users:
+                username = user_data["Name"]
+                self.users[username] = dict(user_data, History_seq=len(payments))
+                self.iban_index[user_data["Iban"]] = username
+                self.card_index[user_data["Card_Number"]] = username
+                self.ledgers[username] = [self._ledger_entry(payment, seq) for seq, payment in enumerate(payments, start=1)]
+                self.rollups[username] = {}
+                self._add_rollups(username, payments)
+                self.checkpoints[username] = [self._opening_checkpoint(username, user_data["Sold"], payments)]
+        self._invalidate(*(user_data["Name"] for user_data, _ in users))
+
+    def checkUserLogin(self, username, Password):
+        with self._lock:
+            data = self.users.get(username)
+        if data is None:
+            return False
+        return self._check_password(Password, data.get("Password_hash"))
+
+    def delete_user(self, username):
+        """Delete the user from the database."""
+        with self._lock:
+            user_data = self.users.pop(username, None)
+            self.ledgers.pop(username, None)
+            self.rollups.pop(username, None)
+            self.checkpoints.pop(username, None)
+            if user_data is not None:
+                for index, key in ((self.iban_index, user_data.get("Iban")), (self.card_index, user_data.get("Card_Number"))):
+                    if index.get(key) == username:
+                        del index[key]
+        self._invalidate(username)
+        self.listeners.notify(username, None)
+
+    def modify_user(self, user : User):
+        """Update the modified user fields."""
+        username = user.credentials.username
+        fields, balance_delta = self._changed_fields(user)
+        with self._lock:
+            if username not in self.users:
+                raise AccountNotFoundError(f"Account '{username}' does not exist.")
+            user_data = self.users[username]
+            self._check_debit(username, user_data["Sold"], balance_delta)
+            for index, field in ((self.iban_index, "Iban"), (self.card_index, "Card_Number")):
+                if field in fields and fields[field] != user_data.get(field):
+                    if index.get(user_data.get(field)) == username:
+                        del index[user_data[field]]
+                    index[fields[field]] = username
+            user_data.update(fields)
+            if balance_delta is not None:
+                user_data["Sold"] += balance_delta
+            self._append_ledger(username, user.payment_history)
+            user_data = copy.deepcopy(user_data)
+        user.mark_clean()
+        self._invalidate(username)
+        self.listeners.notify(username, user_data)
+
+    def transfer(self, sender, receiver, amount, key=None) -> TransferResult:
+        """Moves money between two accounts under the database lock."""
+        if sender == receiver:
+            raise SameAccountError(f"Cannot transfer money from '{sender}' to itself.")
+        if key is not None:
+            self._check_transfer_key(key)
+        with self._lock:
+            if key in self.transfers:
+                return self._replay_transfer(key, self.transfers[key], sender, receiver, amount)
+            sender_data = self.users.get(sender)
+            receiver_data = self.users.get(receiver)
+            payment = self._check_transfer(sender, receiver, sender_data, receiver_data, amount)
+
+            for username, data, delta in ((sender, sender_data, -amount), (receiver, receiver_data, amount)):
+                ledger = self.ledgers[username]
+                ledger.append(self._ledger_entry(payment, len(ledger) + 1))
+                self._add_rollups(username, [payment])
+                data["Sold"] += delta
+                data["History_seq"] = len(ledger)
+
+            result = TransferResult(payment, sender_data["Sold"], receiver_data["Sold"])
+            if key is not None:
+                self.transfers[key] = self._transfer_record(sender, receiver, amount, result)
+            sender_data = copy.deepcopy(sender_data)
+            receiver_data = copy.deepcopy(receiver_data)
+        self._invalidate(sender, receiver)
+        self.listeners.notify(sender, sender_data)
+        self.listeners.notify(receiver, receiver_data)
+        return result
+
+    def transfer_batch(self, items) -> list:
+        """Commits the accepted transfers of the batch under the database lock."""
+        items = list(items)
+        if len(items) > self.transfer_batch_max:
+            raise ValueError(f"At most {self.transfer_batch_max} transfers per batch, got {len(items)}.")
+        usernames = {username for sender, receiver, _, _ in items for username in (sender, receiver)}
+        with self._lock:
+            # the plan runs on copies: the stored documents only change once it is complete
+            accounts = {username: dict(self.users[username]) for username in usernames if username in self.users}
+            records = {key: self.transfers[key] for _, _, _, key in items if key in self.transfers}
+            results, transfers = self._plan_batch(items, accounts, records)
+            payments = {}
+            for key, payment, sender_seq, receiver_seq in transfers:
+                for username, seq in ((payment.sender, sender_seq), (payment.receiver, receiver_seq)):
+                    self.ledgers[username].append(self._ledger_entry(payment, seq))
+                    payments.setdefault(username, []).append(payment)
+                if key is not None:
+                    self.transfers[key] = records[key]
+            changed = {}
+            for username, account_payments in payments.items():
+                self._add_rollups(username, account_payments)
+                self.users[username]["Sold"] = accounts[username]["Sold"]
+                self.users[username]["History_seq"] = accounts[username]["History_seq"]
+                changed[username] = copy.deepcopy(self.users[username])
+        self._invalidate(*changed)
+        for username, data in changed.items():
+            self.listeners.notify(username, data)
+        return results
+
+    def _append_ledger(self, username, history):
+        """Appends the pending payments; must be called with the lock held."""
+        ledger = self.ledgers[username]
+        for payment in history.pending:
+            ledger.append(self._ledger_entry(payment, len(ledger) + 1))
+        self._add_rollups(username, history.pending)
+        self.users[username]["History_seq"] = len(ledger)
+        history.mark_saved()
+
+    def _add_rollups(self, username, payments):
+        """Adds payments to the monthly rollups of the account; must be called with the lock held."""
+        rollups = self.rollups.setdefault(username, {})
+        for month, delta in self._rollup_deltas(username, payments).items():
+            rollup = rollups.setdefault(month, {"Month": month, "In": 0, "Out": 0, "Count": 0, "Counterparties": {}})
+            for field in ("In", "Out", "Count"):
+                rollup[field] += delta[field]
+            for counterparty, amount in delta["Counterparties"].items():
+                rollup["Counterparties"][counterparty] = rollup["Counterparties"].get(counterparty, 0) + amount
+
+    def listen_to_user(self, username, callback):
+        """Listen to changes on a user document."""
+        with self._lock:
+            data = copy.deepcopy(self.users.get(username))
+        return self.listeners.add(username, self._caching_callback(username, callback), data)
+
+    def listen_to_users(self, callback, usernames=None):
+        """Listen to changes on every user document, or on the given usernames."""
+        with self._lock:
+            names = self.users if usernames is None else [username for username in usernames if username in self.users]
+            documents = {username: copy.deepcopy(self.users[username]) for username in names}
+        return self.listeners.add_collection(callback, documents, usernames)
+
+    def _read_user(self, username):
+        with self._lock:
+            data = self.users.get(username)
+            return copy.deepcopy(data) if data is not None else None
+
+    def migrate_ledger_encoding(self) -> int:
+        converted = 0
+        with self._lock:
+            for ledger in self.ledgers.values():
+                for entry in ledger:
+                    if self._payload_outdated(entry["Payment"]):
+                        try:
+                            entry["Payment"] = self._pack_payment(self._unpack_payment(entry["Payment"]))
+                        except ValueError:
+                            continue
+                        converted += 1
+        return converted
+
+    def _read_users(self, usernames) -> dict:
+        with self._lock:
+            return {username: copy.deepcopy(self.users[username]) for username in usernames if username in self.users}
+
+    def _read_fields(self, username, fields) -> dict:
+        with self._lock:
+            data = self.users.get(username)
+            if data is None:
+                return None
+            return {field: copy.deepcopy(data[field]) for field in fields if field in data}
+
+    def get_history_page(self, username, limit=HISTORY_PAGE_SIZE, before=None):
+        with self._lock:
+            ledger = self.ledgers.get(username, [])
+            end = len(ledger) if before is None else max(before - 1, 0)
+            entries = ledger[max(end - limit, 0):end]
+        return self._entries_to_page(list(reversed(entries)), limit)
+
+    def _ledger_entries_after(self, username, after, limit) -> list:
+        with self._lock:
+            # seq n is stored at index n - 1
+            return list(self.ledgers.get(username, [])[after:after + limit])
+
+    def _ledger_entries_between(self, username, since, until, limit, cursor) -> list:
+        with self._lock:
+            # no index in memory: filter the account's ledger
+            entries = [entry for entry in self.ledgers.get(username, [])
+                       if entry.get("Created") is not None
+                       and (since is None or entry["Created"] >= since)
+                       and (until is None or entry["Created"] < until)
+                       and (cursor is None or (entry["Created"], entry["Seq"]) < cursor)]
+        entries.sort(key=lambda entry: (entry["Created"], entry["Seq"]), reverse=True)
+        return entries[:limit]
+
+    def _read_rollups(self, username, since, until) -> list:
+        with self._lock:
+            rollups = self.rollups.get(username, {})
+            return [copy.deepcopy(rollups[month]) for month in sorted(rollups)
+                    if (since is None or month >= since) and (until is None or month <= until)]
+
+    def _replace_rollups(self, username, rollups):
+        with self._lock:
+            self.rollups[username] = {month: dict(rollup, Month=month) for month, rollup in rollups.items()}
+
+    def _all_usernames(self) -> list:
+        with self._lock:
+            return list(self.users)
+
+    def _ledger_state(self, username):
+        with self._lock:
+            data = self.users.get(username)
+            return (data["Sold"], data.get("History_seq", 0)) if data is not None else None
+
+    def _read_checkpoint(self, username, seq):
+        with self._lock:
+            checkpoints = self.checkpoints.get(username, [])
+            index = bisect.bisect_right(checkpoints, seq, key=lambda checkpoint: checkpoint["Seq"])
+            return dict(checkpoints[index - 1]) if index else None
+
+    def _write_checkpoints(self, username, checkpoints):
+        with self._lock:
+            stored = {checkpoint["Seq"]: checkpoint for checkpoint in self.checkpoints.get(username, [])}
+            stored.update((checkpoint["Seq"], dict(checkpoint)) for checkpoint in checkpoints)
+            self.checkpoints[username] = [stored[seq] for seq in sorted(stored)]
+
+    def _lookup_iban(self, iban : str):
+        with self._lock:
+            return self.iban_index.get(iban)
+
+    def _lookup_card(self, card_number):
+        with self._lock:
+            return self.card_index.get(card_number)
+
+    def verify_iban_index(self) -> dict:
+        with self._lock:
+            owners = [(username, data.get("Iban")) for username, data in self.users.items()]
+            return self._index_report(owners, dict(self.iban_index))
+
+    def rebuild_iban_index(self) -> dict:
+        with self._lock:
+            report = self.verify_iban_index()
+            for iban in report["stale"]:
+                del self.iban_index[iban]
+            self.iban_index.update(report["missing"])
+        return report
+
+    def card_exists(self, card_number) -> bool:
+        """
+        Check if a card number is already used or reserved.
+        """
+        with self._lock:
+            return card_number in self.card_index
+
+    def reserve_identifiers(self, card_number, iban) -> bool:
+        with self._lock:
+            if card_number in self.card_index or iban in self.iban_index:
+                return False
+            self.card_index[card_number] = None
+            self.iban_index[iban] = None
+            return True
+
+    def release_identifiers(self, card_number, iban):
+        with self._lock:
+            if card_number in self.card_index and self.card_index[card_number] is None:
+                del self.card_index[card_number]
+            if iban in self.iban_index and self.iban_index[iban] is None:
+                del self.iban_index[iban]
+
+    def verify_card_index(self) -> dict:
+        with self._lock:
+            owners = [(username, data.get("Card_Number")) for username, data in self.users.items()]
+            return self._index_report(owners, dict(self.card_index))
+
+    def rebuild_card_index(self) -> dict:
+        with self._lock:
+            report = self.verify_card_index()
+            for card_number in report["stale"]:
+                del self.card_index[card_number]
+            self.card_index.update(report["missing"])
+        return report
+
+    def add_request(self, request : Request):
+        """
+        Adds a support request to the in-memory 'Requests' table.
+        """
+        with self._lock:
+            self.requests[request.request_id] = request.to_dict()
+
+    def save_schedules(self, schedules):
+        with self._lock:
+            for schedule in schedules:
+                self.schedules[schedule.schedule_id] = schedule.to_dict()
+
+    def delete_schedule(self, schedule_id):
+        with self._lock:
+            self.schedules.pop(schedule_id, None)
+
+    def get_schedules(self, username) -> list:
+        with self._lock:
+            documents = [data for data in self.schedules.values() if data["Sender"] == username]
+        return self._sort_schedules(map(ScheduledPayment.from_dict, documents))
+
+    def read_schedules(self, schedule_ids) -> dict:
+        with self._lock:
+            return {schedule_id: ScheduledPayment.from_dict(self.schedules[schedule_id])
+                    for schedule_id in schedule_ids if schedule_id in self.schedules}
+
+    def next_schedules(self, after=None, limit=1000) -> list:
+        with self._lock:
+            # no index in memory: the smallest keys of a scan
+            keys = ((data["Next_run"], schedule_id) for schedule_id, data in self.schedules.items()
+                    if data["Next_run"] is not None)
+            return heapq.nsmallest(limit, (key for key in keys if after is None or key > after))
@@ -0,0 +1,707 @@
+import json
+import sqlite3
+import msgpack
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from user_management.user import User
+from user_management.request import Request
+from user_management.scheduled_payment import ScheduledPayment
+from user_management.payment_details import HISTORY_PAGE_SIZE, TransferResult
+from user_management.money import BANI_PER_LEU
+from DataBase.Storage import Storage, LocalListeners, PAYMENT_FORMAT_VERSION
+from exceptions import *
+
+# usernames per "IN (...)" query, below SQLite's limit of bound parameters
+IN_QUERY_CHUNK = 500
+
+# column name -> Firestore field name
+USER_COLUMNS = {
+    "username": "Name",
+    "password_hash": "Password_hash",
+    "card_number": "Card_Number",
+    "cvv": "CVV",
+    "expiry_date": "Expiry_date",
+    "sold": "Sold",
+    "email": "Email",
+    "iban": "Iban",
+    "history_seq": "History_seq",
+}
+
+# amounts (sold, amount, balances, totals) are integer bani
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        password_hash TEXT NOT NULL,
+        card_number INTEGER,
+        cvv INTEGER,
+        expiry_date TEXT,
+        sold INTEGER NOT NULL DEFAULT 0,
+        email TEXT,
+        iban TEXT,
+        history_seq INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS users_card_number ON users(card_number);
+    CREATE UNIQUE INDEX IF NOT EXISTS users_iban ON users(iban);
+    CREATE TABLE IF NOT EXISTS ledger (
+        username TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        -- packed payload (BLOB), databases created earlier may still hold strings
+        payment BLOB NOT NULL,
+        -- commit time in microseconds since the epoch, NULL for entries older than it
+        created INTEGER,
+        PRIMARY KEY (username, seq)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS reserved_identifiers (
+        card_number INTEGER NOT NULL UNIQUE,
+        iban TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS transfers (
+        transfer_key TEXT PRIMARY KEY,
+        sender TEXT NOT NULL,
+        receiver TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        payment BLOB NOT NULL,
+        sender_balance INTEGER,
+        receiver_balance INTEGER,
+        created INTEGER
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS requests (
+        request_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    -- monthly totals of each account, month is "YYYY-MM" in UTC
+    CREATE TABLE IF NOT EXISTS rollups (
+        username TEXT NOT NULL,
+        month TEXT NOT NULL,
+        total_in INTEGER NOT NULL DEFAULT 0,
+        total_out INTEGER NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (username, month)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS rollup_counterparties (
+        username TEXT NOT NULL,
+        month TEXT NOT NULL,
+        counterparty TEXT NOT NULL,
+        amount INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (username, month, counterparty)
+    ) WITHOUT ROWID;
+    -- balance of an account right after its ledger entry seq, seq 0 is the opening balance
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        username TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        balance INTEGER NOT NULL,
+        created INTEGER,
+        PRIMARY KEY (username, seq)
+    ) WITHOUT ROWID;
+    -- scheduled payments, next_run in microseconds since the epoch (NULL once finished)
+    CREATE TABLE IF NOT EXISTS schedules (
+        schedule_id TEXT PRIMARY KEY,
+        sender TEXT NOT NULL,
+        next_run INTEGER,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS schedules_next_run ON schedules(next_run, schedule_id) WHERE next_run IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS schedules_sender ON schedules(sender)
+"""
+
+# PRAGMA user_version of SCHEMA; 1: amounts in integer bani instead of REAL lei
+SCHEMA_VERSION = 1
+# REAL lei columns of the tables created before SCHEMA_VERSION 1
+LEI_COLUMNS = {
+    "users": ["sold"],
+    "transfers": ["amount", "sender_balance", "receiver_balance"],
+    "rollups": ["total_in", "total_out"],
+    "rollup_counterparties": ["amount"],
+}
+
+# columns added after the first release: table -> [(column, declaration)]
+ADDED_COLUMNS = {
+    "ledger": [("created", "INTEGER")],
+    "transfers": [("created", "INTEGER")],
+}
+
+def _to_micros(date):
+    """Ledger dates are stored as integer microseconds since the epoch (UTC), so they sort and index."""
+    if date is None:
+        return None
+    delta = date.astimezone(timezone.utc) - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+def _from_micros(micros):
+    if micros is None:
+        return None
+    return datetime.fromtimestamp(micros // 1_000_000, timezone.utc).replace(microsecond=micros % 1_000_000)
+
+class SQLiteDatabase(Storage):
+    """
+    SQLite storage backend.
+    A single connection is shared between threads and guarded by a lock;
+    pass ":memory:" as path for a throwaway database.
+    """
+    def __init__(self, path="edmbank.sqlite3"):
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # other processes writing the same file: wait for their lock instead of failing
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.listeners = LocalListeners()
+        self.init_dadabase()
+
+    def init_dadabase(self):
+        with self._lock, self._transaction():
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            # files from before amounts were integer bani: the tables holding lei are
+            # recreated with INTEGER columns and their rows copied in bani
+            lei_tables = [table for table in LEI_COLUMNS if table in tables] if version < SCHEMA_VERSION else []
+            for table in lei_tables:
+                indexes = self.conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                    (table,)).fetchall()
+                for (index,) in indexes:
+                    self.conn.execute(f"DROP INDEX {index}")
+                self.conn.execute(f"ALTER TABLE {table} RENAME TO {table}_lei")
+
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    self.conn.execute(statement)
+            for table, columns in ADDED_COLUMNS.items():
+                existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+                for column, declaration in columns:
+                    if column not in existing:
+                        self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+            for table in lei_tables:
+                columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table}_lei)")]
+                values = [f"CAST(ROUND({column} * {BANI_PER_LEU}) AS INTEGER)" if column in LEI_COLUMNS[table] else column
+                          for column in columns]
+                self.conn.execute(f"INSERT INTO {table} ({', '.join(columns)}) "
+                                  f"SELECT {', '.join(values)} FROM {table}_lei")
+                self.conn.execute(f"DROP TABLE {table}_lei")
+            if version < SCHEMA_VERSION:
+                self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            # date range queries of get_history
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ledger_created ON ledger(username, created, seq)")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _data_to_row(self, data):
+        return {column: data[field] for column, field in USER_COLUMNS.items() if field in data}
+
+    def _row_to_data(self, row):
+        return {field: row[index] for index, field in enumerate(USER_COLUMNS.values())}
+
+    def _select_user(self, where, value):
+        columns = ", ".join(USER_COLUMNS)
+        with self._lock:
+            row = self.conn.execute(f"SELECT {columns} FROM users WHERE {where} = ?", (value,)).fetchone()
+        return self._row_to_data(row) if row is not None else None
+
+    def add_user(self, user : User):
+        """Add a new user to the database."""
+        user_data = self._new_user_data(user)
+        row = self._data_to_row(user_data)
+        columns = ", ".join(row)
+        placeholders = ", ".join(f":{column}" for column in row)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in row if column != "username")
+        with self._lock, self._transaction():
+            owner = self.conn.execute("SELECT username FROM users WHERE (card_number = ? OR iban = ?) AND username != ?",
+                                      (row["card_number"], row["iban"], row["username"])).fetchone()
+            if owner is not None:
+                raise IdentifierInUseError(f"The card number or IBAN of '{row['username']}' belongs to '{owner[0]}'.")
+            self.conn.execute("DELETE FROM ledger WHERE username = ?", (row["username"],))
+            self._delete_rollups(row["username"])
+            self.conn.execute("DELETE FROM checkpoints WHERE username = ?", (row["username"],))
+            self._insert_checkpoints(row["username"], [
+                self._opening_checkpoint(row["username"], row["sold"], user.payment_history.pending)])
+            # the row itself keeps the identifiers unique from now on
+            self.conn.execute("DELETE FROM reserved_identifiers WHERE card_number = ? OR iban = ?",
+                              (row["card_number"], row["iban"]))
+            # re-adding a username replaces its row in place
+            self.conn.execute(f"INSERT INTO users ({columns}) VALUES ({placeholders}) "
+                              f"ON CONFLICT(username) DO UPDATE SET {updates}", row)
+            user_data["History_seq"] = self._append_ledger(row["username"], user.payment_history)
+        self._invalidate(user.credentials.username)
+        self.listeners.notify(user.credentials.username, user_data)
+
+    def add_users_bulk(self, users):
+        rows = [self._data_to_row(dict(user_data, History_seq=len(payments))) for user_data, payments in users]
+        ledger = [(user_data["Name"], entry["Seq"], entry["Payment"], _to_micros(entry["Created"]))
+                  for user_data, payments in users
+                  for entry in (self._ledger_entry(payment, seq) for seq, payment in enumerate(payments, start=1))]
+        columns = ", ".join(rows[0]) if rows else ""
+        placeholders = ", ".join(f":{column}" for column in rows[0]) if rows else ""
+        with self._lock, self._transaction():
+            # plain INSERT: a duplicate username, card number or IBAN aborts the whole batch
+            self.conn.executemany(f"INSERT INTO users ({columns}) VALUES ({placeholders})", rows)
+            self.conn.executemany("INSERT INTO ledger (username, seq, payment, created) VALUES (?, ?, ?, ?)", ledger)
+            for user_data, payments in users:
+                self._add_rollups(user_data["Name"], payments)
+                self._insert_checkpoints(user_data["Name"], [
+                    self._opening_checkpoint(user_data["Name"], user_data["Sold"], payments)])
+        self._invalidate(*(user_data["Name"] for user_data, _ in users))
+
+    def checkUserLogin(self, username, Password):
+        data = self._select_user("username", username)
+        if data is None:
+            return False
+        return self._check_password(Password, data.get("Password_hash"))
+
+    def delete_user(self, username):
+        """Delete the user from the database."""
+        with self._lock, self._transaction():
+            self.conn.execute("DELETE FROM ledger WHERE username = ?", (username,))
+            self._delete_rollups(username)
+            self.conn.execute("DELETE FROM checkpoints WHERE username = ?", (username,))
+            self.conn.execute("DELETE FROM users WHERE username = ?", (username,))
+        self._invalidate(username)
+        self.listeners.notify(username, None)
+
+    def modify_user(self, user : User):
+        """Update the modified user fields."""
+        username = user.credentials.username
+        fields, balance_delta = self._changed_fields(user)
+        row = self._data_to_row(fields)
+        assignments = [f"{column} = :{column}" for column in row if column != "username"]
+        if balance_delta is not None:
+            assignments.append("sold = sold + :balance_delta")
+            row["balance_delta"] = balance_delta
+        row["username"] = username
+        with self._lock, self._transaction():
+            if balance_delta is not None and balance_delta < 0:
+                # read under the write lock, the update below cannot be preceded by another one
+                stored = self.conn.execute("SELECT sold FROM users WHERE username = ?", (username,)).fetchone()
+                if stored is None:
+                    raise AccountNotFoundError(f"Account '{username}' does not exist.")
+                self._check_debit(username, stored[0], balance_delta)
+            if assignments:
+                self.conn.execute(f"UPDATE users SET {', '.join(assignments)} WHERE username = :username", row)
+            self._append_ledger(username, user.payment_history)
+            user_data = self._select_user("username", username)
+        user.mark_clean()
+        self._invalidate(username)
+        self.listeners.notify(username, user_data)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs the block in a write transaction; must be entered with the lock held.
+        Raises TransientStorageError if another process kept the database locked.
+        """
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as error:
+            raise TransientStorageError(f"Database is busy: {error}") from error
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        try:
+            self.conn.execute("COMMIT")
+        except sqlite3.OperationalError as error:
+            self.conn.execute("ROLLBACK")
+            raise TransientStorageError(f"Database is busy: {error}") from error
+
+    def _append_ledger(self, username, history):
+        """
+        Appends the pending payments and returns the new History_seq.
+        Must be called inside a transaction.
+        """
+        row = self.conn.execute("SELECT history_seq FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            raise AccountNotFoundError(f"Account '{username}' does not exist.")
+        seq = row[0]
+        if history.pending:
+            entries = [self._ledger_entry(payment, seq + index + 1) for index, payment in enumerate(history.pending)]
+            self.conn.executemany("INSERT INTO ledger (username, seq, payment, created) VALUES (?, ?, ?, ?)",
+                                  [(username, entry["Seq"], entry["Payment"], _to_micros(entry["Created"]))
+                                   for entry in entries])
+            self._add_rollups(username, history.pending)
+            seq += len(entries)
+            self.conn.execute("UPDATE users SET history_seq = ? WHERE username = ?", (seq, username))
+        history.mark_saved()
+        return seq
+
+    def _add_rollups(self, username, payments):
+        """Adds payments to the monthly rollups of the account. Must be called inside a transaction."""
+        deltas = self._rollup_deltas(username, payments)
+        self.conn.executemany(
+            "INSERT INTO rollups (username, month, total_in, total_out, count) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (username, month) DO UPDATE SET total_in = total_in + excluded.total_in, "
+            "total_out = total_out + excluded.total_out, count = count + excluded.count",
+            [(username, month, delta["In"], delta["Out"], delta["Count"]) for month, delta in deltas.items()])
+        self.conn.executemany(
+            "INSERT INTO rollup_counterparties (username, month, counterparty, amount) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (username, month, counterparty) DO UPDATE SET amount = amount + excluded.amount",
+            [(username, month, counterparty, amount)
+             for month, delta in deltas.items() for counterparty, amount in delta["Counterparties"].items()])
+
+    def _delete_rollups(self, username):
+        self.conn.execute("DELETE FROM rollups WHERE username = ?", (username,))
+        self.conn.execute("DELETE FROM rollup_counterparties WHERE username = ?", (username,))
+
+    def transfer(self, sender, receiver, amount, key=None) -> TransferResult:
+        """Moves money between two accounts in a single SQLite transaction."""
+        if sender == receiver:
+            raise SameAccountError(f"Cannot transfer money from '{sender}' to itself.")
+        if key is not None:
+            self._check_transfer_key(key)
+        with self._lock, self._transaction():
+            if key is not None:
+                row = self.conn.execute(
+                    "SELECT sender, receiver, amount, payment, sender_balance, receiver_balance, created "
+                    "FROM transfers WHERE transfer_key = ?", (key,)).fetchone()
+                if row is not None:
+                    record = dict(zip(("Sender", "Receiver", "Amount", "Payment", "Sender_balance", "Receiver_balance"), row))
+                    record["Created"] = _from_micros(row[6])
+                    return self._replay_transfer(key, record, sender, receiver, amount)
+            sender_data = self._select_user("username", sender)
+            receiver_data = self._select_user("username", receiver)
+            payment = self._check_transfer(sender, receiver, sender_data, receiver_data, amount)
+
+            for username, data, delta in ((sender, sender_data, -amount), (receiver, receiver_data, amount)):
+                data["Sold"] += delta
+                data["History_seq"] += 1
+                entry = self._ledger_entry(payment, data["History_seq"])
+                self.conn.execute("INSERT INTO ledger (username, seq, payment, created) VALUES (?, ?, ?, ?)",
+                                  (username, entry["Seq"], entry["Payment"], _to_micros(entry["Created"])))
+                self._add_rollups(username, [payment])
+                self.conn.execute("UPDATE users SET sold = ?, history_seq = ? WHERE username = ?",
+                                  (data["Sold"], data["History_seq"], username))
+            result = TransferResult(payment, sender_data["Sold"], receiver_data["Sold"])
+            if key is not None:
+                record = self._transfer_record(sender, receiver, amount, result)
+                self.conn.execute("INSERT INTO transfers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  (key, sender, receiver, amount, record["Payment"],
+                                   record["Sender_balance"], record["Receiver_balance"], _to_micros(record["Created"])))
+        self._invalidate(sender, receiver)
+        self.listeners.notify(sender, sender_data)
+        self.listeners.notify(receiver, receiver_data)
+        return result
+
+    def transfer_batch(self, items) -> list:
+        """Commits the accepted transfers of the batch in a single SQLite transaction."""
+        items = list(items)
+        if len(items) > self.transfer_batch_max:
+            raise ValueError(f"At most {self.transfer_batch_max} transfers per batch, got {len(items)}.")
+        usernames = {username for sender, receiver, _, _ in items for username in (sender, receiver)}
+        keys = list({key for _, _, _, key in items if isinstance(key, str)})
+        with self._lock, self._transaction():
+            accounts = self._read_users(usernames)
+            records = {}
+            for start in range(0, len(keys), IN_QUERY_CHUNK):
+                chunk = keys[start:start + IN_QUERY_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows = self.conn.execute(
+                    "SELECT transfer_key, sender, receiver, amount, payment, sender_balance, receiver_balance, created "
+                    f"FROM transfers WHERE transfer_key IN ({placeholders})", chunk).fetchall()
+                for row in rows:
+                    records[row[0]] = dict(zip(("Sender", "Receiver", "Amount", "Payment", "Sender_balance", "Receiver_balance"), row[1:7]))
+                    records[row[0]]["Created"] = _from_micros(row[7])
+            results, transfers = self._plan_batch(items, accounts, records)
+            ledger = []
+            payments = {}
+            for key, payment, sender_seq, receiver_seq in transfers:
+                for username, seq in ((payment.sender, sender_seq), (payment.receiver, receiver_seq)):
+                    entry = self._ledger_entry(payment, seq)
+                    ledger.append((username, seq, entry["Payment"], _to_micros(entry["Created"])))
+                    payments.setdefault(username, []).append(payment)
+            self.conn.executemany("INSERT INTO ledger (username, seq, payment, created) VALUES (?, ?, ?, ?)", ledger)
+            for username, account_payments in payments.items():
+                self._add_rollups(username, account_payments)
+            self.conn.executemany("UPDATE users SET sold = ?, history_seq = ? WHERE username = ?",
+                                  [(accounts[username]["Sold"], accounts[username]["History_seq"], username) for username in payments])
+            self.conn.executemany("INSERT INTO transfers VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+                (key, record["Sender"], record["Receiver"], record["Amount"], record["Payment"],
+                 record["Sender_balance"], record["Receiver_balance"], _to_micros(record["Created"]))
+                for key, record in ((key, records[key]) for key, _, _, _ in transfers if key is not None)])
+        self._invalidate(*payments)
+        for username in payments:
+            self.listeners.notify(username, accounts[username])
+        return results
+
+    def listen_to_user(self, username, callback):
+        """Listen to changes on a user document."""
+        return self.listeners.add(username, self._caching_callback(username, callback),
+                                  self._select_user("username", username))
+
+    def listen_to_users(self, callback, usernames=None):
+        """Listen to changes on every user document, or on the given usernames."""
+        if usernames is None:
+            columns = ", ".join(USER_COLUMNS)
+            with self._lock:
+                rows = self.conn.execute(f"SELECT {columns} FROM users").fetchall()
+            documents = {data["Name"]: data for data in map(self._row_to_data, rows)}
+        else:
+            documents = self._read_users(usernames)
+        return self.listeners.add_collection(callback, documents, usernames)
+
+    def _read_user(self, username):
+        return self._select_user("username", username)
+
+    def migrate_ledger_encoding(self) -> int:
+        with self._lock, self._transaction():
+            return self._repack_ledger()
+
+    def _repack_ledger(self) -> int:
+        """Rewrites the outdated ledger payloads; must be called inside a transaction."""
+        # current payloads start with the msgpack header of a 4 item array and the version
+        prefix = msgpack.packb([PAYMENT_FORMAT_VERSION, "", 0, ""])[:2]
+        rows = self.conn.execute(
+            "SELECT username, seq, payment FROM ledger WHERE typeof(payment) = 'text' OR substr(payment, 1, 2) != ?",
+            (prefix,)).fetchall()
+        converted = []
+        for username, seq, payment in rows:
+            try:
+                converted.append((self._pack_payment(self._unpack_payment(payment)), username, seq))
+            except ValueError:
+                continue
+        self.conn.executemany("UPDATE ledger SET payment = ? WHERE username = ? AND seq = ?", converted)
+        return len(converted)
+
+    def _read_users(self, usernames) -> dict:
+        columns = ", ".join(USER_COLUMNS)
+        usernames = list(usernames)
+        found = {}
+        with self._lock:
+            for start in range(0, len(usernames), IN_QUERY_CHUNK):
+                chunk = usernames[start:start + IN_QUERY_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows = self.conn.execute(f"SELECT {columns} FROM users WHERE username IN ({placeholders})", chunk).fetchall()
+                for row in rows:
+                    data = self._row_to_data(row)
+                    found[data["Name"]] = data
+        return found
+
+    def _read_fields(self, username, fields) -> dict:
+        columns = {field: column for column, field in USER_COLUMNS.items()}
+        selected = [field for field in fields if field in columns] or ["Name"]
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(columns[field] for field in selected)} FROM users WHERE username = ?",
+                (username,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(selected, row))
+
+    def _rows_to_entries(self, rows):
+        return [{"Seq": seq, "Payment": payment, "Created": _from_micros(created)} for seq, payment, created in rows]
+
+    def get_history_page(self, username, limit=HISTORY_PAGE_SIZE, before=None):
+        with self._lock:
+            if before is None:
+                rows = self.conn.execute(
+                    "SELECT seq, payment, created FROM ledger WHERE username = ? ORDER BY seq DESC LIMIT ?",
+                    (username, limit)).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT seq, payment, created FROM ledger WHERE username = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                    (username, before, limit)).fetchall()
+        return self._entries_to_page(self._rows_to_entries(rows), limit)
+
+    def _ledger_entries_after(self, username, after, limit) -> list:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT seq, payment, created FROM ledger WHERE username = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (username, after, limit)).fetchall()
+        return self._rows_to_entries(rows)
+
+    def _ledger_entries_between(self, username, since, until, limit, cursor) -> list:
+        conditions = ["username = ?", "created IS NOT NULL"]
+        parameters = [username]
+        if since is not None:
+            conditions.append("created >= ?")
+            parameters.append(_to_micros(since))
+        if until is not None:
+            conditions.append("created < ?")
+            parameters.append(_to_micros(until))
+        if cursor is not None:
+            conditions.append("(created, seq) < (?, ?)")
+            parameters.extend((_to_micros(cursor[0]), cursor[1]))
+        with self._lock:
+            # served by the ledger_created index
+            rows = self.conn.execute(
+                f"SELECT seq, payment, created FROM ledger WHERE {' AND '.join(conditions)} "
+                "ORDER BY created DESC, seq DESC LIMIT ?", parameters + [limit]).fetchall()
+        return self._rows_to_entries(rows)
+
+    def _read_rollups(self, username, since, until) -> list:
+        bounds = (username, since or "", until or "9999-99")
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT month, total_in, total_out, count FROM rollups "
+                "WHERE username = ? AND month BETWEEN ? AND ? ORDER BY month", bounds).fetchall()
+            counterparties = self.conn.execute(
+                "SELECT month, counterparty, amount FROM rollup_counterparties "
+                "WHERE username = ? AND month BETWEEN ? AND ?", bounds).fetchall()
+        rollups = {month: {"Month": month, "In": total_in, "Out": total_out, "Count": count, "Counterparties": {}}
+                   for month, total_in, total_out, count in rows}
+        for month, counterparty, amount in counterparties:
+            if month in rollups:
+                rollups[month]["Counterparties"][counterparty] = amount
+        return list(rollups.values())
+
+    def _replace_rollups(self, username, rollups):
+        with self._lock, self._transaction():
+            self._delete_rollups(username)
+            self.conn.executemany(
+                "INSERT INTO rollups (username, month, total_in, total_out, count) VALUES (?, ?, ?, ?, ?)",
+                [(username, month, rollup["In"], rollup["Out"], rollup["Count"]) for month, rollup in rollups.items()])
+            self.conn.executemany(
+                "INSERT INTO rollup_counterparties (username, month, counterparty, amount) VALUES (?, ?, ?, ?)",
+                [(username, month, counterparty, amount)
+                 for month, rollup in rollups.items() for counterparty, amount in rollup["Counterparties"].items()])
+
+    def _all_usernames(self) -> list:
+        with self._lock:
+            return [row[0] for row in self.conn.execute("SELECT username FROM users")]
+
+    def _ledger_state(self, username):
+        with self._lock:
+            row = self.conn.execute("SELECT sold, history_seq FROM users WHERE username = ?", (username,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def _read_checkpoint(self, username, seq):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT seq, balance, created FROM checkpoints WHERE username = ? AND seq <= ? ORDER BY seq DESC LIMIT 1",
+                (username, seq)).fetchone()
+        if row is None:
+            return None
+        return {"Seq": row[0], "Balance": row[1], "Created": _from_micros(row[2])}
+
+    def _write_checkpoints(self, username, checkpoints):
+        with self._lock, self._transaction():
+            self._insert_checkpoints(username, checkpoints)
+
+    def _insert_checkpoints(self, username, checkpoints):
+        """Must be called inside a transaction."""
+        self.conn.executemany("INSERT OR REPLACE INTO checkpoints (username, seq, balance, created) VALUES (?, ?, ?, ?)",
+                              [(username, checkpoint["Seq"], checkpoint["Balance"], _to_micros(checkpoint["Created"]))
+                               for checkpoint in checkpoints])
+
+    def _lookup_iban(self, iban : str):
+        # served by the users_iban index, which SQLite keeps in the same transaction as the row
+        with self._lock:
+            row = self.conn.execute("SELECT username FROM users WHERE iban = ?", (iban,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _lookup_card(self, card_number):
+        # served by the users_card_number index
+        with self._lock:
+            row = self.conn.execute("SELECT username FROM users WHERE card_number = ?", (card_number,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _verify_index(self, column, index_name) -> dict:
+        """
+        Compares what the unique index returns with a scan of the table: an entry
+        missing from a damaged index, or pointing at the wrong row, shows up in the report.
+        """
+        with self._lock:
+            owners = self.conn.execute(f"SELECT username, {column} FROM users NOT INDEXED").fetchall()
+            index = {key: username for key, username in self.conn.execute(
+                f"SELECT {column}, username FROM users INDEXED BY {index_name} WHERE {column} IS NOT NULL")}
+            for (key,) in self.conn.execute(f"SELECT {column} FROM reserved_identifiers"):
+                index.setdefault(key, None)
+        return self._index_report(owners, index)
+
+    def verify_iban_index(self) -> dict:
+        return self._verify_index("iban", "users_iban")
+
+    def rebuild_iban_index(self) -> dict:
+        report = self.verify_iban_index()
+        with self._lock:
+            self.conn.execute("REINDEX users_iban")
+        return report
+
+    def verify_card_index(self) -> dict:
+        return self._verify_index("card_number", "users_card_number")
+
+    def rebuild_card_index(self) -> dict:
+        report = self.verify_card_index()
+        with self._lock:
+            self.conn.execute("REINDEX users_card_number")
+        return report
+
+    def card_exists(self, card_number) -> bool:
+        """
+        Check if a card number is already used or reserved.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM users WHERE card_number = ? UNION ALL SELECT 1 FROM reserved_identifiers WHERE card_number = ?",
+                (card_number, card_number)).fetchone()
+        return row is not None
+
+    def reserve_identifiers(self, card_number, iban) -> bool:
+        with self._lock, self._transaction():
+            taken = self.conn.execute(
+                "SELECT 1 FROM users WHERE card_number = ? OR iban = ? "
+                "UNION ALL SELECT 1 FROM reserved_identifiers WHERE card_number = ? OR iban = ?",
+                (card_number, iban, card_number, iban)).fetchone()
+            if taken is not None:
+                return False
+            self.conn.execute("INSERT INTO reserved_identifiers (card_number, iban) VALUES (?, ?)", (card_number, iban))
+        return True
+
+    def release_identifiers(self, card_number, iban):
+        with self._lock:
+            self.conn.execute("DELETE FROM reserved_identifiers WHERE card_number = ? AND iban = ?", (card_number, iban))
+
+    def add_request(self, request : Request):
+        """
+        Adds a support request to the 'requests' table.
+        """
+        try:
+            with self._lock:
+                self.conn.execute("INSERT OR REPLACE INTO requests (request_id, data) VALUES (?, ?)",
+                                  (request.request_id, json.dumps(request.to_dict())))
+        except sqlite3.Error as e:
+            raise RequestError(f"Failed to add request to database: {e}")
+
+    def save_schedules(self, schedules):
+        rows = []
+        for schedule in schedules:
+            data = schedule.to_dict()
+            rows.append((schedule.schedule_id, schedule.sender, _to_micros(data["Next_run"]),
+                         json.dumps(dict(data, First_run=data["First_run"].isoformat(), Next_run=None))))
+        with self._lock, self._transaction():
+            self.conn.executemany("INSERT OR REPLACE INTO schedules (schedule_id, sender, next_run, data) VALUES (?, ?, ?, ?)", rows)
+
+    def delete_schedule(self, schedule_id):
+        with self._lock:
+            self.conn.execute("DELETE FROM schedules WHERE schedule_id = ?", (schedule_id,))
+
+    def get_schedules(self, username) -> list:
+        with self._lock:
+            rows = self.conn.execute("SELECT data FROM schedules WHERE sender = ?", (username,)).fetchall()
+        return self._sort_schedules(ScheduledPayment.from_dict(json.loads(row[0])) for row in rows)
+
+    def read_schedules(self, schedule_ids) -> dict:
+        schedule_ids = list(schedule_ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(schedule_ids), IN_QUERY_CHUNK):
+                chunk = schedule_ids[start:start + IN_QUERY_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows = self.conn.execute(f"SELECT data FROM schedules WHERE schedule_id IN ({placeholders})", chunk).fetchall()
+                for row in rows:
+                    schedule = ScheduledPayment.from_dict(json.loads(row[0]))
+                    found[schedule.schedule_id] = schedule
+        return found
+
+    def next_schedules(self, after=None, limit=1000) -> list:
+        # Next_run is derived from the other fields, the data column does not keep it
+        query, parameters = "next_run IS NOT NULL", ()
+        if after is not None:
+            query, parameters = query + " AND (next_run, schedule_id) > (?, ?)", (_to_micros(after[0]), after[1])
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT next_run, schedule_id FROM schedules WHERE {query} ORDER BY next_run, schedule_id LIMIT ?",
+                parameters + (limit,)).fetchall()
+        return [(_from_micros(next_run), schedule_id) for next_run, schedule_id in rows]
@@ -0,0 +1,1070 @@
+import threading
+from abc import ABC, abstractmethod
+from enum import Enum
+from datetime import datetime, timezone
+import msgpack
+from user_management.user import User
+from user_management.credit_card import Card
+from user_management.user_credentials import UserCredentials
+from user_management.payment_details import PaymentsHistory, HISTORY_PAGE_SIZE
+from user_management.payment_details import Payment, TransferResult
+from user_management.request import Request
+from user_management.scheduled_payment import ScheduledPayment
+from user_management.money import to_bani, to_lei, check_amount, format_bani
+from DataBase.UserCache import NOT_CACHED
+from exceptions import *
+
+# tracked attribute -> stored field
+CREDENTIALS_FIELDS = {"username": "Name", "password": "Password_hash", "email": "Email"}
+CARD_FIELDS = {"number": "Card_Number", "cvv": "CVV", "expiry_date": "Expiry_date", "IBAN": "Iban"}
+# version tag stored in every packed ledger payload, see _pack_payment
+# 1: amount in lei as a float, 2: amount in integer bani
+PAYMENT_FORMAT_VERSION = 2
+
+# fields of a user document that can be projected with get_fields
+USER_FIELDS = ("Name", "Password_hash", "Card_Number", "CVV", "Expiry_date", "Sold", "Email", "Iban", "History_seq", "Shards")
+# usernames per listen_to_users stream (Firestore's limit for an "in" filter)
+LISTEN_USERS_MAX = 30
+# ledger entries read per query by backfill_rollups and the checkpoint scans
+ROLLUP_BACKFILL_PAGE = 500
+# ledger entries between two balance checkpoints written by compact_ledger: the
+# most entries replayed by get_balance_at and audit_balances once compacted
+CHECKPOINT_INTERVAL = 500
+
+class Storage(ABC):
+    """
+    Storage interface used by BankService.
+    Every backend (Firestore, in-memory, SQLite) stores users with the same
+    field names ("Name", "Sold", "Iban", ...) so the conversion helpers below
+    are shared between them.
+    """
+
+    # optional UserCache in front of get_user / get_user_by_iban
+    cache = None
+    # most items committed by one transfer_batch call
+    transfer_batch_max = 500
+
+    def warm_up(self):
+        """Prepares the connection in the background; nothing to do for local backends."""
+
+    def set_balance_shards(self, username, shards):
+        """
+        Spreads the balance of a busy account over shard counters (0 turns it off).
+        Only Firestore limits the write rate of a document, the local backends ignore it.
+        """
+
+    # ------------------------------------------------------------------
+    # conversion helpers
+
+    def _encode_payment(self, payment : Payment) -> str:
+        """Legacy "a -> amount -> b" string, with the amount in lei."""
+        return f"{payment.sender} -> {to_lei(payment.amount)} -> {payment.receiver}"
+
+    def _decode_payment(self, sentence : str) -> Payment:
+        """Raises ValueError for malformed entries."""
+        sender, amount, receiver = sentence.split(" -> ")
+        return Payment(
+            amount = to_bani(amount),
+            sender = sender,
+            receiver = receiver
+        )
+
+    def _pack_payment(self, payment : Payment) -> bytes:
+        """
+        Compact ledger payload: msgpack of [version, sender, amount in bani, receiver].
+        Usernames are stored as they are.
+        """
+        return msgpack.packb([PAYMENT_FORMAT_VERSION, payment.sender, payment.amount, payment.receiver])
+
+    def _unpack_payment(self, payload) -> Payment:
+        """
+        Decodes a packed payload (either version) or a legacy "a -> amount -> b" string.
+        Raises ValueError for malformed entries.
+        """
+        if isinstance(payload, str):
+            return self._decode_payment(payload)
+        try:
+            version, sender, amount, receiver = msgpack.unpackb(payload)
+        except (msgpack.UnpackException, ValueError, TypeError) as error:
+            raise ValueError(f"Malformed ledger payload: {error}") from error
+        if version == 1:
+            amount = to_bani(amount)
+        elif version != PAYMENT_FORMAT_VERSION or not isinstance(amount, int):
+            raise ValueError(f"Unsupported ledger payload version {version}")
+        return Payment(amount=amount, sender=sender, receiver=receiver)
+
+    def _payload_outdated(self, payload) -> bool:
+        """True for the payloads migrate_ledger_encoding rewrites: strings and older versions."""
+        if isinstance(payload, str):
+            return True
+        try:
+            return msgpack.unpackb(payload)[0] != PAYMENT_FORMAT_VERSION
+        except (msgpack.UnpackException, ValueError, TypeError, IndexError):
+            return False
+
+    def history_to_databse_format(self, history : PaymentsHistory):
+        return [self._pack_payment(payment) for payment in history.history]
+
+    def database_to_class_format(self, history_sentence : list) -> PaymentsHistory:
+        history = PaymentsHistory()
+        for sentence in history_sentence:
+            try:
+                history.add_payment(self._unpack_payment(sentence))
+            except ValueError:
+                continue
+        history.mark_saved()
+        return history
+
+    def _timestamp(self):
+        """Commit time stamped on new ledger entries; Firestore uses its server timestamp."""
+        return datetime.now(timezone.utc)
+
+    def _utc(self, date : datetime) -> datetime:
+        """Naive datetimes are taken as local time, like datetime.now()."""
+        return date.astimezone(timezone.utc) if date is not None else None
+
+    def _ledger_entry(self, payment : Payment, seq : int):
+        """
+        Builds a ledger entry; seq numbers the payments of an account starting at 1.
+        Created is stored next to the payload so it can be indexed for date ranges.
+        """
+        return {
+            "Seq" : seq,
+            "Created" : payment.date if payment.date is not None else self._timestamp(),
+            "Payment" : self._pack_payment(payment)
+        }
+
+    def _entry_to_payment(self, entry) -> Payment:
+        """Decodes a ledger entry with its date and seq. Raises ValueError for malformed entries."""
+        payment = self._unpack_payment(entry["Payment"])
+        payment.date = entry.get("Created")
+        payment.seq = entry.get("Seq")
+        return payment
+
+    def _entries_to_page(self, entries, limit, cursor=lambda entry: entry["Seq"]):
+        """
+        Converts ledger entries (newest first) to a history page.
+        Returns (payments oldest first, cursor of the next older page or None).
+        """
+        payments = []
+        for entry in reversed(entries):
+            try:
+                payments.append(self._entry_to_payment(entry))
+            except ValueError:
+                continue
+        next_cursor = cursor(entries[-1]) if len(entries) == limit else None
+        return payments, next_cursor
+
+    def get_history(self, username, since=None, until=None, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """
+        Returns a page of the payments committed in [since, until), newest page
+        first, as (payments oldest first, cursor of the next older page or None).
+        The range is answered from the index on (Created, Seq), so only the page is read.
+        Ledger entries written before payments were timestamped are not included.
+        """
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+        entries = self._ledger_entries_between(username, self._utc(since), self._utc(until), limit, cursor)
+        return self._entries_to_page(entries, limit, cursor=lambda entry: (entry["Created"], entry["Seq"]))
+
+    def _rollup_month(self, date) -> str:
+        """Month of a payment as "YYYY-MM" in UTC; not committed yet (no date) means the current month."""
+        if not isinstance(date, datetime):
+            date = datetime.now(timezone.utc)
+        return self._utc(date).strftime("%Y-%m")
+
+    def _rollup_deltas(self, username, payments) -> dict:
+        """
+        Groups payments of an account into monthly rollup increments:
+        {month: {"In", "Out", "Count", "Counterparties": {name: amount}}}.
+        """
+        deltas = {}
+        for payment in payments:
+            rollup = deltas.setdefault(self._rollup_month(payment.date),
+                                       {"In": 0, "Out": 0, "Count": 0, "Counterparties": {}})
+            if payment.receiver == username:
+                rollup["In"] += payment.amount
+                counterparty = payment.sender
+            else:
+                rollup["Out"] += payment.amount
+                counterparty = payment.receiver
+            rollup["Count"] += 1
+            rollup["Counterparties"][counterparty] = rollup["Counterparties"].get(counterparty, 0) + payment.amount
+        return deltas
+
+    def get_rollups(self, username, since=None, until=None) -> list:
+        """
+        Returns the monthly rollups of an account from month since to month until
+        ("YYYY-MM", both included, either may be None), oldest first, as dicts with
+        Month, In, Out, Count and Counterparties (name -> amount exchanged).
+        One record is read per month, whatever the number of payments.
+        """
+        return self._read_rollups(username, since, until)
+
+    def backfill_rollups(self, usernames=None) -> dict:
+        """
+        Rebuilds the monthly rollups of the given accounts (all by default) from their ledger.
+        Entries without a date are left out. Run it while no payments are written:
+        a payment committed during the rebuild of its account may be counted twice or lost.
+        Returns counters: accounts, payments and undated entries.
+        """
+        report = {"accounts": 0, "payments": 0, "undated": 0}
+        for username in (usernames if usernames is not None else self._all_usernames()):
+            payments = []
+            for entry in self._scan_ledger(username):
+                if entry.get("Created") is None:
+                    report["undated"] += 1
+                    continue
+                try:
+                    payments.append(self._entry_to_payment(entry))
+                except ValueError:
+                    continue
+            self._replace_rollups(username, self._rollup_deltas(username, payments))
+            report["accounts"] += 1
+            report["payments"] += len(payments)
+        return report
+
+    def _scan_ledger(self, username, after=0, until=None):
+        """Yields the ledger entries with after < Seq <= until (no upper bound if None), oldest first, page by page."""
+        while True:
+            entries = self._ledger_entries_after(username, after, ROLLUP_BACKFILL_PAGE)
+            for entry in entries:
+                if until is not None and entry["Seq"] > until:
+                    return
+                yield entry
+            if len(entries) < ROLLUP_BACKFILL_PAGE:
+                return
+            after = entries[-1]["Seq"]
+
+    def _signed_amount(self, username, payment : Payment) -> int:
+        """Amount of a payment as seen by the account: credits are positive, debits negative."""
+        return payment.amount if payment.receiver == username else -payment.amount
+
+    def _opening_checkpoint(self, username, balance, payments) -> dict:
+        """
+        Checkpoint Seq 0 of a new account: its balance before the first ledger entry,
+        the stored balance minus the payments the account is created with.
+        """
+        return {"Seq": 0, "Balance": balance - sum(self._signed_amount(username, payment) for payment in payments),
+                "Created": None}
+
+    def _replay_ledger(self, username, checkpoint, until) -> int:
+        """Balance after ledger entry until: the checkpoint plus the entries after it. Malformed entries count as 0."""
+        balance = checkpoint["Balance"]
+        for entry in self._scan_ledger(username, checkpoint["Seq"], until):
+            try:
+                balance += self._signed_amount(username, self._entry_to_payment(entry))
+            except ValueError:
+                continue
+        return balance
+
+    def get_balance_at(self, username, at=None, seq=None) -> int:
+        """
+        Balance of the account right after its ledger entry seq, or at the date at
+        (after the last entry committed before it); the balance of the whole ledger
+        if neither is given. It is the closest checkpoint plus the entries after it,
+        at most CHECKPOINT_INTERVAL of them on a compacted ledger, whatever the age of the account.
+        Dates before the first timestamped entry give the opening balance.
+        Raises AccountNotFoundError, or StorageSchemaError for an account created before
+        checkpoints that compact_ledger has not processed yet.
+        """
+        state = self._ledger_state(username)
+        if state is None:
+            raise AccountNotFoundError(f"Account '{username}' does not exist.")
+        if seq is None and at is not None:
+            entries = self._ledger_entries_between(username, None, self._utc(at), 1, None)
+            seq = entries[0]["Seq"] if entries else 0
+        seq = state[1] if seq is None else min(seq, state[1])
+        checkpoint = self._read_checkpoint(username, seq)
+        if checkpoint is None:
+            raise StorageSchemaError(f"Account '{username}' has no balance checkpoint yet, run tools/compact_ledger.py.")
+        return self._replay_ledger(username, checkpoint, seq)
+
+    def audit_balances(self, usernames=None) -> dict:
+        """
+        Checks the stored balance of the given accounts (all by default) against
+        their ledger: latest checkpoint plus the entries after it.
+        Balance and History_seq come from the same read and the entries up to it
+        never change, so the audit is exact while payments are being written.
+        Returns counters and the "mismatches" (Name, Seq, Stored, Ledger) and
+        "unchecked" accounts (no checkpoint yet, see compact_ledger).
+        """
+        report = {"accounts": 0, "mismatches": [], "unchecked": []}
+        for username in (usernames if usernames is not None else self._all_usernames()):
+            state = self._ledger_state(username)
+            if state is None:
+                continue
+            balance, seq = state
+            report["accounts"] += 1
+            checkpoint = self._read_checkpoint(username, seq)
+            if checkpoint is None:
+                report["unchecked"].append(username)
+                continue
+            ledger = self._replay_ledger(username, checkpoint, seq)
+            if ledger != balance:
+                report["mismatches"].append({"Name": username, "Seq": seq, "Stored": balance, "Ledger": ledger})
+        return report
+
+    def compact_ledger(self, usernames=None, interval=CHECKPOINT_INTERVAL) -> dict:
+        """
+        Advances the balance checkpoints of the given accounts (all by default):
+        one checkpoint every interval ledger entries, so balances are rebuilt
+        from at most interval entries. The ledger itself is kept whole.
+        Accounts created before checkpoints get their opening checkpoint, derived
+        from the stored balance, after one full replay of their ledger.
+        Returns counters: accounts, opened (accounts that got their opening
+        checkpoint) and checkpoints written.
+        """
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        report = {"accounts": 0, "opened": 0, "checkpoints": 0}
+        for username in (usernames if usernames is not None else self._all_usernames()):
+            state = self._ledger_state(username)
+            if state is None:
+                continue
+            balance, seq = state
+            report["accounts"] += 1
+            checkpoint = self._read_checkpoint(username, seq)
+            opening = checkpoint is None
+            if opening:
+                # the balance before the ledger is known once the whole ledger is replayed
+                checkpoint = {"Seq": 0, "Balance": 0, "Created": None}
+            elif seq - checkpoint["Seq"] < interval:
+                continue
+
+            checkpoints = []
+            running, last = checkpoint["Balance"], checkpoint["Seq"]
+            for entry in self._scan_ledger(username, checkpoint["Seq"], seq):
+                try:
+                    running += self._signed_amount(username, self._entry_to_payment(entry))
+                except ValueError:
+                    pass
+                if entry["Seq"] - last >= interval:
+                    checkpoints.append({"Seq": entry["Seq"], "Balance": running, "Created": entry.get("Created")})
+                    last = entry["Seq"]
+            if opening:
+                offset = balance - running
+                checkpoints = [{"Seq": 0, "Balance": offset, "Created": None}] + \
+                              [dict(point, Balance=point["Balance"] + offset) for point in checkpoints]
+                report["opened"] += 1
+            self._write_checkpoints(username, checkpoints)
+            report["checkpoints"] += len(checkpoints)
+        return report
+
+    def _check_transfer_key(self, key):
+        """Transfer keys are client generated ids, usable as a document id."""
+        if not isinstance(key, str) or not key or len(key) > 128 or "/" in key:
+            raise ValueError(f"Invalid transfer key: {key!r}")
+
+    def _transfer_record(self, sender, receiver, amount, result : TransferResult):
+        """What is stored under a transfer key, in the same commit as the transfer."""
+        return {
+            "Sender" : sender,
+            "Receiver" : receiver,
+            "Amount" : amount,
+            "Payment" : self._pack_payment(result.payment),
+            "Sender_balance" : result.sender_balance,
+            "Receiver_balance" : result.receiver_balance,
+            "Created" : result.payment.date
+        }
+
+    def _replay_transfer(self, key, record, sender, receiver, amount) -> TransferResult:
+        """Returns the stored result of a transfer key; raises TransferKeyError if it was used for another transfer."""
+        if (record["Sender"], record["Receiver"], record["Amount"]) != (sender, receiver, amount):
+            raise TransferKeyError(f"Transfer key '{key}' was already used for another transfer.")
+        payment = self._unpack_payment(record["Payment"])
+        payment.date = record.get("Created")
+        return TransferResult(payment, record["Sender_balance"], record["Receiver_balance"], replayed=True)
+
+    def _check_transfer(self, sender, receiver, sender_data, receiver_data, amount) -> Payment:
+        """
+        Validates a transfer against the stored documents of both accounts.
+        Returns the payment to record.
+        """
+        if sender_data is None:
+            raise AccountNotFoundError(f"Account '{sender}' does not exist.")
+        if receiver_data is None:
+            raise AccountNotFoundError(f"Account '{receiver}' does not exist.")
+        check_amount(amount)
+        if sender_data["Sold"] < amount:
+            raise InsufficientFundsError(f"Insuficient funds: {format_bani(sender_data['Sold'])} < {format_bani(amount)}")
+        # one date for both ledger entries of the transfer
+        return Payment(amount, sender, receiver, date=self._timestamp())
+
+    def _check_debit(self, username, balance, balance_delta):
+        """
+        Validates the balance change of modify_user against the stored balance:
+        a withdrawal may be checked against a User balance older than the transfers
+        that followed it.
+        """
+        if balance_delta is not None and balance_delta < 0 and balance + balance_delta < 0:
+            raise InsufficientFundsError(f"Insuficient funds: {format_bani(balance)} < {format_bani(-balance_delta)}")
+
+    def _plan_batch(self, items, accounts, records, inboxed=()):
+        """
+        Validates the items (sender, receiver, amount, key) of a transfer batch in
+        order, each against the balances left by the previous ones.
+        accounts: username -> document (None if missing) of every account involved;
+        their Sold and History_seq are advanced in place by the accepted transfers.
+        records: transfer key -> stored record, extended with the new transfers.
+        inboxed: accounts whose credits do not reach their ledger yet (sharded).
+        Returns (results, transfers): per item a TransferResult or the exception that
+        rejected it, and (key, payment, sender seq, receiver seq or None) to write.
+        """
+        results = []
+        transfers = []
+        for sender, receiver, amount, key in items:
+            try:
+                if key is not None:
+                    self._check_transfer_key(key)
+                    if key in records:
+                        results.append(self._replay_transfer(key, records[key], sender, receiver, amount))
+                        continue
+                if sender == receiver:
+                    raise SameAccountError(f"Cannot transfer money from '{sender}' to itself.")
+                sender_data, receiver_data = accounts.get(sender), accounts.get(receiver)
+                payment = self._check_transfer(sender, receiver, sender_data, receiver_data, amount)
+            except (AccountNotFoundError, SameAccountError, InsufficientFundsError, NegativeAmountError,
+                    TransferKeyError, TypeError, ValueError) as error:
+                results.append(error)
+                continue
+            sender_data["Sold"] -= amount
+            receiver_data["Sold"] += amount
+            sender_data["History_seq"] = sender_data.get("History_seq", 0) + 1
+            receiver_seq = None
+            if receiver not in inboxed:
+                receiver_data["History_seq"] = receiver_seq = receiver_data.get("History_seq", 0) + 1
+            result = TransferResult(payment, sender_data["Sold"], receiver_data["Sold"] if receiver_seq else None)
+            if key is not None:
+                records[key] = self._transfer_record(sender, receiver, amount, result)
+            transfers.append((key, payment, sender_data["History_seq"], receiver_seq))
+            results.append(result)
+        return results, transfers
+
+    def _sort_schedules(self, schedules) -> list:
+        """get_schedules order: pending ones by next run, then the finished ones."""
+        return sorted(schedules, key=lambda schedule: (schedule.next_run is None, schedule.next_run or schedule.first_run,
+                                                       schedule.schedule_id))
+
+    def get_payment_history(self, username, saved_count=0) -> PaymentsHistory:
+        """Returns a history of the user that loads its pages from the ledger on demand."""
+        def loader(before, limit):
+            return self.get_history_page(username, limit, before)
+        return PaymentsHistory(loader=loader, saved_count=saved_count)
+
+    def sync_payment_history(self, username, history : PaymentsHistory, saved_count : int):
+        """
+        Brings a loaded history up to saved_count (the History_seq of a snapshot)
+        by reading and decoding only the ledger entries it has not seen yet.
+        Returns the new payments, oldest first, or None if the history has to be
+        rebuilt: the ledger was rewritten (it is shorter than the history) or
+        more than a page of payments is missing.
+        """
+        missing = saved_count - history.saved_count
+        if missing < 0 or missing > HISTORY_PAGE_SIZE:
+            return None
+        if missing == 0:
+            return []
+
+        entries = self._ledger_entries_after(username, history.saved_count, missing)
+        payments = []
+        for entry in entries:
+            try:
+                payment = self._entry_to_payment(entry)
+            except ValueError:
+                continue
+            history.add_saved_payment(payment)
+            payments.append(payment)
+        if entries:
+            # skipped malformed entries still count as seen
+            history.saved_count = entries[-1]["Seq"]
+        return payments
+
+    def _hash_password(self, password) -> str:
+        import bcrypt
+        Password_bytes = str(password).encode()
+        salt = bcrypt.gensalt()
+        return bcrypt.hashpw(Password_bytes, salt).decode()
+
+    def _check_password(self, password, stored_hash) -> bool:
+        if not stored_hash:
+            return False
+        import bcrypt
+        return bcrypt.checkpw(password.encode(), stored_hash.encode())
+
+    def _new_user_data(self, user : User):
+        """Builds the stored document of a new user (hashes the plain password)."""
+        return {
+            "Name" : user.credentials.username,
+            "Password_hash" : self._hash_password(user.credentials.password),
+            "Card_Number" : user.card.number,
+            "CVV" : user.card.cvv,
+            "Expiry_date" : user.card.expiry_date,
+            "Sold" : user.balance,
+            "Email" : user.credentials.email,
+            "Iban" : user.card.IBAN,
+            "History_seq" : 0
+        }
+
+    def _user_to_data(self, user : User):
+        """
+        Builds the stored fields of an existing user (password is already hashed).
+        History_seq is left out, the backends advance it when appending to the ledger.
+        """
+        return {
+            "Name": user.credentials.username,
+            "Password_hash": user.credentials.password,
+            "Card_Number": user.card.number,
+            "CVV": user.card.cvv,
+            "Expiry_date": user.card.expiry_date,
+            "Sold": user.balance,
+            "Email": user.credentials.email,
+            "Iban": user.card.IBAN
+        }
+
+    def _changed_fields(self, user : User):
+        """
+        Returns (fields, balance_delta) with only what was modified since the user
+        was loaded. balance_delta is None when the balance did not change; users
+        that are not tracked are returned whole, with the absolute balance.
+        """
+        data = self._user_to_data(user)
+        if not user.is_tracked:
+            return data, None
+
+        changed = set()
+        for attribute, part, mapping in (("credentials", user.credentials, CREDENTIALS_FIELDS),
+                                         ("card", user.card, CARD_FIELDS)):
+            if attribute in user.dirty_fields or not part.is_tracked:
+                changed.update(mapping.values())
+            else:
+                changed.update(mapping[name] for name in part.dirty_fields if name in mapping)
+
+        fields = {field: data[field] for field in changed}
+        return fields, user.balance_delta()
+
+    def _create_user_from_data(self, username, data):
+        email = data.get("Email")
+        balance = data.get("Sold")
+        hashed_pass = data.get("Password_hash")
+        cardNr = data.get("Card_Number")
+        cvv = data.get("CVV")
+        IBAN = data.get("Iban")
+        exp_date = data.get("Expiry_date")
+        if "History" in data:
+            # legacy document that still embeds the whole history
+            history = self.database_to_class_format(data.get("History") or [])
+        else:
+            history = self.get_payment_history(username, data.get("History_seq", 0))
+
+        credentials = UserCredentials(
+            username = username,
+            password = hashed_pass,
+            email = email
+        )
+
+        card = Card(
+            number = cardNr,
+            cvv = cvv,
+            IBAN = IBAN,
+            expiry_date=exp_date
+        )
+
+        user = User(
+            credentials=credentials,
+            balance=balance,
+            payment_history=history,
+            card=card
+        )
+        user.mark_clean()
+
+        return user
+
+    # ------------------------------------------------------------------
+    # cached reads
+
+    def get_user(self, username) -> User:
+        """Raises AccountNotFoundError if the user does not exist."""
+        if self.cache is not None:
+            data = self.cache.get(username)
+            if data is NOT_CACHED:
+                generation = self.cache.generation
+                data = self._read_user(username)
+                self.cache.put(username, data, generation)
+        else:
+            data = self._read_user(username)
+
+        if data is None:
+            raise AccountNotFoundError(f"Account '{username}' does not exist.")
+        return self._create_user_from_data(username, data)
+
+    def get_users(self, usernames) -> list:
+        """
+        Fetches many users with a single batched read of the ones not cached.
+        Returns the users in the order of usernames, with None for each account
+        that does not exist.
+        """
+        usernames = list(usernames)
+        found = {}
+        to_read = []
+        for username in dict.fromkeys(usernames):
+            data = self.cache.get(username) if self.cache is not None else NOT_CACHED
+            if data is NOT_CACHED:
+                to_read.append(username)
+            else:
+                found[username] = data
+
+        if to_read:
+            generation = self.cache.generation if self.cache is not None else None
+            read = self._read_users(to_read)
+            for username in to_read:
+                data = read.get(username)
+                found[username] = data
+                if self.cache is not None:
+                    self.cache.put(username, data, generation)
+
+        return [self._create_user_from_data(username, found[username]) if found[username] is not None else None
+                for username in usernames]
+
+    def get_fields(self, username, fields) -> dict:
+        """
+        Returns only the requested fields of a user, e.g. get_fields(name, ["Sold", "Iban"]),
+        without reading the rest of the document. Fields missing from the document are None.
+        Raises AccountNotFoundError if the user does not exist.
+        """
+        fields = list(fields)
+        unknown = [field for field in fields if field not in USER_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown user fields: {', '.join(unknown)}")
+
+        data = self.cache.get(username) if self.cache is not None else NOT_CACHED
+        if data is NOT_CACHED:
+            data = self._read_fields(username, fields)
+        if data is None:
+            raise AccountNotFoundError(f"Account '{username}' does not exist.")
+        return {field: data.get(field) for field in fields}
+
+    def get_user_by_iban(self, iban : str) -> User:
+        """Raises AccountNotFoundError if no user owns the IBAN."""
+        if self.cache is not None:
+            found = self.cache.get_by_iban(iban)
+            if found is NOT_CACHED:
+                generation = self.cache.generation
+                found = self._read_user_by_iban(iban)
+                if found is None:
+                    self.cache.put_missing_iban(iban, generation)
+                else:
+                    self.cache.put(found[0], found[1], generation)
+        else:
+            found = self._read_user_by_iban(iban)
+
+        if found is None:
+            raise AccountNotFoundError(f"Account with IBAN '{iban}' does not exist.")
+        username, data = found
+        return self._create_user_from_data(username, data)
+
+    def resolve_iban(self, iban : str) -> str:
+        """
+        Returns the username owning the IBAN with a single keyed lookup.
+        Raises AccountNotFoundError if no user owns it.
+        """
+        if self.cache is not None:
+            found = self.cache.get_by_iban(iban)
+            if found is None:
+                raise AccountNotFoundError(f"Account with IBAN '{iban}' does not exist.")
+            if found is not NOT_CACHED:
+                return found[0]
+
+        username = self._lookup_iban(iban)
+        if username is None:
+            if self.cache is not None:
+                self.cache.put_missing_iban(iban)
+            raise AccountNotFoundError(f"Account with IBAN '{iban}' does not exist.")
+        return username
+
+    def resolve_card(self, card_number) -> str:
+        """
+        Returns the username owning the card number with a single keyed lookup.
+        Raises AccountNotFoundError if no user owns it.
+        """
+        if self.cache is not None:
+            found = self.cache.get_by_card(card_number)
+            if found is not NOT_CACHED:
+                return found[0]
+
+        username = self._lookup_card(card_number)
+        if username is None:
+            raise AccountNotFoundError(f"Account with card number '{card_number}' does not exist.")
+        return username
+
+    def _read_user_by_iban(self, iban : str):
+        """Returns (username, document) of the owner of the IBAN, or None."""
+        username = self._lookup_iban(iban)
+        if username is None:
+            return None
+        data = self._read_user(username)
+        if data is None or data.get("Iban") != iban:
+            return None
+        return username, data
+
+    def _index_report(self, owners, index):
+        """
+        Compares the identifiers (IBANs or card numbers) of the users, given as
+        (username, identifier) pairs, with the stored index (identifier -> username).
+        missing: identifier -> username entries to write, stale: identifiers to remove
+        from the index, duplicates: identifiers owned by more than one user (kept on
+        the first owner). Reservations (entries without a username) are left alone.
+        """
+        expected = {}
+        duplicates = set()
+        for username, identifier in owners:
+            if not identifier:
+                continue
+            if identifier in expected and expected[identifier] != username:
+                duplicates.add(identifier)
+                continue
+            expected[identifier] = username
+        return {
+            "missing": {key: username for key, username in expected.items() if index.get(key) != username},
+            "stale": sorted(key for key, username in index.items() if username is not None and key not in expected),
+            "duplicates": sorted(duplicates),
+        }
+
+    def _invalidate(self, *usernames):
+        """Drops the cached documents of users that were just written."""
+        if self.cache is not None:
+            self.cache.invalidate(*usernames)
+
+    def _caching_callback(self, username, callback):
+        """Wraps a listener callback so the snapshots also refresh the cache."""
+        def on_snapshot(doc_snapshot, changes, read_time):
+            if self.cache is not None:
+                for doc in doc_snapshot:
+                    self.cache.refresh(username, doc.to_dict() if doc.exists else None)
+            callback(doc_snapshot, changes, read_time)
+        return on_snapshot
+
+    # ------------------------------------------------------------------
+    # interface
+
+    @abstractmethod
+    def add_user(self, user : User):
+        """
+        Add a new user to the database.
+        Raises IdentifierInUseError if the card number or the IBAN belongs to another user.
+        """
+
+    @abstractmethod
+    def add_users_bulk(self, users):
+        """
+        Writes many new users at once, for seeding test data.
+        users is a list of (document, payments) pairs: the documents already hold
+        Password_hash and the payments become their ledger. Listeners are not notified.
+        """
+
+    @abstractmethod
+    def checkUserLogin(self, username, Password) -> bool:
+        """Check the password of a user against the stored hash."""
+
+    @abstractmethod
+    def delete_user(self, username):
+        """Delete the user from the database."""
+
+    @abstractmethod
+    def modify_user(self, user : User):
+        """
+        Update the stored fields of an existing user and append its pending
+        payments to the ledger.
+        Raises InsufficientFundsError, writing nothing, if a decrease of the
+        balance would take the stored balance below 0.
+        """
+
+    @abstractmethod
+    def transfer(self, sender, receiver, amount, key=None) -> TransferResult:
+        """
+        Moves money between two accounts as a single atomic write: both balances
+        and both ledger entries are committed together or not at all.
+        With a key, the result is stored in the same commit and a later call with
+        the same key returns it (replayed) instead of moving the money again.
+        Raises AccountNotFoundError, SameAccountError, InsufficientFundsError,
+        TransferKeyError, or TransientStorageError when it can be retried.
+        """
+
+    @abstractmethod
+    def transfer_batch(self, items) -> list:
+        """
+        Commits many transfers in one atomic write, e.g. a payroll run: items are
+        (sender, receiver, amount, key) tuples, at most transfer_batch_max of them.
+        The accounts and keys involved are read in bulk, then the items are checked
+        in order against running balances, so an earlier credit can fund a later debit.
+        Returns, in the order of items, the TransferResult of each transfer (replayed
+        for a known key) or the exception that rejected it; rejected items write nothing.
+        Raises TransientStorageError when the whole batch can be retried.
+        """
+
+    @abstractmethod
+    def listen_to_user(self, username, callback):
+        """
+        Listen to changes on a user document.
+        The callback receives (doc_snapshot, changes, read_time) like a Firestore
+        on_snapshot callback; the returned object has an unsubscribe() method.
+        """
+
+    @abstractmethod
+    def listen_to_users(self, callback, usernames=None):
+        """
+        Listen to changes on every user document (the whole Users collection), or
+        only on the given usernames (at most LISTEN_USERS_MAX) with a single stream.
+        The callback receives (docs, changes, read_time) like a Firestore collection
+        on_snapshot callback: the first call has every document in docs and an ADDED
+        change for each, later calls the changes since the previous one.
+        The returned object has an unsubscribe() method and an is_active property.
+        """
+
+    @abstractmethod
+    def _read_user(self, username):
+        """Returns the stored document of the user, or None if it does not exist."""
+
+    @abstractmethod
+    def get_history_page(self, username, limit=HISTORY_PAGE_SIZE, before=None):
+        """
+        Returns a page of the user's ledger with the payments older than the cursor
+        (the newest ones if before is None), as (payments oldest first, next cursor or None).
+        """
+
+    @abstractmethod
+    def _ledger_entries_after(self, username, after, limit) -> list:
+        """Returns up to limit ledger entries with a Seq greater than after, oldest first."""
+
+    @abstractmethod
+    def _ledger_entries_between(self, username, since, until, limit, cursor) -> list:
+        """
+        Returns up to limit ledger entries with since <= Created < until (either
+        bound may be None), ordered by (Created, Seq) newest first and older than
+        the (Created, Seq) cursor if one is given.
+        """
+
+    @abstractmethod
+    def _read_rollups(self, username, since, until) -> list:
+        """Returns the stored rollups of the months between since and until (included), oldest first."""
+
+    @abstractmethod
+    def _replace_rollups(self, username, rollups):
+        """Replaces all the rollups of an account with rollups ({month: rollup})."""
+
+    @abstractmethod
+    def _all_usernames(self) -> list:
+        """Returns the usernames of every account."""
+
+    @abstractmethod
+    def _ledger_state(self, username):
+        """
+        Returns (Sold, History_seq) of the account from a single read, or None if
+        it does not exist. Sold is the part of the balance recorded in the ledger
+        up to History_seq (without the unfolded credits of a sharded account).
+        """
+
+    @abstractmethod
+    def _read_checkpoint(self, username, seq):
+        """Returns the latest checkpoint (Seq, Balance, Created) of the account with Seq <= seq, or None."""
+
+    @abstractmethod
+    def _write_checkpoints(self, username, checkpoints):
+        """Stores checkpoints of an account, replacing the ones with the same Seq."""
+
+    @abstractmethod
+    def migrate_ledger_encoding(self) -> int:
+        """
+        Rewrites the ledger entries still stored as "a -> amount -> b" strings or
+        in an older packed version in the current format. Returns the number of entries converted.
+        """
+
+    @abstractmethod
+    def _read_users(self, usernames) -> dict:
+        """
+        Reads the documents of several users in one batched call.
+        Returns username -> document, leaving out the users that do not exist.
+        """
+
+    @abstractmethod
+    def _read_fields(self, username, fields) -> dict:
+        """
+        Reads only the given fields of a user (a field mask on the server side).
+        Returns None if the user does not exist.
+        """
+
+    @abstractmethod
+    def _lookup_iban(self, iban : str):
+        """Returns the username owning the IBAN, or None."""
+
+    @abstractmethod
+    def _lookup_card(self, card_number):
+        """Returns the username owning the card number, or None (also for a reserved one)."""
+
+    @abstractmethod
+    def verify_iban_index(self) -> dict:
+        """
+        Compares the IBAN index with the user documents.
+        Returns lists of "missing" entries, "stale" entries and "duplicates"
+        (IBANs owned by more than one user).
+        """
+
+    @abstractmethod
+    def rebuild_iban_index(self) -> dict:
+        """Repairs the IBAN index from the user documents and returns the verify report it fixed."""
+
+    @abstractmethod
+    def card_exists(self, card_number) -> bool:
+        """Check if a card number is already used or reserved."""
+
+    @abstractmethod
+    def reserve_identifiers(self, card_number, iban) -> bool:
+        """
+        Atomically reserves a card number and an IBAN in the uniqueness indexes.
+        Returns False, reserving nothing, if either is already used or reserved.
+        add_user turns the reservation into the user's own entries.
+        """
+
+    @abstractmethod
+    def release_identifiers(self, card_number, iban):
+        """Drops a reservation that will not be used."""
+
+    @abstractmethod
+    def verify_card_index(self) -> dict:
+        """Same report as verify_iban_index, for the card number index."""
+
+    @abstractmethod
+    def rebuild_card_index(self) -> dict:
+        """Repairs the card number index from the user documents."""
+
+    @abstractmethod
+    def add_request(self, request : Request):
+        """Save a support request. Raises RequestError on failure."""
+
+    @abstractmethod
+    def save_schedules(self, schedules):
+        """Writes scheduled payments (new ones or their progress) in bulk."""
+
+    @abstractmethod
+    def delete_schedule(self, schedule_id):
+        """Removes a scheduled payment; its occurrences already paid stay in the ledger."""
+
+    @abstractmethod
+    def get_schedules(self, username) -> list:
+        """Returns the scheduled payments sent by the account, soonest first, finished ones last."""
+
+    @abstractmethod
+    def read_schedules(self, schedule_ids) -> dict:
+        """Reads scheduled payments in bulk: schedule id -> ScheduledPayment, missing ids left out."""
+
+    @abstractmethod
+    def next_schedules(self, after=None, limit=1000) -> list:
+        """
+        Returns the (Next_run, Id) keys of the pending scheduled payments, ordered,
+        starting after the key after (from the first with None).
+        Finished schedules (Next_run None) are left out.
+        """
+
+
+class LocalSnapshot:
+    """
+    Minimal stand-in for a Firestore DocumentSnapshot, used by the local
+    backends to notify listeners.
+    """
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = dict(data) if data is not None else None
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field) if self._data is not None else None
+
+
+class LocalChangeType(Enum):
+    """Same members as Firestore's ChangeType."""
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+
+class LocalChange:
+    """Minimal stand-in for a Firestore DocumentChange, passed to collection listeners."""
+    def __init__(self, change_type, document):
+        self.type = change_type
+        self.document = document
+
+
+class LocalWatch:
+    """Handle returned by the local backends' listen_to_user and listen_to_users."""
+    def __init__(self, registry, username, callback):
+        self._registry = registry
+        self._username = username
+        self._callback = callback
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._registry.remove(self._username, self._callback)
+
+
+class LocalListeners:
+    """
+    Per-document listener registry for the local backends; collection
+    listeners are registered under the username None.
+    Callbacks are invoked synchronously after a write, outside the backend lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks: dict[str, list] = {}
+
+    def add(self, username, callback, current_data):
+        with self._lock:
+            self._callbacks.setdefault(username, []).append(callback)
+        # Firestore delivers the current state right after subscribing
+        callback([LocalSnapshot(username, current_data)], [], datetime.now(timezone.utc))
+        return LocalWatch(self, username, callback)
+
+    def add_collection(self, callback, documents, usernames=None):
+        """
+        Registers a listener of every user, or only of usernames;
+        documents (username -> data) is their current state.
+        """
+        listener = callback
+        if usernames is not None:
+            usernames = set(usernames)
+            def listener(docs, changes, read_time):
+                changes = [change for change in changes if change.document.id in usernames]
+                if changes:
+                    callback([doc for doc in docs if doc.id in usernames], changes, read_time)
+        with self._lock:
+            self._callbacks.setdefault(None, []).append(listener)
+        snapshots = [LocalSnapshot(username, data) for username, data in documents.items()]
+        callback(snapshots, [LocalChange(LocalChangeType.ADDED, snapshot) for snapshot in snapshots],
+                 datetime.now(timezone.utc))
+        return LocalWatch(self, None, listener)
+
+    def remove(self, username, callback):
+        with self._lock:
+            callbacks = self._callbacks.get(username, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._callbacks.pop(username, None)
+
+    def notify(self, username, data):
+        with self._lock:
+            callbacks = list(self._callbacks.get(username, []))
+            collection_callbacks = list(self._callbacks.get(None, []))
+        if not callbacks and not collection_callbacks:
+            return
+        read_time = datetime.now(timezone.utc)
+        for callback in callbacks:
+            callback([LocalSnapshot(username, data)], [], read_time)
+        if collection_callbacks:
+            snapshot = LocalSnapshot(username, data)
+            change = LocalChange(LocalChangeType.MODIFIED if data is not None else LocalChangeType.REMOVED, snapshot)
+            for callback in collection_callbacks:
+                callback([snapshot], [change], read_time)
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict
+
+# returned by the lookups when the cache knows nothing about the key
+NOT_CACHED = object()
+
+class UserCache:
+    """
+    In-process LRU cache of user documents with a time to live.
+    Missing accounts are cached too (for negative_ttl seconds) so repeated
+    lookups of unknown usernames or IBANs do not reach the database.
+    """
+    def __init__(self, max_size=1024, ttl=30.0, negative_ttl=5.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        # username -> (expires_at, document or None when the account does not exist)
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        # iban -> username of the cached documents
+        self._ibans: dict[str, str] = {}
+        # card number (as a string) -> username of the cached documents
+        self._cards: dict[str, str] = {}
+        # iban -> expires_at for IBANs that belong to no account
+        self._missing_ibans: OrderedDict[str, float] = OrderedDict()
+        # incremented by every invalidation, see put()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, username):
+        """Returns the cached document, None for a cached missing account, or NOT_CACHED."""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    self._remove(username)
+                self.misses += 1
+                return NOT_CACHED
+            self._entries.move_to_end(username)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[1]
+
+    def get_by_iban(self, iban):
+        """Returns (username, document), None for a cached unknown IBAN, or NOT_CACHED."""
+        with self._lock:
+            expires_at = self._missing_ibans.get(iban)
+            if expires_at is not None:
+                if expires_at > self.clock():
+                    self.negative_hits += 1
+                    return None
+                del self._missing_ibans[iban]
+            username = self._ibans.get(iban)
+        if username is None:
+            with self._lock:
+                self.misses += 1
+            return NOT_CACHED
+        data = self.get(username)
+        if data is NOT_CACHED or data is None:
+            return NOT_CACHED
+        return username, data
+
+    def get_by_card(self, card_number):
+        """Returns (username, document) of a cached card number, or NOT_CACHED."""
+        with self._lock:
+            username = self._cards.get(str(card_number))
+            if username is None:
+                self.misses += 1
+                return NOT_CACHED
+        data = self.get(username)
+        if data is NOT_CACHED or data is None:
+            return NOT_CACHED
+        return username, data
+
+    def put(self, username, data, generation=None):
+        """
+        Caches the document of a user (None if the account does not exist).
+        Pass the generation read before querying the database: the result is
+        dropped if a write invalidated the cache in the meantime.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._remove(username)
+            ttl = self.ttl if data is not None else self.negative_ttl
+            self._entries[username] = (self.clock() + ttl, dict(data) if data is not None else None)
+            if data is not None and data.get("Iban"):
+                self._ibans[data["Iban"]] = username
+                self._missing_ibans.pop(data["Iban"], None)
+            if data is not None and data.get("Card_Number"):
+                self._cards[str(data["Card_Number"])] = username
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def refresh(self, username, data):
+        """
+        Caches a document delivered by a listener. The same document as the cached
+        one only renews its time to live; a new one moves the generation like a
+        write, so reads started before the snapshot do not overwrite it.
+        """
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[1] != data:
+                self.generation += 1
+        self.put(username, data)
+
+    def put_missing_iban(self, iban, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._missing_ibans[iban] = self.clock() + self.negative_ttl
+            while len(self._missing_ibans) > self.max_size:
+                self._missing_ibans.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *usernames):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            for username in usernames:
+                self._remove(username)
+            # a write may have created the account behind a missing IBAN
+            self._missing_ibans.clear()
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._ibans.clear()
+            self._cards.clear()
+            self._missing_ibans.clear()
+
+    def _remove(self, username):
+        entry = self._entries.pop(username, None)
+        if entry is not None and entry[1] is not None:
+            iban = entry[1].get("Iban")
+            if iban and self._ibans.get(iban) == username:
+                del self._ibans[iban]
+            card_number = entry[1].get("Card_Number")
+            if card_number and self._cards.get(str(card_number)) == username:
+                del self._cards[str(card_number)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,233 @@
+import threading
+import time
+from DataBase.UserCache import NOT_CACHED
+
+# seconds the mirror keeps answering after its stream was last seen alive
+DEFAULT_MAX_STALENESS = 10.0
+
+class UserMirror:
+    """
+    Process-local replica of the Users collection, kept in sync by one
+    collection listener (Storage.listen_to_users), for teller and back-office
+    processes that look up many accounts.
+    It takes the place of the UserCache (same lookups, storage.cache = mirror):
+    username, IBAN and card lookups are answered from memory while the stream
+    was seen alive less than max_staleness seconds ago. Otherwise, and for the
+    accounts it does not hold, the lookups fall back to the database.
+    Sharded accounts are not mirrored: the stream does not see their shards.
+    """
+    def __init__(self, storage, max_staleness=DEFAULT_MAX_STALENESS, clock=time.monotonic):
+        self.storage = storage
+        self.max_staleness = max_staleness
+        self.clock = clock
+        self._lock = threading.Lock()
+        # username -> (update time or None, document)
+        self._documents: dict[str, tuple] = {}
+        # iban -> username, card number (as a string) -> username
+        self._ibans: dict[str, str] = {}
+        self._cards: dict[str, str] = {}
+        # incremented by every invalidation and applied snapshot, see put()
+        self.generation = 0
+        # read time of the last snapshot applied, and clock() when the stream was last seen alive
+        self.read_time = None
+        self._alive_at = None
+        # False until the first snapshot of the current stream, which carries the whole collection
+        self._synced = False
+        self._watch = None
+        self._monitor = None
+        self._stopped = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.snapshots = 0
+        self.resyncs = 0
+        self.invalidations = 0
+
+    def start(self):
+        """Subscribes to the Users collection and starts checking that the stream stays alive."""
+        if self._watch is not None:
+            return
+        self._subscribe()
+        self._monitor = threading.Thread(target=self._check_stream, name="user-mirror", daemon=True)
+        self._monitor.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            watch, self._watch = self._watch, None
+            self._alive_at = None
+        if watch is not None:
+            watch.unsubscribe()
+
+    def _subscribe(self):
+        with self._lock:
+            self._synced = False
+        watch = self.storage.listen_to_users(self._on_snapshot)
+        with self._lock:
+            self._watch = watch
+
+    def _check_stream(self):
+        """
+        The listener only calls back when documents change, so an idle stream is
+        checked here: alive while active, subscribed again (a full resync) once it stopped.
+        """
+        while not self._stopped.wait(self.max_staleness / 2):
+            with self._lock:
+                watch = self._watch
+            if watch is None:
+                continue
+            if watch.is_active:
+                with self._lock:
+                    if self._synced:
+                        self._alive_at = self.clock()
+                continue
+            watch.unsubscribe()
+            with self._lock:
+                self.resyncs += 1
+            try:
+                self._subscribe()
+            except Exception:
+                # the database is unreachable: lookups keep falling back until the next check
+                continue
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            if not self._synced:
+                # first snapshot of the stream: the whole collection, documents deleted meanwhile included
+                self._documents.clear()
+                self._ibans.clear()
+                self._cards.clear()
+                for doc in docs:
+                    self._store(doc.id, doc.to_dict(), getattr(doc, "update_time", None))
+                self._synced = True
+            else:
+                for change in changes:
+                    doc = change.document
+                    if change.type.name == "REMOVED" or not doc.exists:
+                        self._remove(doc.id)
+                    else:
+                        self._store(doc.id, doc.to_dict(), getattr(doc, "update_time", None))
+            # network reads started before this snapshot must not overwrite it
+            self.generation += 1
+            self.read_time = read_time
+            self._alive_at = self.clock()
+            self.snapshots += 1
+
+    def _mirrored(self, data) -> bool:
+        # the balance of a sharded account and a legacy embedded History need the database
+        return data is not None and not data.get("Shards") and "History" not in data
+
+    def _store(self, username, data, version):
+        """Must be called with the lock held."""
+        current = self._documents.get(username)
+        if current is not None and current[0] is not None and version is not None and version < current[0]:
+            return
+        self._remove(username)
+        if not self._mirrored(data):
+            return
+        self._documents[username] = (version, dict(data))
+        if data.get("Iban"):
+            self._ibans[data["Iban"]] = username
+        if data.get("Card_Number"):
+            self._cards[str(data["Card_Number"])] = username
+
+    def _remove(self, username):
+        entry = self._documents.pop(username, None)
+        if entry is None:
+            return
+        iban = entry[1].get("Iban")
+        if iban and self._ibans.get(iban) == username:
+            del self._ibans[iban]
+        card_number = entry[1].get("Card_Number")
+        if card_number and self._cards.get(str(card_number)) == username:
+            del self._cards[str(card_number)]
+
+    def _fresh(self) -> bool:
+        return self._alive_at is not None and self.clock() - self._alive_at <= self.max_staleness
+
+    def get(self, username):
+        """Returns the mirrored document, or NOT_CACHED if the mirror is stale or does not hold it."""
+        with self._lock:
+            if not self._fresh():
+                self.stale += 1
+                return NOT_CACHED
+            entry = self._documents.get(username)
+            if entry is None:
+                self.misses += 1
+                return NOT_CACHED
+            self.hits += 1
+            return entry[1]
+
+    def _get_by(self, index, key):
+        with self._lock:
+            username = index.get(key) if self._fresh() else None
+        if username is None:
+            with self._lock:
+                self.misses += 1
+            return NOT_CACHED
+        data = self.get(username)
+        if data is NOT_CACHED:
+            return NOT_CACHED
+        return username, data
+
+    def get_by_iban(self, iban):
+        """Returns (username, document) of the owner of the IBAN, or NOT_CACHED."""
+        return self._get_by(self._ibans, iban)
+
+    def get_by_card(self, card_number):
+        """Returns (username, document) of the owner of the card number, or NOT_CACHED."""
+        return self._get_by(self._cards, str(card_number))
+
+    def put(self, username, data, generation=None):
+        """
+        Keeps a document read from the database until the stream delivers a newer one.
+        Dropped if a snapshot or a write happened since generation was read.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if username not in self._documents:
+                self._store(username, data, None)
+
+    def refresh(self, username, data):
+        """Document delivered by a per-account listener; kept only if it differs from the mirrored one."""
+        with self._lock:
+            entry = self._documents.get(username)
+            if entry is not None and entry[1] == data:
+                return
+            self.generation += 1
+            self._store(username, data, None)
+
+    def put_missing_iban(self, iban, generation=None):
+        """Unknown IBANs are not remembered: the next lookup asks the database again."""
+
+    def invalidate(self, *usernames):
+        """Writes of this process: the accounts are read from the database until the stream catches up."""
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            for username in usernames:
+                self._remove(username)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._documents.clear()
+            self._ibans.clear()
+            self._cards.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                "size": len(self._documents),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "snapshots": self.snapshots,
+                "resyncs": self.resyncs,
+                "invalidations": self.invalidations,
+                "read_time": self.read_time,
+                "staleness": self.clock() - self._alive_at if self._alive_at is not None else None,
+            }
@@ -7,9 +7,8 @@ from tkinter import TclError
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from EDMBank_login import EDMBankLogin
-from EDMBank_main import EDMBankApp
 from services.bank_service import BankService
-from DataBase.DataBase import Database
+from DataBase.Factory import create_database
 
 def apply_dpi_fix(root):
     try:
@@ -44,6 +43,9 @@ def restart_app(current_root, bank_service):
     new_root.mainloop()
 
 def start_main_app(user, login_window, bank_service: BankService):
+    # the main window is imported after login, the login window shows up sooner without it
+    from EDMBank_main import EDMBankApp
+
     # get the position and size of the login window before destroying it
     login_window.update_idletasks()
     x = login_window.winfo_x()
@@ -76,7 +78,8 @@ if __name__ == "__main__":
     
     apply_dpi_fix(root)
 
-    db = Database()
+    db = create_database()
+    db.warm_up()
     bank_service = BankService(db)
     run_login_app(root, bank_service)
     root.mainloop()
\ No newline at end of file
@@ -1,6 +1,5 @@
 import tkinter as tk
 from tkinter import messagebox
-from EDMBank_register import EDMBankRegister
 from EDMBank_keyboard import AlphaNumericKeyboard
 from services.bank_service import BankService
 from ui_utils import UIHelper, get_resource_path
@@ -201,6 +200,9 @@ class EDMBankLogin:
         # hide the login window
         self.main.withdraw() 
         
+        # imported on first use to keep it out of the startup path
+        from EDMBank_register import EDMBankRegister
+
         # create a new top-level window for registration
         register_root = tk.Toplevel(self.main)
         
@@ -2,16 +2,23 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import os
 import random
+import threading
+import uuid
+from datetime import datetime, timezone
 from PIL import Image, ImageTk
 from EDMBank_contact import EDMBankContact
-import locale
 from EDMBank_profile import EDMBankProfile 
 from EDMBank_settings import EDMBankSettings 
 from ui_utils import UIHelper, get_resource_path
 from user_management.user import User
+from user_management.payment_details import PaymentsHistory
+from user_management.money import parse_amount, format_bani
 from services.bank_service import BankService
 from exceptions import *
 
+# real-time updates are applied at most once per frame (milliseconds)
+UPDATE_FRAME_MS = 16
+
 class EDMBankApp:
     def __init__(self, main, current_user: User, bank_service: BankService, relauch_login_callback=None): 
         self.main = main 
@@ -60,7 +67,7 @@ class EDMBankApp:
         self.card_iban = self.current_user.card.IBAN
         
         # ensure balance is formatted correctly from the start
-        self.sold_amount = self.float_to_balance(float(self.current_user.balance))
+        self.sold_amount = self.bani_to_balance(self.current_user.balance)
         
         self.nav_images = []  
         self.top_logo_image = None
@@ -80,50 +87,90 @@ class EDMBankApp:
 
         self.main.bind('<Configure>', self.on_resize)
 
+        # History_seq of the latest snapshot, and whether a ledger read for it runs in the background
+        self.history_target = None
+        self.history_syncing = False
+
         # setup real-time listener
         self.setup_realtime_listener()
 
     
     def setup_realtime_listener(self):
-        def on_snapshot(doc_snapshot, changes, read_time):
-            for doc in doc_snapshot:
-                if doc.exists:
-                    data = doc.to_dict()
-                    # schedule UI update on main thread
-                    self.main.after(0, self.handle_user_update, data)
+        # the hub coalesces the snapshots of a burst and flushes them on the main thread, once per frame
+        self.bank_service.start_listener_hub(lambda flush: self.main.after(UPDATE_FRAME_MS, flush))
 
-        # keep a reference to the listener
-        self.user_listener = self.bank_service.listen_to_user_changes(self.logged_in_user, on_snapshot)
+        def on_update(data):
+            if data is not None:
+                self.handle_user_update(data)
+
+        # keep a reference to the subscription
+        self.user_listener = self.bank_service.subscribe_user_updates(self.logged_in_user, on_update)
 
     def handle_user_update(self, data):
         # update balance
         if "Sold" in data:
             new_balance = data.get("Sold")
-            self.current_user.balance = new_balance
-            self.sold_amount = self.float_to_balance(float(new_balance))
+            # the stored balance: a later deposit or withdrawal must not apply this change again
+            self.current_user.set_synced_balance(new_balance)
+            self.sold_amount = self.bani_to_balance(new_balance)
             self.update_balance_display()
 
         # update history and notify
-        if "History" in data:
-            new_history_strings = data.get("History")
-            # convert to object to update local state
-            new_history_obj = self.bank_service.db.database_to_class_format(new_history_strings)
-            
-            # check if we have a new transaction
-            old_len = len(self.current_user.payment_history.history)
-            new_len = len(new_history_obj.history)
-            
-            if new_len > old_len:
+        if "History_seq" in data:
+            self.history_target = data.get("History_seq")
+            if not self.history_syncing:
+                self.start_history_sync()
+
+    def start_history_sync(self):
+        # the ledger query runs off the main thread, its result is applied on it by finish_history_sync
+        self.history_syncing = True
+        history = self.current_user.payment_history
+        target = self.history_target
+        # the thread only reads: the payments are added to the shown history on the main thread
+        base = history.saved_count
+        seen = PaymentsHistory(saved_count=base)
+
+        def read_ledger():
+            reloaded = None
+            try:
+                # decode only the ledger entries we have not seen yet
+                new_payments = self.bank_service.sync_payment_history(self.logged_in_user, seen, target)
+                if new_payments is None:
+                    # the ledger was rewritten or we are too far behind, reload the most recent page
+                    reloaded = self.bank_service.get_payment_history(self.logged_in_user, target)
+                    new_payments = []
+            except Exception:
+                # the next snapshot tries again
+                new_payments = None
+            self.main.after(0, self.finish_history_sync, history, base, seen, new_payments, reloaded, target)
+
+        threading.Thread(target=read_ledger, name="history-sync", daemon=True).start()
+
+    def finish_history_sync(self, history, base, seen, new_payments, reloaded, target):
+        self.history_syncing = False
+        # a payment saved by this window during the read moved the history: read again from there
+        stale = history is self.current_user.payment_history and history.saved_count != base
+        # skipped if the history was replaced in the meantime
+        if new_payments is not None and not stale and history is self.current_user.payment_history:
+            if reloaded is not None:
+                self.current_user.payment_history = reloaded
+            else:
+                for payment in new_payments:
+                    history.add_saved_payment(payment)
+                # skipped malformed entries still count as seen
+                history.saved_count = seen.saved_count
+
+            if new_payments:
                 # get the last payment
-                last_payment = new_history_obj.history[-1]
+                last_payment = new_payments[-1]
                 # check if I am the receiver
                 if last_payment.receiver == self.logged_in_user:
                      self.show_message("Money Received!", 
-                                       f"You received {self.float_to_balance(last_payment.amount)} from {last_payment.sender}!", 
+                                       f"You received {self.bani_to_balance(last_payment.amount)} from {last_payment.sender}!", 
                                        "info")
-            
-            # update local user history
-            self.current_user.payment_history = new_history_obj
+        if stale or self.history_target != target:
+            # a newer snapshot arrived during the read
+            self.start_history_sync()
 
     def show_message(self, title, message, message_type="info"):
         
@@ -555,6 +602,8 @@ class EDMBankApp:
 
     def logout_and_relaunch_login(self):
         if self.relauch_login_callback:
+            # the hub outlives this window: stop its updates
+            self.user_listener.unsubscribe()
             self.relauch_login_callback()
         else:
              self.show_in_app_login() 
@@ -571,6 +620,17 @@ class EDMBankApp:
         
         return int(x), int(y)
 
+    def transfer_key(self, pending, *inputs):
+        """
+        Idempotency key of the transfer a popup is about to send. Pressing SEND
+        again with the same inputs (after an error or a timeout) reuses the key,
+        so the transfer cannot happen twice; changed inputs get a new key.
+        """
+        if pending.get("inputs") != inputs:
+            pending["inputs"] = inputs
+            pending["key"] = uuid.uuid4().hex
+        return pending["key"]
+
     def show_in_app_login(self):
         login_window = tk.Toplevel(self.main)
         login_window.title("Login EDM Bank")
@@ -676,16 +736,21 @@ class EDMBankApp:
         tree.tag_configure('received', foreground='#2a9d8f') # green for received
 
         # populate data
-        history = self.current_user.payment_history.history
-        
-        if not history:
-            tree.insert("", "end", values=("No transactions", "-", "-"))
-        else:
+        payment_history = self.current_user.payment_history
+
+        def populate():
+            tree.delete(*tree.get_children())
+            history = payment_history.history
+
+            if not history:
+                tree.insert("", "end", values=("No transactions", "-", "-"))
+                return
+
             # show newest first
             for payment in reversed(history):
                 amount_val = payment.amount
-                amount_str = self.float_to_balance(amount_val)
-                
+                amount_str = self.bani_to_balance(amount_val)
+
                 if payment.sender == self.logged_in_user:
                     trans_type = "SENT ➔"
                     details = f"To: {payment.receiver}"
@@ -696,9 +761,25 @@ class EDMBankApp:
                     details = f"From: {payment.sender}"
                     display_amount = f"+ {amount_str}"
                     tag = 'received'
-                
+
                 tree.insert("", "end", values=(trans_type, details, display_amount), tags=(tag,))
 
+        def load_older():
+            # fetch the next page of the ledger only when asked for
+            payment_history.load_more()
+            populate()
+            if not payment_history.has_more:
+                older_btn.config(state='disabled')
+
+        populate()
+
+        # older transactions button
+        older_btn = tk.Button(history_window, text="OLDER", font=('Arial', 14, 'bold'),
+                              bg='#52796f', fg='white', command=load_older, width=15)
+        older_btn.pack(pady=(10, 0))
+        if not payment_history.has_more:
+            older_btn.config(state='disabled')
+
         # close button
         tk.Button(history_window, text="CLOSE", font=('Arial', 14, 'bold'),
                   bg='#354f52', fg='white', command=history_window.destroy, width=15).pack(pady=20)
@@ -775,7 +856,7 @@ class EDMBankApp:
             
             try:
                 # basic amount validation
-                transfer_amount = float(amount_str.replace(',', '.')) 
+                transfer_amount = parse_amount(amount_str)
                 if transfer_amount <= 0:
                     self.show_message("Error", "Deposit amount must be positive.", "error")
                     return
@@ -784,7 +865,7 @@ class EDMBankApp:
                 self.bank_service.add_money(self.current_user, transfer_amount, holder)
                 
                 # update UI
-                self.sold_amount = self.float_to_balance(self.current_user.balance)
+                self.sold_amount = self.bani_to_balance(self.current_user.balance)
                 self.update_balance_display()
                 
                 # close popup
@@ -792,7 +873,7 @@ class EDMBankApp:
 
                 # confirmation
                 self.show_message("Deposit Successful", 
-                                  f"Successfully deposited {self.float_to_balance(transfer_amount)} "
+                                  f"Successfully deposited {self.bani_to_balance(transfer_amount)} "
                                   f"from card ending in {card_number[-4:]}.\n\n"
                                   f"Your new balance is {self.sold_amount}.", 
                                   "info")
@@ -813,7 +894,108 @@ class EDMBankApp:
         cancel_btn.pack(side='left', padx=10)
     
     def make_payment(self):
-        self.show_message("Payments", "Pay bills and services", "info")
+        payment_window = tk.Toplevel(self.main)
+        payment_window.title("Scheduled Payments")
+        payment_window.configure(bg='#cad2c5')
+
+        popup_width = 650
+        popup_height = 620
+
+        x, y = self.get_center_coordinates(popup_width, popup_height)
+
+        payment_window.geometry(f"{popup_width}x{popup_height}+{x}+{y}")
+        payment_window.grab_set()
+
+        tk.Label(payment_window, text="Bills and Standing Orders", font=('Tex Gyre Chorus', 24, 'bold'),
+                 bg="#c6cec1", fg="#486e72").pack(pady=10)
+
+        # scheduled payments of the user
+        tree_frame = tk.Frame(payment_window, bg='#cad2c5')
+        tree_frame.pack(fill='both', expand=True, padx=20, pady=5)
+        columns = ("to", "amount", "next", "repeat", "last")
+        tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=6)
+        for column, title, width in (("to", "To", 120), ("amount", "Amount", 120), ("next", "Next payment", 140),
+                                     ("repeat", "Repeat", 90), ("last", "Last", 120)):
+            tree.heading(column, text=title)
+            tree.column(column, width=width, anchor='center')
+        tree.pack(fill='both', expand=True)
+
+        def populate():
+            tree.delete(*tree.get_children())
+            for schedule in self.bank_service.get_scheduled_payments(self.current_user):
+                next_run = schedule.next_run.astimezone().strftime("%Y-%m-%d") if schedule.next_run else "done"
+                tree.insert("", "end", iid=schedule.schedule_id,
+                            values=(schedule.receiver, self.bani_to_balance(schedule.amount), next_run,
+                                    (schedule.interval or "once").capitalize(), schedule.last_status or "-"))
+
+        # new scheduled payment
+        form = tk.Frame(payment_window, bg='#cad2c5')
+        form.pack(fill='x', padx=20)
+
+        def create_input_field(label_text, default=""):
+            tk.Label(form, text=label_text, font=('Tex Gyre Chorus', 16, 'bold'),
+                     bg='#cad2c5', fg='#354f52').pack(pady=(5, 2), anchor='w')
+            entry = tk.Entry(form, font=('Arial', 12), relief='flat', bd=2, bg='white')
+            entry.insert(0, default)
+            entry.pack(pady=(0, 5), fill='x')
+            return entry
+
+        iban_entry = create_input_field("Recipient IBAN (RO...):")
+        sum_entry = create_input_field("Sum (RON):")
+        date_entry = create_input_field("First payment (YYYY-MM-DD):", datetime.now().strftime("%Y-%m-%d"))
+        tk.Label(form, text="Repeat:", font=('Tex Gyre Chorus', 16, 'bold'),
+                 bg='#cad2c5', fg='#354f52').pack(pady=(5, 2), anchor='w')
+        repeat_var = tk.StringVar(value="Once")
+        ttk.Combobox(form, textvariable=repeat_var, values=("Once", "Daily", "Weekly", "Monthly"),
+                     state='readonly').pack(pady=(0, 5), fill='x')
+
+        def schedule():
+            iban = iban_entry.get().strip()
+            if not self.is_valid_ro_iban(iban):
+                self.show_message("Error", "Incorrect IBAN format (must start with RO and be 24 characters).", "error")
+                return
+            try:
+                amount = parse_amount(sum_entry.get())
+                # paid at 09:00 local time on the chosen day
+                first_run = datetime.strptime(date_entry.get().strip(), "%Y-%m-%d").replace(hour=9).astimezone()
+            except ValueError:
+                self.show_message("Error", "Invalid amount or date.", "error")
+                return
+            interval = None if repeat_var.get() == "Once" else repeat_var.get().lower()
+            try:
+                self.bank_service.schedule_iban_payment(self.current_user, iban, amount,
+                                                        first_run.astimezone(timezone.utc), interval)
+            except NegativeAmountError:
+                self.show_message("Error", "The amount must be positive.", "error")
+                return
+            except (AccountNotFoundError, SameAccountError) as e:
+                self.show_message("Error", str(e), "error")
+                return
+            except Exception as e:
+                self.show_message("Error", f"Scheduling failed: {e}", "error")
+                return
+            populate()
+            self.show_message("Success", f"Payment of {format_bani(amount)} scheduled.", "info")
+
+        def cancel_selected():
+            for schedule_id in tree.selection():
+                try:
+                    self.bank_service.cancel_scheduled_payment(self.current_user, schedule_id)
+                except ScheduleNotFoundError:
+                    pass
+            populate()
+
+        button_frame = tk.Frame(payment_window, bg='#cad2c5')
+        button_frame.pack(pady=15)
+        for text, command, color in (("SCHEDULE", schedule, '#52796f'), ("CANCEL SELECTED", cancel_selected, '#354f52'),
+                                     ("CLOSE", payment_window.destroy, '#354f52')):
+            tk.Button(button_frame, text=text, font=('Arial', 12, 'bold'), bg=color, fg='white',
+                      command=command, width=14).pack(side='left', padx=5)
+
+        try:
+            populate()
+        except Exception as e:
+            self.show_message("Error", f"Could not load the scheduled payments: {e}", "error")
 
     def settings(self):
         self.switch_view("settings")
@@ -822,37 +1004,40 @@ class EDMBankApp:
         self.show_message("Cards", "Manage your cards", "info")
 
     def show_stats(self):
-        self.show_message("Statistics", "Spending statistics", "info")
+        # last 6 months, read from the monthly rollups
+        today = datetime.now(timezone.utc)
+        first = today.year * 12 + today.month - 1 - 5
+        since = f"{first // 12:04d}-{first % 12 + 1:02d}"
+        try:
+            months = self.bank_service.get_monthly_statistics(self.current_user, since=since)
+        except Exception as e:
+            self.show_message("Error", f"Could not load statistics: {e}", "error")
+            return
+
+        if not months:
+            self.show_message("Statistics", "No payments in the last 6 months.", "info")
+            return
+        lines = []
+        for month in reversed(months):
+            lines.append(f"{month['Month']}: +{format_bani(month['In'])} / -{format_bani(month['Out'])}, {month['Count']} payments")
+            if month["Top"]:
+                lines.append("    top: " + ", ".join(name for name, _ in month["Top"]))
+        self.show_message("Statistics", "\n".join(lines), "info")
     
     def show_profile(self):
         # navigate to the profile page
         self.switch_view("profile")
         
-    def balance_to_float(self, balance_str):
-        """Converts a balance string (e.g., '1.250,00 RON') to a float."""
+    def balance_to_bani(self, balance_str):
+        """Converts a balance string (e.g., '1.250,00 RON') to bani."""
         try:
-            # Remove currency and thousand separator, replace decimal comma
-            return float(balance_str.upper().replace(' RON', '').replace('.', '').replace(',', '.'))
+            return parse_amount(balance_str)
         except ValueError:
-            return 0.0
+            return 0
 
-    def float_to_balance(self, amount_float):
-        """Converts a float to a balance string (e.g., '1.250,00 RON')."""
-        
-        # set locale for correct number formatting (Romanian/European)
-        try:
-            # try to set Romanian locale for correct format
-            locale.setlocale(locale.LC_ALL, 'ro_RO.UTF-8')
-        except locale.Error:
-            # fallback for systems where 'ro_RO.UTF-8' is not available
-            try:
-                locale.setlocale(locale.LC_ALL, 'C')
-            except locale.Error:
-                pass
-                
-        # manual format fallback (thousands dot, decimal comma) format to two decimal places, then handle custom separators
-        formatted = "{:,.2f}".format(amount_float).replace(",", "X").replace(".", ",").replace("X", ".")
-        return f"{formatted} RON"
+    def bani_to_balance(self, bani):
+        """Converts bani to a balance string (e.g., '1.250,00 RON')."""
+        return format_bani(bani)
 
     def update_balance_display(self):
         """Updates the label that shows the current balance."""
@@ -892,6 +1077,7 @@ class EDMBankApp:
         # button frame
         button_frame = tk.Frame(transfer_window, bg='#cad2c5')
         button_frame.pack(pady=10)
+        pending_transfer = {}
         
         def attempt_transfer():
             receiver = username_entry.get().strip()
@@ -902,20 +1088,21 @@ class EDMBankApp:
                 return
 
             try:
-                transfer_amount = float(amount.replace(',', '.'))
+                transfer_amount = parse_amount(amount)
                 if transfer_amount <= 0:
                     self.show_message("Error", "Transfer amount must be positive.", "error")
                     return
 
-                self.bank_service.transfer_money(self.current_user.credentials.username, receiver, transfer_amount)
+                key = self.transfer_key(pending_transfer, receiver, transfer_amount)
+                self.bank_service.transfer_money(self.current_user.credentials.username, receiver, transfer_amount, key=key)
                 self.current_user = self.bank_service.refresh_user(self.current_user)
 
                 # update UI
-                self.sold_amount = self.float_to_balance(self.current_user.balance)
+                self.sold_amount = self.bani_to_balance(self.current_user.balance)
                 self.update_balance_display()
                 
                 transfer_window.destroy()
-                self.show_message("Success", f"Transferring {transfer_amount:,.2f} RON to {receiver}...", "info")
+                self.show_message("Success", f"Transferring {format_bani(transfer_amount)} to {receiver}...", "info")
 
             except ValueError:
                 self.show_message("Error", "Invalid amount entered. Please use numbers.", "error")
@@ -923,6 +1110,8 @@ class EDMBankApp:
                 self.show_message("Error", "Account not found.", "error")
             except InsufficientFundsError:
                 self.show_message("Error", "Insufficient funds.", "error")
+            except TransientStorageError:
+                self.show_message("Error", "The bank is busy, press SEND to try again.", "error")
             except Exception as e:
                 self.show_message("Error", f"Transfer failed: {e}", "error")
             
@@ -976,6 +1165,7 @@ class EDMBankApp:
         # button frame
         button_frame = tk.Frame(transfer_window, bg='#cad2c5')
         button_frame.pack(pady=10)
+        pending_transfer = {}
         
         def attempt_iban_transfer():
             iban = iban_entry.get().strip()
@@ -990,22 +1180,23 @@ class EDMBankApp:
                 return
                 
             try:
-                transfer_amount = float(amount.replace(',', '.')) 
+                transfer_amount = parse_amount(amount)
                 
                 if transfer_amount <= 0:
                     self.show_message("Error", "Transfer amount must be positive.", "error")
                     return
                 
                 # perform IBAN transfer
-                self.bank_service.transfer_iban(self.current_user, iban, transfer_amount)
+                key = self.transfer_key(pending_transfer, iban, transfer_amount)
+                self.bank_service.transfer_iban(self.current_user, iban, transfer_amount, key=key)
                 
                 # update UI
-                self.sold_amount = self.float_to_balance(self.current_user.balance)
+                self.sold_amount = self.bani_to_balance(self.current_user.balance)
                 self.update_balance_display()
 
                 transfer_window.destroy()
                 self.show_message("Success", 
-                                  f"Bank transfer of {transfer_amount:,.2f} RON to IBAN {iban} has been initiated.", 
+                                  f"Bank transfer of {format_bani(transfer_amount)} to IBAN {iban} has been initiated.", 
                                   "info")
             except ValueError:
                 self.show_message("Error", "Invalid amount entered. Please use numbers.", "error")
@@ -1013,6 +1204,8 @@ class EDMBankApp:
                 self.show_message("Error", "Insufficient funds for this transfer.", "error")
             except AccountNotFoundError:
                 self.show_message("Error", "No account found with this IBAN.", "error")
+            except TransientStorageError:
+                self.show_message("Error", "The bank is busy, press SEND to try again.", "error")
             except Exception as e:
                 self.show_message("Error", f"Transfer failed: {e}", "error")
 
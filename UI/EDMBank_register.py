@@ -15,6 +15,8 @@ class EDMBankRegister:
         self.login_window = login_window 
         self.on_success_callback = on_success_callback # store the success callback
         self.bank_service = bank_service
+        # reserve card numbers and IBANs while the user fills in the form
+        self.bank_service.start_identifier_pool()
         
         # initialize UI Helper
         self.main.update_idletasks() # ensure geometry is applied
@@ -201,10 +203,7 @@ class EDMBankRegister:
         # if all validations pass, proceed with registration
         credentials = UserCredentials(username, password, email)
         pay_history = PaymentsHistory()
-        user_card = Card.generateCard()
-
-        while (self.bank_service.is_card_unique(user_card.number) == False):
-            user_card = Card.generateCard()
+        user_card = self.bank_service.claim_card()
 
         user = User(credentials, 0, pay_history, user_card)
         self.bank_service.add_user(user)
@@ -1,5 +1,10 @@
+import time
+# startup timings are measured from here (the interpreter's own startup is not included)
+STARTED = time.perf_counter()
+
 import sys
 import os
+import json
 import tkinter as tk
 
 
@@ -7,16 +12,40 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 ui_dir = os.path.join(current_dir, 'UI')
 sys.path.append(ui_dir)
 
-from DataBase.DataBase import Database
+from DataBase.Factory import create_database
 from services.bank_service import BankService
 from UI.EDMBank_launcher import run_login_app
 
+IMPORTS_DONE = time.perf_counter()
+
+# EDMBANK_STARTUP_REPORT=<file> appends the startup timings to the file as a JSON line,
+# EDMBANK_STARTUP_EXIT=1 closes the app once the login window is drawn (see benchmarks/startup_benchmark.py)
+STARTUP_REPORT_ENV = "EDMBANK_STARTUP_REPORT"
+STARTUP_EXIT_ENV = "EDMBANK_STARTUP_EXIT"
+
+def report_first_window(root):
+    root.update_idletasks()
+    first_window = time.perf_counter()
+    report_path = os.environ.get(STARTUP_REPORT_ENV)
+    if report_path:
+        with open(report_path, "a") as report:
+            report.write(json.dumps({
+                "imports_ms": (IMPORTS_DONE - STARTED) * 1000,
+                "first_window_ms": (first_window - STARTED) * 1000,
+            }) + "\n")
+    if os.environ.get(STARTUP_EXIT_ENV):
+        root.destroy()
+
 if __name__ == "__main__":
-    db = Database()
+    db = create_database()
+    # Firestore connects on a background thread while the login window is built
+    db.warm_up()
     bank_service = BankService(db)
     
     root = tk.Tk()
     
     run_login_app(root, bank_service)
+    # runs once the main loop has drawn the login window
+    root.after(0, report_first_window, root)
     
     root.mainloop()
@@ -0,0 +1,159 @@
+"""
+Stress test of concurrent transfers, withdrawals and deposits through the
+TransferExecutor, at several thread counts:
+
+    python benchmarks/concurrency_benchmark.py --backend sqlite --accounts 200 --operations 5000 --threads 1 2 4 8 16
+
+The operations share one User object per account (like a teller process), and
+--hot sends that fraction of them to the first 5 accounts, so many run on the
+same accounts at the same time. After each run the benchmark checks that money
+was conserved: the stored total equals the initial total plus the deposits
+minus the withdrawals that succeeded, every User object matches its stored
+balance, the balances match the ledger (audit_balances) and no balance is
+negative. --no-locks runs without the account locks to show the updates they
+prevent losing. With a low --initial-balance many withdrawals and transfers are
+rejected, which checks that a withdrawal made with a User balance older than
+the transfers that followed it is refused by the storage:
+
+    python benchmarks/concurrency_benchmark.py --backend sqlite --initial-balance 500
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataBase.Factory import create_database
+from services.bank_service import BankService
+from services.transfer_executor import TransferExecutor
+from user_management.credit_card import Card
+from exceptions import *
+
+INITIAL_BALANCE = 100_000
+# accounts receiving the --hot fraction of the operations
+HOT_ACCOUNTS = 5
+
+class NoLocks:
+    """Stand-in for AccountLocks with --no-locks."""
+    contended = 0
+
+    def hold(self, *usernames):
+        return nullcontext()
+
+    def __len__(self):
+        return 0
+
+def create_accounts(db, count, initial_balance):
+    # written in bulk with a ready hash: the password hashing is not what is measured
+    documents = []
+    for index in range(count):
+        username = f"user{index}"
+        card = Card.generateCard()
+        documents.append(({"Name": username, "Password_hash": "benchmark", "Card_Number": card.number, "CVV": card.cvv,
+                           "Expiry_date": card.expiry_date, "Sold": initial_balance, "Email": f"{username}@edmbank.ro",
+                           "Iban": card.IBAN}, []))
+    db.add_users_bulk(documents)
+    return {document["Name"]: db.get_user(document["Name"]) for document, _ in documents}
+
+def make_jobs(usernames, operations, hot, seed):
+    rng = random.Random(seed)
+    hot_accounts = usernames[:HOT_ACCOUNTS]
+
+    def pick():
+        return rng.choice(hot_accounts) if rng.random() < hot else rng.choice(usernames)
+
+    jobs = []
+    for _ in range(operations):
+        kind = rng.choices(("transfer", "withdraw", "deposit"), weights=(6, 2, 2))[0]
+        first = pick()
+        if kind == "transfer":
+            second = pick()
+            while second == first:
+                second = rng.choice(usernames)
+            jobs.append((kind, first, second, rng.randint(1, 500)))
+        else:
+            jobs.append((kind, first, None, rng.randint(1, 500)))
+    return jobs
+
+def run(bank, users, jobs, threads):
+    started = time.perf_counter()
+    with TransferExecutor(bank, max_workers=threads) as executor:
+        futures = []
+        for kind, first, second, amount in jobs:
+            if kind == "transfer":
+                futures.append(executor.transfer(first, second, amount))
+            elif kind == "withdraw":
+                futures.append(executor.withdraw(users[first], amount))
+            else:
+                futures.append(executor.add_money(users[first], amount, "benchmark"))
+        outcomes = []
+        for future in futures:
+            try:
+                future.result()
+                outcomes.append(True)
+            except InsufficientFundsError:
+                outcomes.append(False)
+        stats = executor.stats()
+    stats["elapsed"] = time.perf_counter() - started
+    stats["outcomes"] = outcomes
+    return stats
+
+def check(db, users, jobs, outcomes, initial_balance):
+    """Money created or lost by the run, User objects out of sync, ledger mismatches and negative balances."""
+    expected = initial_balance * len(users)
+    for (kind, _, _, amount), ok in zip(jobs, outcomes):
+        if ok and kind == "withdraw":
+            expected -= amount
+        elif ok and kind == "deposit":
+            expected += amount
+    stored = {username: db.get_fields(username, ["Sold"])["Sold"] for username in users}
+    # transfers change the accounts in the storage, not the shared User objects
+    transferred = {username: 0 for username in users}
+    for (kind, first, second, amount), ok in zip(jobs, outcomes):
+        if ok and kind == "transfer":
+            transferred[first] -= amount
+            transferred[second] += amount
+    out_of_sync = sum(1 for username, user in users.items() if user.balance + transferred[username] != stored[username])
+    audit = db.audit_balances(list(users))
+    negative = sum(1 for balance in stored.values() if balance < 0)
+    return sum(stored.values()) - expected, out_of_sync, len(audit["mismatches"]), negative
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="sqlite")
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--operations", type=int, default=5000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--initial-balance", type=int, default=INITIAL_BALANCE, help="balance of every account, in bani")
+    parser.add_argument("--hot", type=float, default=0.3, help="fraction of the operations on the hot accounts")
+    parser.add_argument("--no-locks", action="store_true", help="run without the account locks")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    failed = False
+    for threads in args.threads:
+        with tempfile.TemporaryDirectory() as tmp:
+            options = {"path": os.path.join(tmp, "bench.sqlite3")} if args.backend == "sqlite" else {}
+            db = create_database(args.backend, cache_size=0, **options)
+            users = create_accounts(db, args.accounts, args.initial_balance)
+            bank = BankService(db)
+            if args.no_locks:
+                bank.account_locks = NoLocks()
+            jobs = make_jobs(list(users), args.operations, args.hot, args.seed)
+            stats = run(bank, users, jobs, threads)
+            drift, out_of_sync, mismatches, negative = check(db, users, jobs, stats["outcomes"], args.initial_balance)
+            failed = failed or bool(drift or out_of_sync or mismatches or negative)
+            print(f"{threads:3d} threads: {len(jobs) / stats['elapsed']:9.1f} ops/s  "
+                  f"rejected {stats['outcomes'].count(False):5d}  contended {stats['contended']:5d}  "
+                  f"money drift {drift:+}  users out of sync {out_of_sync}  ledger mismatches {mismatches}  "
+                  f"negative {negative}")
+            if hasattr(db, "close"):
+                db.close()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
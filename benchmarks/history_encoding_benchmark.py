@@ -0,0 +1,76 @@
+"""
+Encode/decode time and payload size of the payment history encodings.
+
+Compares the legacy "sender -> amount -> receiver" strings with the packed
+msgpack payloads stored in the ledger, for a generated history:
+
+    python benchmarks/history_encoding_benchmark.py --entries 20000
+
+It also counts the payments that do not survive a round trip; the legacy format
+loses those whose usernames contain " -> ".
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataBase.MemoryDatabase import MemoryDatabase
+from user_management.payment_details import Payment
+
+def generate_history(count, seed):
+    rng = random.Random(seed)
+    usernames = [f"user{index}" for index in range(200)] + ["a -> b"]
+    return [Payment(rng.randrange(1, 500_000), *rng.sample(usernames, 2)) for _ in range(count)]
+
+def lost_payments(original, decoded):
+    # entries the decoder rejected are None in decoded
+    same = sum(1 for a, b in zip(original, decoded)
+               if b is not None and (a.sender, a.amount, a.receiver) == (b.sender, b.amount, b.receiver))
+    return len(original) - same
+
+def measure(encode, decode, payload_size, payments, rounds):
+    encode_time = decode_time = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        encoded = [encode(payment) for payment in payments]
+        encode_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = []
+        for payload in encoded:
+            try:
+                decoded.append(decode(payload))
+            except ValueError:
+                decoded.append(None)
+        decode_time += time.perf_counter() - start
+    return {
+        "encode_ms": encode_time / rounds * 1000,
+        "decode_ms": decode_time / rounds * 1000,
+        "bytes": sum(payload_size(payload) for payload in encoded),
+        "lost": lost_payments(payments, decoded),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    db = MemoryDatabase()
+    payments = generate_history(args.entries, args.seed)
+    encodings = {
+        "legacy": (db._encode_payment, db._decode_payment, lambda payload: len(payload.encode("utf-8"))),
+        "packed": (db._pack_payment, db._unpack_payment, len),
+    }
+    print(f"{args.entries} payments, average of {args.rounds} rounds")
+    for name, (encode, decode, payload_size) in encodings.items():
+        stats = measure(encode, decode, payload_size, payments, args.rounds)
+        print(f"{name:>7}: encode {stats['encode_ms']:8.2f} ms  decode {stats['decode_ms']:8.2f} ms  "
+              f"payload {stats['bytes'] / 1024:8.1f} KiB  lost {stats['lost']}")
+
+if __name__ == "__main__":
+    main()
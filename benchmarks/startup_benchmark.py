@@ -0,0 +1,83 @@
+"""
+Import time and time to the first (login) window of app.py.
+
+Starts the app several times with EDMBANK_STARTUP_EXIT=1, so it closes once the
+login window is drawn, and reports the median timings and the heaviest imports
+(from python -X importtime):
+
+    python benchmarks/startup_benchmark.py --runs 5 --history startup_history.jsonl
+
+--history appends the result as a JSON line, to track startup across releases.
+The storage backend is chosen with EDMBANK_STORAGE like for the app; a display
+is required.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_app(report_path):
+    env = dict(os.environ, EDMBANK_STARTUP_REPORT=report_path, EDMBANK_STARTUP_EXIT="1")
+    completed = subprocess.run([sys.executable, "-X", "importtime", os.path.join(ROOT, "app.py")],
+                               cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return completed.stderr
+
+def heaviest_imports(importtime_output, count):
+    """Top-level imports sorted by cumulative time, as (module, milliseconds)."""
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # nested imports are indented below the module that triggered them
+        if not name[1:].startswith(" "):
+            imports.append((name.strip(), int(cumulative) / 1000))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:count]
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="heaviest imports to list")
+    parser.add_argument("--history", help="JSON lines file the result is appended to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report_path = os.path.join(tmp, "startup.jsonl")
+        for _ in range(args.runs):
+            importtime_output = run_app(report_path)
+        with open(report_path) as report:
+            runs = [json.loads(line) for line in report]
+
+    result = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "storage": os.environ.get("EDMBANK_STORAGE", "firestore"),
+        "runs": len(runs),
+        "imports_ms": statistics.median(run["imports_ms"] for run in runs),
+        "first_window_ms": statistics.median(run["first_window_ms"] for run in runs),
+    }
+    print(f"imports        {result['imports_ms']:8.1f} ms (median of {len(runs)})")
+    print(f"first window   {result['first_window_ms']:8.1f} ms")
+    print("heaviest imports (last run):")
+    for name, milliseconds in heaviest_imports(importtime_output, args.top):
+        print(f"  {milliseconds:8.1f} ms  {name}")
+
+    if args.history:
+        with open(args.history, "a") as history:
+            history.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Transfer throughput and latency under concurrent load.
+
+Compares the old transfer path (two get_user reads, balances changed in Python,
+two modify_user writes) with the atomic BankService.transfer_money, on a local
+storage backend:
+
+    python benchmarks/transfer_benchmark.py --backend sqlite --accounts 1000 --threads 8 --transfers 5000
+
+Besides transfers/sec and latency percentiles it reports the money created or
+lost by the run, which must be 0 for a correct transfer path.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+from DataBase.Factory import create_database
+from services.bank_service import BankService
+from user_management.credit_card import Card
+from user_management.payment_details import Payment
+from exceptions import *
+
+INITIAL_BALANCE = 1000
+
+def legacy_transfer(db, sender, receiver, amount):
+    """The transfer path used before transfers were atomic."""
+    sender = db.get_user(sender)
+    receiver = db.get_user(receiver)
+    if sender.balance < amount:
+        raise InsufficientFundsError
+    sender.balance -= amount
+    receiver.balance += amount
+    payment = Payment(amount, sender.credentials.username, receiver.credentials.username)
+    sender.payment_history.add_payment(payment)
+    receiver.payment_history.add_payment(payment)
+    db.modify_user(sender)
+    db.modify_user(receiver)
+
+def create_accounts(db, count):
+    # hash the shared test password once instead of once per account
+    password_hash = bcrypt.hashpw(b"benchmark", bcrypt.gensalt(4)).decode()
+    documents = []
+    for index in range(count):
+        username = f"user{index}"
+        card = Card.generateCard()
+        documents.append(({"Name": username, "Password_hash": password_hash, "Card_Number": card.number, "CVV": card.cvv,
+                           "Expiry_date": card.expiry_date, "Sold": INITIAL_BALANCE, "Email": f"{username}@edmbank.ro",
+                           "Iban": card.IBAN}, []))
+    db.add_users_bulk(documents)
+    return [document["Name"] for document, _ in documents]
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+def run(transfer, usernames, transfers, threads, seed):
+    rng = random.Random(seed)
+    jobs = []
+    for _ in range(transfers):
+        sender, receiver = rng.sample(usernames, 2)
+        jobs.append((sender, receiver, rng.randint(1, 50)))
+
+    def timed(job):
+        start = time.perf_counter()
+        try:
+            transfer(*job)
+            ok = True
+        except InsufficientFundsError:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(timed, jobs))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "elapsed": elapsed,
+        "committed": sum(1 for _, ok in results if ok),
+        "per_second": len(results) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+def total_money(db, usernames):
+    return sum(db.get_user(username).balance for username in usernames)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="sqlite")
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--transfers", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for name in ("legacy", "atomic"):
+        with tempfile.TemporaryDirectory() as tmp:
+            options = {"path": os.path.join(tmp, "bench.sqlite3")} if args.backend == "sqlite" else {}
+            db = create_database(args.backend, **options)
+            usernames = create_accounts(db, args.accounts)
+            if name == "legacy":
+                transfer = lambda sender, receiver, amount: legacy_transfer(db, sender, receiver, amount)
+            else:
+                transfer = BankService(db).transfer_money
+
+            stats = run(transfer, usernames, args.transfers, args.threads, args.seed)
+            drift = total_money(db, usernames) - INITIAL_BALANCE * len(usernames)
+            print(f"{name:>7}: {stats['per_second']:9.1f} transfers/s  "
+                  f"p50 {stats['p50_ms']:7.2f} ms  p99 {stats['p99_ms']:7.2f} ms  "
+                  f"committed {stats['committed']}/{args.transfers}  money drift {drift:+}")
+            if hasattr(db, "close"):
+                db.close()
+
+if __name__ == "__main__":
+    main()
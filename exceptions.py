@@ -12,4 +12,28 @@ class NegativeAmountError(Exception):
 
 class RequestError(Exception):
     """Raised when there is an error processing a support request."""
-    pass
\ No newline at end of file
+    pass
+
+class SameAccountError(Exception):
+    """Raised when the sender and the receiver of a transfer are the same account."""
+    pass
+
+class TransientStorageError(Exception):
+    """Raised when the storage is busy or unreachable and the operation can be retried."""
+    pass
+
+class TransferKeyError(Exception):
+    """Raised when a transfer key is reused for a different transfer."""
+    pass
+
+class StorageSchemaError(Exception):
+    """Raised when the stored data is in an older format that must be migrated first."""
+    pass
+
+class ScheduleNotFoundError(Exception):
+    """Raised when a scheduled payment does not exist or belongs to another account."""
+    pass
+
+class IdentifierInUseError(Exception):
+    """Raised when a new account's card number or IBAN already belongs to another account."""
+    pass
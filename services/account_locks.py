@@ -0,0 +1,50 @@
+import threading
+from contextlib import contextmanager
+
+class AccountLocks:
+    """
+    One lock per account, existing only while it is held or awaited.
+    hold(*usernames) takes the locks of the accounts in sorted order: two threads
+    holding overlapping accounts never wait on each other in a cycle, and
+    operations on disjoint accounts do not wait at all.
+    The locks are reentrant, but a thread already holding accounts must not
+    take one that sorts before them.
+    """
+    def __init__(self):
+        self._mutex = threading.Lock()
+        # username -> [lock, threads holding or waiting for it]
+        self._locks: dict[str, list] = {}
+        self.contended = 0
+
+    @contextmanager
+    def hold(self, *usernames):
+        names = sorted(set(usernames))
+        with self._mutex:
+            entries = []
+            for name in names:
+                entry = self._locks.get(name)
+                if entry is None:
+                    entry = self._locks[name] = [threading.RLock(), 0]
+                entry[1] += 1
+                entries.append((name, entry))
+        acquired = []
+        try:
+            for _, entry in entries:
+                if not entry[0].acquire(blocking=False):
+                    with self._mutex:
+                        self.contended += 1
+                    entry[0].acquire()
+                acquired.append(entry)
+            yield
+        finally:
+            for entry in reversed(acquired):
+                entry[0].release()
+            with self._mutex:
+                for name, entry in entries:
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._locks[name]
+
+    def __len__(self):
+        with self._mutex:
+            return len(self._locks)
@@ -0,0 +1,43 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+class AsyncAccountLocks:
+    """
+    asyncio counterpart of AccountLocks, for coroutines of one event loop.
+    hold(*usernames) takes one asyncio.Lock per account in sorted order, so
+    coroutines holding overlapping accounts never wait on each other in a cycle.
+    The locks are not reentrant: a coroutine must not hold an account twice.
+    """
+    def __init__(self):
+        # username -> [lock, coroutines holding or waiting for it]
+        self._locks: dict[str, list] = {}
+        self.contended = 0
+
+    @asynccontextmanager
+    async def hold(self, *usernames):
+        # no await between the lookups and the counts: no other coroutine runs in between
+        entries = []
+        for name in sorted(set(usernames)):
+            entry = self._locks.get(name)
+            if entry is None:
+                entry = self._locks[name] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            entries.append((name, entry))
+        acquired = []
+        try:
+            for _, entry in entries:
+                if entry[0].locked():
+                    self.contended += 1
+                await entry[0].acquire()
+                acquired.append(entry)
+            yield
+        finally:
+            for entry in reversed(acquired):
+                entry[0].release()
+            for name, entry in entries:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[name]
+
+    def __len__(self):
+        return len(self._locks)
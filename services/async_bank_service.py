@@ -0,0 +1,221 @@
+import asyncio
+import uuid
+from DataBase.AsyncStorage import AsyncStorage
+from user_management.user import User
+from user_management.payment_details import Payment, HISTORY_PAGE_SIZE
+from user_management.request import Request
+from user_management.credit_card import Card
+from user_management.money import check_amount, format_bani
+from services.identifier_pool import IdentifierPool
+from services.async_account_locks import AsyncAccountLocks
+from services.retry import retry_with_backoff_async
+from services.bank_service import CASH_WITHDRAWAL, summarize_rollup, batch_chunks
+from exceptions import *
+
+class AsyncBankService:
+    """
+    asyncio variant of BankService, on top of an AsyncStorage (see create_async_database).
+    Independent storage calls are awaited concurrently with asyncio.gather.
+    """
+    def __init__(self, db: AsyncStorage):
+        self.db = db
+        # created on first use, see claim_card
+        self.identifier_pool = None
+        # held around every balance change: coroutines may share User objects and accounts
+        self.account_locks = AsyncAccountLocks()
+
+    async def transfer_money(self, sender: str, receiver: str, amount: int, key: str = None):
+        """
+        Transfers money between two users identified by username.
+        Both accounts are read, checked and written in a single atomic commit.
+        The key identifies the transfer: retrying with the same key (after a
+        timeout or a contention error) never moves the money twice.
+        """
+        check_amount(amount)
+
+        key = key or uuid.uuid4().hex
+        # transfers on the same accounts wait here instead of conflicting in the storage
+        async with self.account_locks.hold(sender, receiver):
+            return await retry_with_backoff_async(lambda: self.db.transfer(sender, receiver, amount, key=key))
+
+    async def transfer_batch(self, items, chunk_size: int = None) -> list:
+        """Runs many transfers in order, chunk by chunk, see BankService.iter_transfer_batch."""
+        chunk_size = min(chunk_size or self.db.transfer_batch_max, self.db.transfer_batch_max)
+        results = []
+        for chunk in batch_chunks(items, chunk_size):
+            results.extend(await retry_with_backoff_async(lambda: self.db.transfer_batch(chunk)))
+        return results
+
+    async def transfer_iban(self, sender_user: User, iban: str, amount: int, key: str = None):
+        """
+        Transfers money to a user identified by IBAN.
+        Retries with the same key are idempotent, see transfer_money.
+        """
+        check_amount(amount)
+
+        if (sender_user.balance < amount):
+            raise InsufficientFundsError(f"Insuficient funds: {format_bani(sender_user.balance)} < {format_bani(amount)}")
+
+        try:
+            receiver = await self.db.resolve_iban(iban)
+        except AccountNotFoundError:
+            raise AccountNotFoundError(f"No user found with IBAN: {iban}")
+
+        key = key or uuid.uuid4().hex
+        sender = sender_user.credentials.username
+        async with self.account_locks.hold(sender, receiver):
+            result = await retry_with_backoff_async(lambda: self.db.transfer(sender, receiver, amount, key=key))
+
+            # keep the caller's copy in sync with what was committed
+            sender_user.set_synced_balance(result.sender_balance)
+            if not result.replayed:
+                # a replayed transfer is already in the history
+                sender_user.payment_history.add_saved_payment(result.payment)
+        return result
+
+    async def refresh_user(self, user: User) -> User:
+        return await self.db.get_user(user.credentials.username)
+
+    async def withdraw(self, user: User, amount: int):
+        check_amount(amount)
+        # the change of user.balance and the write are one step for the other coroutines
+        async with self.account_locks.hold(user.credentials.username):
+            user.balance -= amount
+            # recorded in the ledger like a deposit, so it shows in the history and the rollups
+            payment = Payment(amount, user.credentials.username, CASH_WITHDRAWAL)
+            user.payment_history.add_payment(payment)
+            try:
+                # the funds are checked against the stored balance, which transfers may have lowered
+                await self.db.modify_user(user)
+            except InsufficientFundsError:
+                user.balance += amount
+                user.payment_history.discard_payment(payment)
+                raise
+
+    async def add_money(self, user: User, amount: int, sender_name: str):
+        check_amount(amount)
+        async with self.account_locks.hold(user.credentials.username):
+            user.balance += amount
+
+            # Create payment record for the deposit
+            payment = Payment(amount, sender_name, user.credentials.username)
+            user.payment_history.add_payment(payment)
+
+            await self.db.modify_user(user)
+
+    async def checkUserLogin(self, username, Password):
+        return bool(await self.db.checkUserLogin(username, Password))
+
+    async def is_card_unique(self, card_number):
+        return not await self.db.card_exists(card_number)
+
+    async def is_username_unique(self, username):
+        try:
+            await self.db.get_fields(username, ["Name"])
+            return False
+        except AccountNotFoundError:
+            return True
+
+    async def check_registration(self, username, card_number):
+        """
+        Checks the username and the card number at the same time.
+        Returns (username is unique, card number is unique).
+        """
+        return tuple(await asyncio.gather(self.is_username_unique(username), self.is_card_unique(card_number)))
+
+    async def claim_card(self) -> Card:
+        """
+        Returns a new card whose number and IBAN are reserved for the caller.
+        """
+        if self.identifier_pool is None:
+            self.identifier_pool = IdentifierPool(self.db.storage)
+            self.identifier_pool.start()
+        card_number, iban = await asyncio.to_thread(self.identifier_pool.claim)
+        return Card.generateCard(number=card_number, IBAN=iban)
+
+    async def change_password(self, user: User, old_password: str, new_password: str):
+        """
+        Changes the user's password after verifying the old one.
+        """
+        import bcrypt
+        stored_hash = user.credentials.password.encode('utf-8')
+
+        # bcrypt is slow on purpose, keep it off the event loop
+        if not await asyncio.to_thread(bcrypt.checkpw, old_password.encode('utf-8'), stored_hash):
+             raise ValueError("Incorrect old password.")
+
+        new_hashed = await asyncio.to_thread(bcrypt.hashpw, new_password.encode('utf-8'), bcrypt.gensalt())
+        user.credentials.password = new_hashed.decode('utf-8')
+
+        await self.db.modify_user(user)
+
+    async def add_user(self, user : User):
+        await self.db.add_user(user)
+
+    async def get_user(self, username):
+        return await self.db.get_user(username)
+
+    async def get_user_by_card(self, card_number):
+        return await self.db.get_user(await self.db.resolve_card(card_number))
+
+    async def get_users(self, usernames):
+        """
+        Retrieves many users with one batched database call.
+        Returns them in the order of usernames, with None for the accounts that do not exist.
+        """
+        return await self.db.get_users(usernames)
+
+    async def get_fields(self, username, fields):
+        return await self.db.get_fields(username, fields)
+
+    async def get_balance(self, username) -> int:
+        return (await self.db.get_fields(username, ["Sold"]))["Sold"]
+
+    async def get_payment_history(self, username, saved_count=0):
+        """
+        Returns the payment history of a user. Its pages are loaded synchronously
+        on access, so read them outside the event loop.
+        """
+        return await self.db.get_payment_history(username, saved_count)
+
+    async def get_history(self, user: User, since=None, until=None, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """One page of the user's payments in [since, until), see BankService.get_history."""
+        return await self.db.get_history(user.credentials.username, since, until, limit, cursor)
+
+    async def get_monthly_statistics(self, user: User, since=None, until=None, top=3):
+        """Monthly totals of the user from the rollups, see BankService.get_monthly_statistics."""
+        rollups = await self.db.get_rollups(user.credentials.username, since, until)
+        return [summarize_rollup(rollup, top) for rollup in rollups]
+
+    async def get_balance_at(self, user: User, at=None):
+        """See BankService.get_balance_at."""
+        return await self.db.get_balance_at(user.credentials.username, at=at)
+
+    async def sync_payment_history(self, username, history, saved_count):
+        return await self.db.sync_payment_history(username, history, saved_count)
+
+    def cache_stats(self):
+        return self.db.cache.stats() if self.db.cache is not None else None
+
+    async def delete_user(self, username):
+        await self.db.delete_user(username)
+
+    async def listen_to_user_changes(self, username, callback):
+        """
+        Listen to real-time changes for a user. The callback runs on the listener's thread.
+        """
+        return await self.db.listen_to_user(username, callback)
+
+    async def create_support_request(self, user: User, title: str, concern: str):
+        request = Request(
+            username=user.credentials.username,
+            email=user.credentials.email,
+            title=title,
+            concern=concern
+        )
+        await self.db.add_request(request)
+
+    async def close(self):
+        if self.identifier_pool is not None:
+            await asyncio.to_thread(self.identifier_pool.close)
+        await self.db.close()
@@ -1,84 +1,154 @@
-from DataBase.DataBase import Database
+import uuid
+from itertools import islice
+from DataBase.Storage import Storage
 from user_management.user import User
-from user_management.payment_details import Payment
+from user_management.payment_details import Payment, HISTORY_PAGE_SIZE
 from user_management.request import Request
+from user_management.credit_card import Card
+from user_management.scheduled_payment import ScheduledPayment
+from user_management.money import check_amount, format_bani
+from services.account_locks import AccountLocks
+from services.identifier_pool import IdentifierPool
+from services.listener_hub import ListenerHub
+from services.payment_scheduler import PaymentScheduler, utc_now
+from services.retry import retry_with_backoff
 from exceptions import *
-import bcrypt
+
+# counterparty of the ledger entries of cash withdrawals
+CASH_WITHDRAWAL = "Cash withdrawal"
+
+def summarize_rollup(rollup, top=3):
+    """Monthly rollup -> statistics with only the top counterparties."""
+    counterparties = sorted(rollup["Counterparties"].items(), key=lambda item: item[1], reverse=True)
+    return {
+        "Month": rollup["Month"],
+        "In": rollup["In"],
+        "Out": rollup["Out"],
+        "Count": rollup["Count"],
+        "Top": counterparties[:top]
+    }
+
+def batch_chunks(items, size):
+    """
+    Splits (sender, receiver, amount[, key]) items into lists of at most size
+    (sender, receiver, amount, key) items, consuming items lazily. Items without
+    a key get a new one, so a chunk can be retried without moving money twice.
+    """
+    items = iter(items)
+    while True:
+        chunk = [(item[0], item[1], item[2], item[3] if len(item) > 3 and item[3] else uuid.uuid4().hex)
+                 for item in islice(items, size)]
+        if not chunk:
+            return
+        yield chunk
 
 class BankService:
-    def __init__(self, db: Database):
+    def __init__(self, db: Storage):
         self.db = db
+        # created on first use, see start_identifier_pool
+        self.identifier_pool = None
+        # created on first use, see start_listener_hub
+        self.listener_hub = None
+        # created by start_payment_scheduler, in the process that pays the scheduled payments
+        self.payment_scheduler = None
+        # held around every balance change: callers on several threads (e.g. a
+        # TransferExecutor) may share User objects and accounts
+        self.account_locks = AccountLocks()
 
-    def transfer_money(self, sender: str, receiver: str, amount: float):
-        try:
-            sender = self.db.get_user(sender)
-            receiver = self.db.get_user(receiver)
-        except AccountNotFoundError:
-            raise AccountNotFoundError
-        
-        if amount <= 0:
-            raise NegativeAmountError
+    def transfer_money(self, sender: str, receiver: str, amount: int, key: str = None):
+        """
+        Transfers money between two users identified by username.
+        Both accounts are read, checked and written in a single atomic commit.
+        The key identifies the transfer: retrying with the same key (after a
+        timeout or a contention error) never moves the money twice.
+        """
+        check_amount(amount)
 
-        if (sender.balance < amount):
-            raise InsufficientFundsError(f"Insuficient funds: {sender.balance}$ < {amount}$")
-        
-        sender.balance -= amount
-        receiver.balance += amount
+        key = key or uuid.uuid4().hex
+        # transfers on the same accounts wait here instead of conflicting in the storage
+        with self.account_locks.hold(sender, receiver):
+            return retry_with_backoff(lambda: self.db.transfer(sender, receiver, amount, key=key))
 
-        # Create payment record
-        payment = Payment(amount, sender.credentials.username, receiver.credentials.username)
-        sender.payment_history.add_payment(payment)
-        receiver.payment_history.add_payment(payment)
+    def transfer_batch(self, items, chunk_size: int = None) -> list:
+        """
+        Runs many transfers, e.g. a payroll: items are (sender, receiver, amount)
+        or (sender, receiver, amount, key) tuples, applied in order.
+        Returns per item the TransferResult or the exception that rejected it,
+        see iter_transfer_batch.
+        """
+        return list(self.iter_transfer_batch(items, chunk_size))
 
-        self.db.modify_user(sender)
-        self.db.modify_user(receiver)
+    def iter_transfer_batch(self, items, chunk_size: int = None):
+        """
+        Generator variant of transfer_batch, which reads items lazily: each chunk
+        of chunk_size items (at most the storage's transfer_batch_max) is read in
+        bulk and committed atomically, then its results are yielded.
+        A chunk that keeps failing with TransientStorageError raises it, the
+        chunks before it stay committed; running the same keyed items again
+        replays them.
+        """
+        chunk_size = min(chunk_size or self.db.transfer_batch_max, self.db.transfer_batch_max)
+        for chunk in batch_chunks(items, chunk_size):
+            yield from retry_with_backoff(lambda: self.db.transfer_batch(chunk))
 
-    def transfer_iban(self, sender_user: User, iban: str, amount: float):
+    def transfer_iban(self, sender_user: User, iban: str, amount: int, key: str = None):
         """
         Transfers money to a user identified by IBAN.
+        Retries with the same key are idempotent, see transfer_money.
         """
-        if amount <= 0:
-            raise NegativeAmountError
+        check_amount(amount)
 
         if (sender_user.balance < amount):
-            raise InsufficientFundsError(f"Insuficient funds: {sender_user.balance}$ < {amount}$")
+            raise InsufficientFundsError(f"Insuficient funds: {format_bani(sender_user.balance)} < {format_bani(amount)}")
         
-        # Try to find the receiver by IBAN
+        # Try to find the receiver by IBAN (one keyed read of the IBAN index)
         try:
-            receiver_user = self.db.get_user_by_iban(iban)
+            receiver = self.db.resolve_iban(iban)
         except AccountNotFoundError:
             raise AccountNotFoundError(f"No user found with IBAN: {iban}")
 
-        sender_user.balance -= amount
-        receiver_user.balance += amount
-        
-        # Create payment record
-        payment = Payment(amount, sender_user.credentials.username, receiver_user.credentials.username)
-        sender_user.payment_history.add_payment(payment)
-        receiver_user.payment_history.add_payment(payment)
-        
-        self.db.modify_user(sender_user)
-        self.db.modify_user(receiver_user)
+        key = key or uuid.uuid4().hex
+        sender = sender_user.credentials.username
+        with self.account_locks.hold(sender, receiver):
+            result = retry_with_backoff(lambda: self.db.transfer(sender, receiver, amount, key=key))
+
+            # keep the caller's copy in sync with what was committed
+            sender_user.set_synced_balance(result.sender_balance)
+            if not result.replayed:
+                # a replayed transfer is already in the history
+                sender_user.payment_history.add_saved_payment(result.payment)
+        return result
 
     def refresh_user(self, user: User) -> User:
         user_updated = self.db.get_user(username=user.credentials.username)
         return user_updated
 
-    def withdraw(self, user: User, amount: float):
-        if (user.balance < amount):
-            raise InsufficientFundsError(f"Insuficient funds: {user.balance}$ < {amount}$")
-        
-        user.balance -= amount
-        self.db.modify_user(user)
+    def withdraw(self, user: User, amount: int):
+        check_amount(amount)
+        # the change of user.balance and the write are one step for the other threads
+        with self.account_locks.hold(user.credentials.username):
+            user.balance -= amount
+            # recorded in the ledger like a deposit, so it shows in the history and the rollups
+            payment = Payment(amount, user.credentials.username, CASH_WITHDRAWAL)
+            user.payment_history.add_payment(payment)
+            try:
+                # the funds are checked against the stored balance, which transfers may have lowered
+                self.db.modify_user(user)
+            except InsufficientFundsError:
+                user.balance += amount
+                user.payment_history.discard_payment(payment)
+                raise
 
-    def add_money(self, user: User, amount: float, sender_name: str):
-        user.balance += amount
-        
-        # Create payment record for the deposit
-        payment = Payment(amount, sender_name, user.credentials.username)
-        user.payment_history.add_payment(payment)
-        
-        self.db.modify_user(user)
+    def add_money(self, user: User, amount: int, sender_name: str):
+        check_amount(amount)
+        with self.account_locks.hold(user.credentials.username):
+            user.balance += amount
+
+            # Create payment record for the deposit
+            payment = Payment(amount, sender_name, user.credentials.username)
+            user.payment_history.add_payment(payment)
+
+            self.db.modify_user(user)
     
     def checkUserLogin(self, username, Password):
         if self.db.checkUserLogin(username, Password):
@@ -94,12 +164,30 @@ class BankService:
             return False
         return True
     
+    def start_identifier_pool(self):
+        """
+        Starts reserving unique card numbers and IBANs in the background,
+        e.g. when the registration window opens.
+        """
+        if self.identifier_pool is None:
+            self.identifier_pool = IdentifierPool(self.db)
+        self.identifier_pool.start()
+
+    def claim_card(self) -> Card:
+        """
+        Returns a new card whose number and IBAN are reserved for the caller,
+        so no uniqueness check is needed before add_user.
+        """
+        self.start_identifier_pool()
+        card_number, iban = self.identifier_pool.claim()
+        return Card.generateCard(number=card_number, IBAN=iban)
+
     def is_username_unique(self, username):
         """
         Checks if the username is unique.
         """
         try:
-            self.db.get_user(username)
+            self.db.get_fields(username, ["Name"])
             return False
         except AccountNotFoundError:
             return True
@@ -108,6 +196,8 @@ class BankService:
         """
         Changes the user's password after verifying the old one.
         """
+        import bcrypt
+
         # Verify old password
         stored_hash = user.credentials.password.encode('utf-8')
         
@@ -136,6 +226,72 @@ class BankService:
         """
         return self.db.get_user(username)
 
+    def get_user_by_card(self, card_number):
+        """
+        Retrieves the owner of a card number, e.g. for a teller.
+        """
+        return self.db.get_user(self.db.resolve_card(card_number))
+
+    def get_payment_history(self, username, saved_count=0):
+        """
+        Returns the payment history of a user, loaded page by page from the ledger.
+        """
+        return self.db.get_payment_history(username, saved_count)
+
+    def get_history(self, user: User, since=None, until=None, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """
+        Returns one page of the user's payments committed between since (included)
+        and until (excluded), e.g. the last 30 days, without loading the whole history.
+        Returns (payments oldest first, cursor of the next older page or None).
+        """
+        return self.db.get_history(user.credentials.username, since, until, limit, cursor)
+
+    def get_monthly_statistics(self, user: User, since=None, until=None, top=3):
+        """
+        Monthly totals of the user from the precomputed rollups ("YYYY-MM" bounds,
+        both included): one record per month is read, not the payments.
+        Returns dicts with Month, In, Out, Count and Top, the counterparties
+        with the largest amounts exchanged as (name, amount) pairs.
+        """
+        rollups = self.db.get_rollups(user.credentials.username, since, until)
+        return [summarize_rollup(rollup, top) for rollup in rollups]
+
+    def get_balance_at(self, user: User, at=None):
+        """
+        Balance of the user at a past date (its ledger balance if at is None),
+        from the closest balance checkpoint and the ledger entries after it.
+        """
+        return self.db.get_balance_at(user.credentials.username, at=at)
+
+    def get_fields(self, username, fields):
+        """
+        Retrieves only the given fields of a user, e.g. ["Sold", "Iban"].
+        """
+        return self.db.get_fields(username, fields)
+
+    def get_balance(self, username) -> int:
+        return self.db.get_fields(username, ["Sold"])["Sold"]
+
+    def sync_payment_history(self, username, history, saved_count):
+        """
+        Appends to history the payments it is missing, up to saved_count.
+        Returns them, or None if the history must be reloaded with get_payment_history.
+        """
+        return self.db.sync_payment_history(username, history, saved_count)
+
+    def get_users(self, usernames):
+        """
+        Retrieves many users with one batched database call.
+        Returns them in the order of usernames, with None for the accounts that do not exist.
+        """
+        return self.db.get_users(usernames)
+
+    def cache_stats(self):
+        """
+        Returns the hit/miss counters of the user cache, or None if it is disabled.
+        """
+        return self.db.cache.stats() if self.db.cache is not None else None
+
     def delete_user(self, username):
         """
         Deletes a user from the database.
@@ -148,6 +304,78 @@ class BankService:
         """
         return self.db.listen_to_user(username, callback)
 
+    def schedule_payment(self, sender: str, receiver: str, amount: int, first_run, interval: str = None) -> ScheduledPayment:
+        """
+        Schedules a transfer at first_run (an aware datetime), repeated daily,
+        weekly or monthly with interval, once without. Both accounts must exist.
+        """
+        check_amount(amount)
+        if sender == receiver:
+            raise SameAccountError(f"Cannot transfer money from '{sender}' to itself.")
+        schedule = ScheduledPayment(sender, receiver, amount, first_run, interval)
+        # raise AccountNotFoundError for unknown accounts
+        self.db.get_fields(sender, ["Name"])
+        self.db.get_fields(receiver, ["Name"])
+        self.db.save_schedules([schedule])
+        if self.payment_scheduler is not None:
+            self.payment_scheduler.add(schedule)
+        return schedule
+
+    def schedule_iban_payment(self, sender_user: User, iban: str, amount: int, first_run, interval: str = None) -> ScheduledPayment:
+        """schedule_payment to the account identified by IBAN."""
+        try:
+            receiver = self.db.resolve_iban(iban)
+        except AccountNotFoundError:
+            raise AccountNotFoundError(f"No user found with IBAN: {iban}")
+        return self.schedule_payment(sender_user.credentials.username, receiver, amount, first_run, interval)
+
+    def get_scheduled_payments(self, user: User) -> list:
+        return self.db.get_schedules(user.credentials.username)
+
+    def cancel_scheduled_payment(self, user: User, schedule_id: str):
+        """Cancels a scheduled payment of the user; occurrences already paid are not reverted."""
+        schedule = self.db.read_schedules([schedule_id]).get(schedule_id)
+        if schedule is None or schedule.sender != user.credentials.username:
+            raise ScheduleNotFoundError(f"No scheduled payment '{schedule_id}' for '{user.credentials.username}'.")
+        self.db.delete_schedule(schedule_id)
+
+    def start_payment_scheduler(self, clock=utc_now) -> PaymentScheduler:
+        """
+        Starts paying the scheduled payments when they are due, on a background
+        thread; one process per database is enough, see tools/run_scheduler.py.
+        """
+        if self.payment_scheduler is None:
+            self.payment_scheduler = PaymentScheduler(self, clock)
+        self.payment_scheduler.start()
+        return self.payment_scheduler
+
+    def start_listener_hub(self, schedule=None):
+        """
+        Creates the hub sharing the real-time streams between subscriptions, or
+        changes when it delivers: schedule(flush) runs flush later, e.g. on the
+        UI thread once per frame, so a burst of snapshots becomes one update.
+        """
+        if self.listener_hub is None:
+            self.listener_hub = ListenerHub(self.db, schedule)
+        else:
+            self.listener_hub.schedule = schedule
+        return self.listener_hub
+
+    def subscribe_user_updates(self, username, callback):
+        """
+        Calls callback(document) with the user's latest document after changes,
+        through the listener hub. Returns a handle with an unsubscribe() method.
+        """
+        if self.listener_hub is None:
+            self.start_listener_hub()
+        return self.listener_hub.subscribe(username, callback)
+
+    def listener_stats(self):
+        """
+        Returns the subscriber, stream and queue counters of the listener hub, or None if it was not started.
+        """
+        return self.listener_hub.stats() if self.listener_hub is not None else None
+
     def create_support_request(self, user: User, title: str, concern: str):
         """
         Creates and saves a support request for the user.
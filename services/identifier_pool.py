@@ -0,0 +1,86 @@
+import threading
+from collections import deque
+from user_management.credit_card import Card
+
+class IdentifierPool:
+    """
+    Pool of card numbers and IBANs already reserved in the storage's uniqueness
+    indexes, so registration can take one without checking the database.
+    A background thread tops the pool up to `size` whenever it drops below `low_water`.
+    """
+    def __init__(self, db, size=20, low_water=5, max_attempts=100):
+        self.db = db
+        self.size = size
+        self.low_water = low_water
+        # collisions tolerated in a row before giving up on a reservation
+        self.max_attempts = max_attempts
+        self._reserved = deque()
+        self._lock = threading.Lock()
+        self._refill_needed = threading.Event()
+        self._closed = False
+        self._thread = None
+        self.collisions = 0
+
+    def start(self):
+        """Starts the background refill; safe to call more than once."""
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._refill_loop, name="identifier-pool", daemon=True)
+                self._thread.start()
+        self._refill_needed.set()
+
+    def claim(self):
+        """
+        Returns a reserved (card_number, iban) pair.
+        Reserves one on the spot if the pool is empty.
+        """
+        with self._lock:
+            identifiers = self._reserved.popleft() if self._reserved else None
+            remaining = len(self._reserved)
+        if remaining < self.low_water:
+            self._refill_needed.set()
+        if identifiers is None:
+            identifiers = self._reserve_one()
+        return identifiers
+
+    def close(self):
+        """Stops the refill thread and releases the identifiers that were not claimed."""
+        self._closed = True
+        self._refill_needed.set()
+        with self._lock:
+            unclaimed = list(self._reserved)
+            self._reserved.clear()
+        for card_number, iban in unclaimed:
+            self.db.release_identifiers(card_number, iban)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._reserved)
+
+    def _reserve_one(self):
+        for _ in range(self.max_attempts):
+            card_number = Card.generate_number()
+            iban = Card.generate_iban()
+            if self.db.reserve_identifiers(card_number, iban):
+                return card_number, iban
+            self.collisions += 1
+        raise RuntimeError(f"Could not reserve a unique card number and IBAN in {self.max_attempts} attempts.")
+
+    def _refill_loop(self):
+        while True:
+            self._refill_needed.wait()
+            self._refill_needed.clear()
+            try:
+                while not self._closed and len(self) < self.size:
+                    identifiers = self._reserve_one()
+                    with self._lock:
+                        if not self._closed:
+                            self._reserved.append(identifiers)
+                            identifiers = None
+                    if identifiers is not None:
+                        self.db.release_identifiers(*identifiers)
+            except Exception:
+                # storage unreachable: claim() reserves on demand until the next refill works
+                pass
+            if self._closed:
+                return
@@ -0,0 +1,218 @@
+import threading
+from DataBase.Storage import LISTEN_USERS_MAX
+
+class _Stream:
+    """One listen_to_users stream shared by up to LISTEN_USERS_MAX accounts."""
+    def __init__(self):
+        self.usernames = set()
+        self.watch = None
+        # bumped by every restart: snapshots of the replaced watch are ignored
+        self.version = 0
+
+class HubSubscription:
+    """Handle returned by ListenerHub.subscribe."""
+    def __init__(self, hub, username, callback):
+        self._hub = hub
+        self._username = username
+        self._callback = callback
+
+    def unsubscribe(self):
+        self._hub._unsubscribe(self._username, self._callback)
+
+class ListenerHub:
+    """
+    Shares a few storage streams between many per-account subscriptions.
+    Accounts are grouped LISTEN_USERS_MAX to a listen_to_users stream instead
+    of one listen_to_user stream each. Snapshots are coalesced: only the latest
+    document of an account is kept until the next flush, which schedule(flush)
+    runs (e.g. on the Tk main loop once per frame). Without schedule, every
+    snapshot is delivered right away on the listener thread.
+    Adding or removing an account restarts the watch of its stream, which
+    reads the documents of that stream again.
+    Sharded accounts get their own listen_to_user stream, which adds the shards to Sold.
+    """
+    def __init__(self, db, schedule=None, stream_size=LISTEN_USERS_MAX):
+        self.db = db
+        self.schedule = schedule
+        self.stream_size = stream_size
+        # serializes subscriptions; replaced watches are closed after releasing it,
+        # since closing a Firestore watch waits for its callback thread
+        self._streams_lock = threading.RLock()
+        self._streams: list[_Stream] = []
+        self._stream_of: dict[str, _Stream] = {}
+        self._lock = threading.Lock()
+        # username -> listen_to_user watch of the sharded accounts (None while it opens)
+        self._dedicated: dict[str, object] = {}
+        self._subscribers: dict[str, list] = {}
+        # username -> latest document not delivered yet (None for a deleted account)
+        self._pending: dict[str, dict] = {}
+        # username -> last document received, for the next subscribers of the account
+        self._latest: dict[str, dict] = {}
+        self._flush_scheduled = False
+        self.snapshots = 0
+        self.coalesced = 0
+        self.delivered = 0
+        self.max_queue_depth = 0
+
+    def subscribe(self, username, callback) -> HubSubscription:
+        """
+        Calls callback(document) with the latest document of the account after
+        each burst of changes, starting with the current one (None once deleted).
+        """
+        replaced = None
+        with self._streams_lock:
+            with self._lock:
+                subscribers = self._subscribers.setdefault(username, [])
+                subscribers.append(callback)
+                first = len(subscribers) == 1
+                latest = self._latest.get(username)
+            if first:
+                stream = next((stream for stream in self._streams if len(stream.usernames) < self.stream_size), None)
+                if stream is None:
+                    stream = _Stream()
+                    self._streams.append(stream)
+                stream.usernames.add(username)
+                self._stream_of[username] = stream
+                # the new watch starts with the current documents of the stream
+                replaced = self._restart(stream)
+        if replaced is not None:
+            replaced.unsubscribe()
+        if not first and latest is not None:
+            # the account is already streamed: its last document is queued again
+            self._queue(username, latest)
+        return HubSubscription(self, username, callback)
+
+    def _unsubscribe(self, username, callback):
+        replaced = dedicated = None
+        with self._streams_lock:
+            with self._lock:
+                subscribers = self._subscribers.get(username, [])
+                if callback in subscribers:
+                    subscribers.remove(callback)
+                if subscribers:
+                    return
+                self._subscribers.pop(username, None)
+                self._pending.pop(username, None)
+                self._latest.pop(username, None)
+                dedicated = self._dedicated.pop(username, None)
+            stream = self._stream_of.pop(username, None)
+            if stream is not None:
+                stream.usernames.discard(username)
+                replaced = self._restart(stream)
+                if not stream.usernames:
+                    self._streams.remove(stream)
+        for watch in (replaced, dedicated):
+            if watch is not None:
+                watch.unsubscribe()
+
+    def close(self):
+        """Stops every stream."""
+        with self._streams_lock:
+            watches = [stream.watch for stream in self._streams]
+            self._streams.clear()
+            self._stream_of.clear()
+            with self._lock:
+                watches.extend(self._dedicated.values())
+                self._dedicated.clear()
+                self._subscribers.clear()
+                self._pending.clear()
+                self._latest.clear()
+        for watch in watches:
+            if watch is not None:
+                watch.unsubscribe()
+
+    def _restart(self, stream):
+        """
+        Opens a new watch for the accounts of a stream; must be called with _streams_lock held.
+        Returns the replaced watch, to unsubscribe once the lock is released.
+        """
+        old = stream.watch
+        stream.version += 1
+        version = stream.version
+        stream.watch = None
+        if stream.usernames:
+            stream.watch = self.db.listen_to_users(
+                lambda docs, changes, read_time: self._on_snapshot(stream, version, changes),
+                sorted(stream.usernames))
+        return old
+
+    def _on_snapshot(self, stream, version, changes):
+        if version != stream.version:
+            return
+        for change in changes:
+            doc = change.document
+            data = doc.to_dict() if doc.exists and change.type.name != "REMOVED" else None
+            if data is not None and data.get("Shards"):
+                self._listen_sharded(doc.id)
+                continue
+            with self._lock:
+                # a restarted stream sends its documents again, unchanged ones are dropped
+                skip = doc.id in self._dedicated or (doc.id in self._latest and self._latest[doc.id] == data)
+            if skip:
+                continue
+            if self.db.cache is not None:
+                # an unchanged document keeps the cache generation: the reads in flight are kept
+                self.db.cache.refresh(doc.id, data)
+            self._queue(doc.id, data)
+
+    def _listen_sharded(self, username):
+        """The shared stream does not see the balance shards: the account gets its own stream."""
+        with self._lock:
+            if username in self._dedicated or username not in self._subscribers:
+                return
+            self._dedicated[username] = None
+
+        def on_snapshot(doc_snapshot, changes, read_time):
+            for doc in doc_snapshot:
+                self._queue(username, doc.to_dict() if doc.exists else None)
+        watch = self.db.listen_to_user(username, on_snapshot)
+        with self._lock:
+            if username in self._dedicated:
+                self._dedicated[username] = watch
+                return
+        # unsubscribed while the watch was opening
+        watch.unsubscribe()
+
+    def _queue(self, username, data):
+        with self._lock:
+            if username not in self._subscribers:
+                return
+            if username in self._pending:
+                self.coalesced += 1
+            self._pending[username] = data
+            self._latest[username] = data
+            self.snapshots += 1
+            self.max_queue_depth = max(self.max_queue_depth, len(self._pending))
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+            schedule = self.schedule
+        if schedule is None:
+            self.flush()
+        else:
+            schedule(self.flush)
+
+    def flush(self):
+        """Delivers the latest document of every account changed since the last flush."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flush_scheduled = False
+            deliveries = [(list(self._subscribers.get(username, [])), data) for username, data in pending.items()]
+            self.delivered += len(pending)
+        for callbacks, data in deliveries:
+            for callback in callbacks:
+                callback(data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": sum(len(callbacks) for callbacks in self._subscribers.values()),
+                "accounts": len(self._subscribers),
+                "streams": len(self._streams),
+                "dedicated_streams": len(self._dedicated),
+                "queue_depth": len(self._pending),
+                "max_queue_depth": self.max_queue_depth,
+                "snapshots": self.snapshots,
+                "coalesced": self.coalesced,
+                "delivered": self.delivered,
+            }
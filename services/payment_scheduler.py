@@ -0,0 +1,205 @@
+import heapq
+import threading
+from datetime import datetime, timezone
+from user_management.payment_details import TransferResult
+from user_management.scheduled_payment import PAID
+from exceptions import TransientStorageError
+
+# pending schedules kept in the heap: the soonest ones, the others are read from
+# the storage (ordered by next run) when the heap runs out of them
+SCHEDULER_WINDOW = 10_000
+# seconds between two reloads of the window, which picks up the schedules
+# added or cancelled by other processes
+RELOAD_INTERVAL = 60.0
+# seconds before due payments are tried again after a TransientStorageError
+RETRY_DELAY = 5.0
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+class PaymentScheduler:
+    """
+    Pays the scheduled payments stored in the database when they are due.
+    A heap of (next run, id) keys holds the soonest pending schedules, at most
+    window of them, so a million pending schedules cost one window of memory:
+    the storage query returns the next window once the heap is used up.
+    The thread sleeps until the next due time, or until a sooner schedule is
+    added, then pays the due ones in batches through BankService.transfer_batch.
+    Every occurrence has its own transfer key: an occurrence paid before a crash
+    is replayed, not paid again. Occurrences missed while nothing was running are
+    paid one after the other on start. A rejected occurrence (e.g. insufficient
+    funds) is recorded in Last_status and the schedule moves on.
+    clock() returns the current aware datetime; offline, pass a fake clock and
+    call run_due() instead of start().
+    """
+    def __init__(self, bank, clock=utc_now, window=SCHEDULER_WINDOW, batch_size=None):
+        self.bank = bank
+        self.db = bank.db
+        self.clock = clock
+        self.window = window
+        self.batch_size = batch_size or self.db.transfer_batch_max
+        self._condition = threading.Condition()
+        self._heap = []
+        # last key read from the storage while more may follow it, None once all were read;
+        # keys after it stay out of the heap until the next read
+        self._window_end = None
+        self._loaded = False
+        self._retry_at = None
+        self._reload_at = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self.paid = 0
+        self.rejected = 0
+        self.skipped = 0
+
+    def load(self):
+        """(Re)reads the soonest pending schedules from the storage."""
+        keys = self.db.next_schedules(None, self.window)
+        with self._condition:
+            self._heap = list(keys)
+            heapq.heapify(self._heap)
+            self._window_end = keys[-1] if len(keys) == self.window else None
+            self._loaded = True
+            self._condition.notify()
+
+    def _refill(self):
+        """Reads the next window once the heap is empty; must be called with the condition held."""
+        keys = self.db.next_schedules(self._window_end, self.window)
+        for key in keys:
+            heapq.heappush(self._heap, key)
+        self._window_end = keys[-1] if len(keys) == self.window else None
+
+    def _push(self, key):
+        """Must be called with the condition held."""
+        if self._window_end is None or key <= self._window_end:
+            heapq.heappush(self._heap, key)
+
+    def add(self, schedule):
+        """Takes a schedule just saved by this process, waking the thread if it is due sooner."""
+        if schedule.next_run is None:
+            return
+        with self._condition:
+            if not self._loaded:
+                return
+            self._push((schedule.next_run, schedule.schedule_id))
+            self._condition.notify()
+
+    def _pop_due(self, now) -> list:
+        if not self._loaded:
+            self.load()
+        with self._condition:
+            due = []
+            while len(due) < self.batch_size:
+                if not self._heap and self._window_end is not None:
+                    self._refill()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                due.append(heapq.heappop(self._heap))
+            return due
+
+    def run_due(self, now=None) -> int:
+        """Pays every occurrence due at now (default: clock()). Returns how many were executed."""
+        now = now or self.clock()
+        executed = 0
+        while True:
+            due = self._pop_due(now)
+            if not due:
+                return executed
+            try:
+                executed += self._execute(due)
+            except TransientStorageError:
+                # the batch is tried again with the same transfer keys
+                with self._condition:
+                    for key in due:
+                        heapq.heappush(self._heap, key)
+                raise
+
+    def _execute(self, due) -> int:
+        """Pays one batch of due keys and moves their schedules to the next occurrence."""
+        stored = self.db.read_schedules(schedule_id for _, schedule_id in due)
+        schedules = []
+        for next_run, schedule_id in dict.fromkeys(due):
+            # a key pushed by add() while load() read it is in the heap twice;
+            # a copy popped in a later batch no longer matches next_run below
+            schedule = stored.get(schedule_id)
+            if schedule is None or schedule.next_run != next_run:
+                # cancelled, or changed since its key was read (it is in the storage under the new key)
+                self.skipped += 1
+                continue
+            schedules.append(schedule)
+        if not schedules:
+            return 0
+        results = self.bank.transfer_batch([(schedule.sender, schedule.receiver, schedule.amount, schedule.payment_key())
+                                            for schedule in schedules])
+        for schedule, result in zip(schedules, results):
+            if isinstance(result, TransferResult):
+                schedule.record_run(PAID)
+                self.paid += 1
+            else:
+                schedule.record_run(type(result).__name__)
+                self.rejected += 1
+        self.db.save_schedules(schedules)
+        with self._condition:
+            for schedule in schedules:
+                if schedule.next_run is not None:
+                    self._push((schedule.next_run, schedule.schedule_id))
+        return len(schedules)
+
+    def start(self):
+        """Starts paying the due schedules on a background thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="payment-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            now = self.clock()
+            if self._reload_at is None or now.timestamp() >= self._reload_at:
+                self._reload_at = now.timestamp() + RELOAD_INTERVAL
+                try:
+                    self.load()
+                except Exception:
+                    # the database is unreachable: tried again after the retry delay
+                    self._retry_at = now.timestamp() + RETRY_DELAY
+            if self._retry_at is None or now.timestamp() >= self._retry_at:
+                self._retry_at = None
+                try:
+                    self.run_due(now)
+                except Exception:
+                    self._retry_at = self.clock().timestamp() + RETRY_DELAY
+            with self._condition:
+                if self._stopped.is_set():
+                    break
+                self._condition.wait(self._timeout())
+
+    def _timeout(self) -> float:
+        """Seconds until the next due payment, reload or retry; must be called with the condition held."""
+        now = self.clock().timestamp()
+        wake = [self._reload_at]
+        if self._retry_at is not None:
+            wake.append(self._retry_at)
+        elif self._heap:
+            wake.append(self._heap[0][0].timestamp())
+        elif self._window_end is not None:
+            wake.append(now)
+        return max(0.0, min(wake) - now)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "queued": len(self._heap),
+                "next_run": self._heap[0][0] if self._heap else None,
+                "paid": self.paid,
+                "rejected": self.rejected,
+                "skipped": self.skipped,
+            }
@@ -0,0 +1,45 @@
+import random
+import time
+from exceptions import TransientStorageError
+
+# transfers retried after the storage reports contention or a timeout
+DEFAULT_ATTEMPTS = 5
+BASE_DELAY = 0.05
+MAX_DELAY = 2.0
+
+def backoff_delay(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY, rng=random):
+    """
+    Full jitter: a random wait up to the exponential backoff of the attempt,
+    so clients that conflicted together do not retry together.
+    """
+    return rng.random() * min(max_delay, base_delay * 2 ** attempt)
+
+def retry_with_backoff(operation, attempts=DEFAULT_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                       sleep=time.sleep):
+    """
+    Calls operation() until it succeeds, retrying only on TransientStorageError.
+    The operation must be safe to repeat (a transfer with an idempotency key).
+    The last error is raised once the attempts are used up.
+    """
+    for attempt in range(attempts):
+        try:
+            return operation()
+        except TransientStorageError:
+            if attempt == attempts - 1:
+                raise
+        sleep(backoff_delay(attempt, base_delay, max_delay))
+
+async def retry_with_backoff_async(operation, attempts=DEFAULT_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                                   sleep=None):
+    """Coroutine variant of retry_with_backoff, operation() returns an awaitable; sleep defaults to asyncio.sleep."""
+    if sleep is None:
+        # imported here: the synchronous app does not need asyncio at startup
+        import asyncio
+        sleep = asyncio.sleep
+    for attempt in range(attempts):
+        try:
+            return await operation()
+        except TransientStorageError:
+            if attempt == attempts - 1:
+                raise
+        await sleep(backoff_delay(attempt, base_delay, max_delay))
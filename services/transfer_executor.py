@@ -0,0 +1,70 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# worker threads: transfers mostly wait for the storage, not for the CPU
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+class TransferExecutor:
+    """
+    Runs BankService transfers, withdrawals and deposits on a thread pool.
+    BankService holds the locks of the accounts of each operation, taken in
+    sorted order (services/account_locks.py): operations on overlapping
+    accounts run one after the other without deadlocking, operations on
+    disjoint accounts run in parallel. The methods return futures; the
+    exceptions (e.g. InsufficientFundsError) are raised by future.result().
+    """
+    def __init__(self, bank, max_workers=DEFAULT_WORKERS):
+        self.bank = bank
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transfer")
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    def _submit(self, function, *args):
+        future = self._pool.submit(function, *args)
+        future.add_done_callback(self._count)
+        return future
+
+    def _count(self, future):
+        with self._lock:
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def transfer(self, sender: str, receiver: str, amount: int, key: str = None):
+        return self._submit(self.bank.transfer_money, sender, receiver, amount, key)
+
+    def withdraw(self, user, amount: int):
+        return self._submit(self.bank.withdraw, user, amount)
+
+    def add_money(self, user, amount: int, sender_name: str):
+        return self._submit(self.bank.add_money, user, amount, sender_name)
+
+    def run_transfers(self, items) -> list:
+        """
+        Runs (sender, receiver, amount[, key]) transfers concurrently and waits
+        for them. Returns per item the TransferResult or the exception that rejected it.
+        Unlike BankService.transfer_batch, the items are independent: their order is not kept.
+        """
+        futures = [self.transfer(*item) for item in items]
+        return [future.exception() or future.result() for future in futures]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "completed": self.completed,
+                "failed": self.failed,
+                "contended": self.bank.account_locks.contended,
+                "locked_accounts": len(self.bank.account_locks),
+            }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -0,0 +1,34 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataBase.Factory import create_database
+
+def account(index, name, sold):
+    """User document for add_users_bulk."""
+    return {"Name": name, "Password_hash": "x", "Card_Number": 4000_0000_0000_0000 + index, "CVV": 123,
+            "Expiry_date": "12/30", "Sold": sold, "Email": f"{name}@edmbank.ro",
+            "Iban": f"RO49EDMB{index:016d}", "History_seq": 0}
+
+@pytest.fixture(params=["memory", "sqlite"])
+def db(request, tmp_path):
+    options = {"path": str(tmp_path / "test.sqlite3")} if request.param == "sqlite" else {}
+    storage = create_database(request.param, cache_size=16, **options)
+    yield storage
+    if hasattr(storage, "close"):
+        storage.close()
+
+@pytest.fixture
+def accounts(db):
+    """Creates the accounts {name: balance} given to it, without payments."""
+    def create(balances):
+        db.add_users_bulk([(account(index, name, sold), []) for index, (name, sold) in enumerate(balances.items())])
+        return list(balances)
+    return create
+
+@pytest.fixture
+def sold(db):
+    """Stored balance of an account."""
+    return lambda username: db.get_fields(username, ["Sold"])["Sold"]
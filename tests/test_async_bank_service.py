@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+from DataBase.AsyncStorage import AsyncStorage
+from exceptions import AccountNotFoundError, InsufficientFundsError
+from services.async_bank_service import AsyncBankService
+
+def run(db, scenario):
+    async def main():
+        bank = AsyncBankService(AsyncStorage(db, max_workers=8))
+        try:
+            return await scenario(bank)
+        finally:
+            bank.db._executor.shutdown()
+    return asyncio.run(main())
+
+def test_storage_methods_are_coroutines(db, accounts):
+    accounts({"alice": 100, "bob": 200})
+
+    async def scenario(bank):
+        users = await bank.get_users(["alice", "nobody", "bob"])
+        balances = await asyncio.gather(bank.get_balance("alice"), bank.get_balance("bob"))
+        with pytest.raises(AccountNotFoundError):
+            await bank.get_user("nobody")
+        return [user and user.balance for user in users], balances
+
+    assert run(db, scenario) == ([100, None, 200], [100, 200])
+
+def test_shared_user_changes_are_serialised(db, accounts, sold):
+    accounts({"alice": 1_000})
+
+    async def scenario(bank):
+        alice = await bank.get_user("alice")
+        await asyncio.gather(*[bank.add_money(alice, 10, "card") for _ in range(20)],
+                             *[bank.withdraw(alice, 5) for _ in range(20)])
+        return alice, len(bank.account_locks)
+
+    alice, locked = run(db, scenario)
+    assert sold("alice") == alice.balance == 1_100
+    assert db.get_fields("alice", ["History_seq"])["History_seq"] == 40
+    assert locked == 0
+
+def test_rejected_withdrawal_keeps_the_other_changes(db, accounts, sold):
+    accounts({"alice": 100})
+
+    async def scenario(bank):
+        alice = await bank.get_user("alice")
+        outcomes = await asyncio.gather(bank.withdraw(alice, 80), bank.withdraw(alice, 80), bank.add_money(alice, 5, "card"),
+                                        return_exceptions=True)
+        return alice, outcomes
+
+    alice, outcomes = run(db, scenario)
+    assert sum(isinstance(outcome, InsufficientFundsError) for outcome in outcomes) == 1
+    assert sold("alice") == alice.balance == 25
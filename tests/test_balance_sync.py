@@ -0,0 +1,33 @@
+from services.bank_service import BankService
+
+def test_iban_transfer_then_deposit(db, accounts):
+    accounts({"alice": 10_000, "bob": 10_000})
+    bank = BankService(db)
+    alice = db.get_user("alice")
+    bank.transfer_iban(alice, db.get_user("bob").card.IBAN, 300)
+    assert alice.balance == 9_700
+    assert alice.balance_delta() is None
+
+    bank.add_money(alice, 50, "card")
+    assert db.get_fields("alice", ["Sold"])["Sold"] == 9_750
+    assert alice.balance == 9_750
+
+def test_incoming_transfer_then_deposit(db, accounts):
+    accounts({"alice": 10_000, "bob": 10_000})
+    bank = BankService(db)
+    alice = db.get_user("alice")
+    result = bank.transfer_money("bob", "alice", 100)
+    # what the listener does with a snapshot
+    alice.set_synced_balance(result.receiver_balance)
+
+    bank.add_money(alice, 10, "card")
+    assert db.get_fields("alice", ["Sold"])["Sold"] == 10_110
+    assert db.get_fields("bob", ["Sold"])["Sold"] == 9_900
+
+def test_synced_balance_keeps_unsaved_change(db, accounts):
+    accounts({"alice": 1_000})
+    alice = db.get_user("alice")
+    alice.balance += 25
+    alice.set_synced_balance(2_000)
+    assert alice.balance == 2_025
+    assert alice.balance_delta() == 25
@@ -0,0 +1,19 @@
+def test_audit_and_balance_history(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    for _ in range(5):
+        db.transfer("alice", "bob", 10)
+    report = db.compact_ledger(["alice"], interval=2)
+    assert report["checkpoints"] == 2
+    assert db.get_balance_at("alice", seq=3) == 970
+    assert db.get_balance_at("alice") == 950
+    assert db.get_balance_at("alice", seq=0) == 1_000
+    audit = db.audit_balances(["alice", "bob"])
+    assert audit["accounts"] == 2 and audit["mismatches"] == [] and audit["unchecked"] == []
+
+def test_audit_finds_a_balance_without_ledger_entry(db, accounts):
+    accounts({"alice": 1_000})
+    alice = db.get_user("alice")
+    alice.balance += 5
+    db.modify_user(alice)
+    (mismatch,) = db.audit_balances(["alice"])["mismatches"]
+    assert (mismatch["Name"], mismatch["Stored"], mismatch["Ledger"]) == ("alice", 1_005, 1_000)
@@ -0,0 +1,14 @@
+import pytest
+from exceptions import AccountNotFoundError
+
+def test_fields_are_projected(db, accounts):
+    accounts({"alice": 100})
+    assert db.get_fields("alice", ["Sold", "History_seq"]) == {"Sold": 100, "History_seq": 0}
+    assert db.get_fields("alice", ["Shards"]) == {"Shards": None}
+
+def test_projection_errors(db, accounts):
+    accounts({"alice": 100})
+    with pytest.raises(ValueError):
+        db.get_fields("alice", ["Sold", "Password"])
+    with pytest.raises(AccountNotFoundError):
+        db.get_fields("nobody", ["Sold"])
@@ -0,0 +1,14 @@
+def test_users_come_back_in_order(db, accounts):
+    accounts({"alice": 100, "bob": 200, "carol": 300})
+    users = db.get_users(["carol", "nobody", "alice", "carol"])
+    assert [user and user.credentials.username for user in users] == ["carol", None, "alice", "carol"]
+    assert [user and user.balance for user in users] == [300, None, 100, 300]
+
+def test_cached_users_are_not_read_again(db, accounts):
+    accounts({"alice": 100, "bob": 200})
+    db.get_user("alice")
+    hits = db.cache.stats()["hits"]
+    db.get_users(["alice", "bob"])
+    assert db.cache.stats()["hits"] == hits + 1
+    # bob was cached by the batched read
+    assert db.cache.get("bob")["Sold"] == 200
@@ -0,0 +1,10 @@
+from datetime import timedelta
+
+def test_history_by_date(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    first = db.transfer("alice", "bob", 1).payment.date
+    db.transfer("alice", "bob", 2)
+    page, cursor = db.get_history("bob", since=first, until=first + timedelta(days=1))
+    assert [payment.amount for payment in page] == [1, 2] and cursor is None
+    page, _ = db.get_history("bob", until=first)
+    assert page == []
@@ -0,0 +1,14 @@
+def test_sync_reads_only_the_missing_entries(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    db.transfer("alice", "bob", 1)
+    history = db.get_payment_history("bob", saved_count=1)
+    history.load_more()
+    db.transfer("alice", "bob", 2)
+    db.transfer("alice", "bob", 3)
+    new_payments = db.sync_payment_history("bob", history, 3)
+    assert [payment.amount for payment in new_payments] == [2, 3]
+    assert history.saved_count == 3
+    assert [payment.amount for payment in history.history] == [1, 2, 3]
+    assert db.sync_payment_history("bob", history, 3) == []
+    # a ledger shorter than the history must be reloaded
+    assert db.sync_payment_history("bob", history, 2) is None
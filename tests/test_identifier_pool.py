@@ -0,0 +1,35 @@
+import time
+
+from services.identifier_pool import IdentifierPool
+from user_management.user import User, UserCredentials, PaymentsHistory, Card
+
+def test_claimed_identifiers_are_reserved_and_unique(db):
+    pool = IdentifierPool(db, size=5, low_water=2)
+    claimed = [pool.claim() for _ in range(8)]
+    assert len({card_number for card_number, _ in claimed}) == len({iban for _, iban in claimed}) == 8
+    for card_number, iban in claimed:
+        assert db.card_exists(card_number)
+        assert not db.reserve_identifiers(card_number, iban)
+    pool.close()
+
+def test_close_releases_the_unclaimed_identifiers(db):
+    pool = IdentifierPool(db, size=3, low_water=3)
+    pool.start()
+    deadline = time.monotonic() + 5
+    while len(pool) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    reserved = list(pool._reserved)
+    assert len(reserved) == 3
+    pool.close()
+    assert len(pool) == 0
+    for card_number, iban in reserved:
+        assert not db.card_exists(card_number)
+
+def test_registration_takes_a_claimed_card(db):
+    pool = IdentifierPool(db)
+    card_number, iban = pool.claim()
+    card = Card.generateCard(number=card_number, IBAN=iban)
+    db.add_user(User(UserCredentials("alice", "secret", "alice@edmbank.ro"), 0, PaymentsHistory(), card))
+    assert db.resolve_card(card_number) == "alice"
+    assert db.resolve_iban(iban) == "alice"
+    pool.close()
@@ -0,0 +1,41 @@
+import pytest
+from exceptions import AccountNotFoundError, IdentifierInUseError
+from user_management.user import User, UserCredentials, PaymentsHistory, Card
+
+def new_user(username, card):
+    return User(UserCredentials(username, "secret", f"{username}@edmbank.ro"), 1_000, PaymentsHistory(), card)
+
+def stored_card(db, username):
+    fields = db.get_fields(username, ["Card_Number", "Iban"])
+    return Card.generateCard(number=fields["Card_Number"], IBAN=fields["Iban"])
+
+def test_colliding_identifiers_keep_the_existing_account(db, accounts, sold):
+    accounts({"alice": 1_000})
+    card = stored_card(db, "alice")
+    with pytest.raises(IdentifierInUseError):
+        db.add_user(new_user("bob", card))
+    assert sold("alice") == 1_000
+    with pytest.raises(AccountNotFoundError):
+        db.get_user("bob")
+    assert db.resolve_iban(card.IBAN) == "alice"
+
+def test_readding_a_user_replaces_it(db, accounts, sold):
+    accounts({"alice": 500})
+    db.add_user(new_user("alice", stored_card(db, "alice")))
+    assert sold("alice") == 1_000
+    assert db.checkUserLogin("alice", "secret")
+
+def test_reservations_are_claimed(db):
+    card = Card.generateCard()
+    assert db.reserve_identifiers(card.number, card.IBAN)
+    assert not db.reserve_identifiers(card.number, card.IBAN)
+    db.add_user(new_user("alice", card))
+    # the entries belong to alice now, releasing the reservation keeps them
+    db.release_identifiers(card.number, card.IBAN)
+    assert db.resolve_iban(card.IBAN) == "alice"
+    assert db.resolve_card(card.number) == "alice"
+
+def test_index_reports_are_clean(db, accounts):
+    accounts({"alice": 100, "bob": 200})
+    for report in (db.verify_iban_index(), db.verify_card_index()):
+        assert report == {"missing": {}, "stale": [], "duplicates": []}
@@ -0,0 +1,35 @@
+from services.bank_service import BankService
+
+def test_seq_continues_across_sessions_and_transfers(db, accounts):
+    accounts({"alice": 1_000, "bob": 1_000})
+    bank = BankService(db)
+    alice = db.get_user("alice")
+    bank.add_money(alice, 10, "card")
+    db.transfer("bob", "alice", 20)
+    # a second session of the same account
+    bank.add_money(db.get_user("alice"), 30, "card")
+    bank.withdraw(alice, 40)
+    assert [entry["Seq"] for entry in db._ledger_entries_after("alice", 0, 10)] == [1, 2, 3, 4]
+    assert db.get_fields("alice", ["History_seq", "Sold"]) == {"History_seq": 4, "Sold": 1_020}
+
+def test_history_pages_from_the_newest(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    for amount in range(1, 8):
+        db.transfer("alice", "bob", amount)
+    page, cursor = db.get_history_page("bob", limit=3)
+    assert [payment.amount for payment in page] == [5, 6, 7]
+    page, cursor = db.get_history_page("bob", limit=3, before=cursor)
+    assert [payment.amount for payment in page] == [2, 3, 4]
+    page, cursor = db.get_history_page("bob", limit=3, before=cursor)
+    assert [payment.amount for payment in page] == [1] and cursor is None
+
+def test_history_loads_older_pages_on_demand(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    for amount in range(1, 6):
+        db.transfer("alice", "bob", amount)
+    history = db.get_payment_history("bob", saved_count=5)
+    assert history.load_more(limit=2) == 2
+    assert [payment.amount for payment in history.history] == [4, 5] and history.has_more
+    while history.has_more:
+        history.load_more(limit=2)
+    assert [payment.amount for payment in history.history] == [1, 2, 3, 4, 5]
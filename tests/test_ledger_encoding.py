@@ -0,0 +1,41 @@
+import msgpack
+import pytest
+from DataBase.Factory import create_database
+from user_management.payment_details import Payment
+
+def test_payloads_roundtrip(db):
+    payment = Payment(amount=1250, sender="alice", receiver="bob")
+    decoded = db._unpack_payment(db._pack_payment(payment))
+    assert (decoded.sender, decoded.amount, decoded.receiver) == ("alice", 1250, "bob")
+    assert not db._payload_outdated(db._pack_payment(payment))
+
+def test_older_payloads_are_decoded(db):
+    legacy = db._unpack_payment("alice -> 12.5 -> bob")
+    assert (legacy.sender, legacy.amount, legacy.receiver) == ("alice", 1250, "bob")
+    version_1 = msgpack.packb([1, "alice", 0.1, "bob"])
+    assert db._unpack_payment(version_1).amount == 10
+    assert db._payload_outdated("alice -> 12.5 -> bob")
+    assert db._payload_outdated(version_1)
+
+def test_malformed_payloads_raise(db):
+    with pytest.raises(ValueError):
+        db._unpack_payment(b"\xc1")
+    with pytest.raises(ValueError):
+        db._unpack_payment(msgpack.packb([9, "alice", 100, "bob"]))
+
+def test_fresh_ledger_needs_no_migration(db, accounts):
+    accounts({"alice": 100, "bob": 0})
+    db.transfer("alice", "bob", 40)
+    assert db.migrate_ledger_encoding() == 0
+
+def test_outdated_entries_are_rewritten():
+    db = create_database("memory")
+    db.add_users_bulk([({"Name": "alice", "Password_hash": "x", "Card_Number": 4000_0000_0000_0000, "CVV": 123,
+                         "Expiry_date": "12/30", "Sold": 0, "Email": "alice@edmbank.ro",
+                         "Iban": "RO49EDMB0000000000000000", "History_seq": 0},
+                        [Payment(amount=500, sender="bob", receiver="alice")])])
+    db.ledgers["alice"][0]["Payment"] = "bob -> 5 -> alice"
+    assert db.migrate_ledger_encoding() == 1
+    assert db.migrate_ledger_encoding() == 0
+    [payment] = db.get_history_page("alice")[0]
+    assert (payment.sender, payment.amount, payment.receiver) == ("bob", 500, "alice")
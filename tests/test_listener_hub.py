@@ -0,0 +1,47 @@
+from services.listener_hub import ListenerHub
+
+def test_bursts_are_coalesced_until_the_flush(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    flushes = []
+    hub = ListenerHub(db, schedule=flushes.append, stream_size=1)
+    received = {"alice": [], "bob": []}
+    for username in received:
+        hub.subscribe(username, received[username].append)
+    flushes.pop()()
+    assert [data["Sold"] for data in received["bob"]] == [0]
+    for amount in (10, 20, 30):
+        db.transfer("alice", "bob", amount)
+    # one flush scheduled for the whole burst
+    assert len(flushes) == 1
+    flushes.pop()()
+    assert [data["Sold"] for data in received["bob"]] == [0, 60]
+    assert [data["Sold"] for data in received["alice"]] == [1_000, 940]
+    stats = hub.stats()
+    assert stats["streams"] == 2 and stats["coalesced"] == 4 and stats["queue_depth"] == 0
+    hub.close()
+
+def test_second_subscriber_gets_the_latest_document(db, accounts):
+    accounts({"alice": 1_000})
+    hub = ListenerHub(db)
+    first, second = [], []
+    subscription = hub.subscribe("alice", first.append)
+    hub.subscribe("alice", second.append)
+    assert second == [first[-1]]
+    subscription.unsubscribe()
+    assert hub.stats()["subscribers"] == 1
+    hub.close()
+
+def test_unchanged_snapshots_keep_the_cache_generation(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    db.get_users(["alice", "bob"])
+    generation, invalidations = db.cache.generation, db.cache.stats()["invalidations"]
+    hub = ListenerHub(db)
+    # the first snapshots repeat the cached documents, the restarted stream sends alice again
+    hub.subscribe("alice", lambda data: None)
+    hub.subscribe("bob", lambda data: None)
+    assert db.cache.generation == generation
+    assert db.cache.stats()["invalidations"] == invalidations
+    db.transfer("alice", "bob", 5)
+    # the snapshots of the write are cached
+    assert db.cache.get("bob")["Sold"] == 5
+    hub.close()
@@ -0,0 +1,35 @@
+from decimal import Decimal
+import pytest
+from exceptions import NegativeAmountError
+from user_management.money import to_bani, to_lei, parse_amount, format_bani, check_amount
+
+def test_lei_to_bani():
+    assert to_bani(0.1) == 10
+    assert to_bani("12.345") == 1235
+    assert to_bani(7) == 700
+    assert to_lei(1250) == Decimal("12.50")
+    for invalid in (True, "abc", float("nan")):
+        with pytest.raises(ValueError):
+            to_bani(invalid)
+
+def test_user_input_is_parsed():
+    assert parse_amount("12") == 1200
+    assert parse_amount("12,5") == 1250
+    assert parse_amount("1250.50 RON") == 125050
+    assert parse_amount("1.250,50") == 125050
+    for invalid in ("12.345", "abc", ""):
+        with pytest.raises(ValueError):
+            parse_amount(invalid)
+
+def test_balances_are_formatted():
+    assert format_bani(125000) == "1.250,00 RON"
+    assert format_bani(-5) == "-0,05 RON"
+
+def test_amounts_are_checked():
+    check_amount(1)
+    with pytest.raises(TypeError):
+        check_amount(12.5)
+    with pytest.raises(TypeError):
+        check_amount(True)
+    with pytest.raises(NegativeAmountError):
+        check_amount(0)
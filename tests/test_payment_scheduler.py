@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+from services.bank_service import BankService
+from services.payment_scheduler import PaymentScheduler
+from user_management.scheduled_payment import PAID
+
+START = datetime(2026, 1, 31, 9, 0, tzinfo=timezone.utc)
+
+def test_pays_due_occurrences_once(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    bank = BankService(db)
+    schedule = bank.schedule_payment("alice", "bob", 100, START, "monthly")
+    scheduler = PaymentScheduler(bank, clock=lambda: START + timedelta(days=40))
+    assert scheduler.run_due() == 2
+    # 31 Jan and 28 Feb, the next one is back on the 31st
+    stored = db.read_schedules([schedule.schedule_id])[schedule.schedule_id]
+    assert stored.runs == 2 and stored.last_status == PAID
+    assert stored.next_run == datetime(2026, 3, 31, 9, 0, tzinfo=timezone.utc)
+    assert db.get_fields("bob", ["Sold"])["Sold"] == 200
+    # the keys make a second scheduler replay, not pay
+    assert PaymentScheduler(bank, clock=lambda: START + timedelta(days=40)).run_due() == 0
+
+def test_key_queued_twice_runs_once(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    bank = BankService(db)
+    scheduler = PaymentScheduler(bank, clock=lambda: START)
+    scheduler.load()
+    schedule = bank.schedule_payment("alice", "bob", 100, START)
+    # add() racing with a load() that already read the new schedule
+    scheduler.load()
+    scheduler.add(schedule)
+    assert scheduler.run_due() == 1
+    assert db.read_schedules([schedule.schedule_id])[schedule.schedule_id].runs == 1
+    assert db.get_fields("bob", ["Sold"])["Sold"] == 100
+
+def test_rejected_occurrence_moves_on(db, accounts):
+    accounts({"alice": 50, "bob": 0})
+    bank = BankService(db)
+    schedule = bank.schedule_payment("alice", "bob", 100, START, "daily")
+    assert PaymentScheduler(bank, clock=lambda: START).run_due() == 1
+    stored = db.read_schedules([schedule.schedule_id])[schedule.schedule_id]
+    assert stored.last_status == "InsufficientFundsError" and stored.failures == 1
+    assert stored.next_run == START + timedelta(days=1)
@@ -0,0 +1,31 @@
+import asyncio
+import pytest
+from exceptions import TransientStorageError
+from services.retry import retry_with_backoff, retry_with_backoff_async
+
+def flaky(failures, result="done"):
+    calls = []
+    def operation():
+        calls.append(None)
+        if len(calls) <= failures:
+            raise TransientStorageError("busy")
+        return result
+    return operation, calls
+
+def test_retries_transient_errors():
+    operation, calls = flaky(2)
+    assert retry_with_backoff(operation, attempts=3, sleep=lambda delay: None) == "done"
+    assert len(calls) == 3
+
+def test_raises_the_last_error():
+    operation, calls = flaky(5)
+    with pytest.raises(TransientStorageError):
+        retry_with_backoff(operation, attempts=3, sleep=lambda delay: None)
+    assert len(calls) == 3
+
+def test_async_variant_sleeps_with_asyncio():
+    operation, calls = flaky(1)
+    async def attempt():
+        return operation()
+    assert asyncio.run(retry_with_backoff_async(attempt, base_delay=0.001)) == "done"
+    assert len(calls) == 2
@@ -0,0 +1,20 @@
+from services.bank_service import BankService
+
+def test_rollups_total_the_month(db, accounts):
+    accounts({"alice": 1_000, "bob": 0, "carol": 0})
+    db.transfer("alice", "bob", 100)
+    db.transfer("alice", "carol", 50)
+    db.transfer("bob", "alice", 30)
+    (rollup,) = db.get_rollups("alice")
+    assert (rollup["In"], rollup["Out"], rollup["Count"]) == (30, 150, 3)
+    assert rollup["Counterparties"] == {"bob": 130, "carol": 50}
+
+def test_backfill_rebuilds_the_same_rollups(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    bank = BankService(db)
+    db.transfer("alice", "bob", 100)
+    bank.withdraw(db.get_user("bob"), 40)
+    before = {username: db.get_rollups(username) for username in ("alice", "bob")}
+    report = db.backfill_rollups(["alice", "bob"])
+    assert report["accounts"] == 2 and report["payments"] == 3
+    assert {username: db.get_rollups(username) for username in ("alice", "bob")} == before
@@ -0,0 +1,26 @@
+from argparse import Namespace
+from tools.seed_data import AccountGenerator
+
+ARGS = Namespace(history_distribution="fixed", history_mean=6, history_max=10, history_days=30)
+
+def test_payments_mirror_each_other():
+    documents, passwords, histories = AccountGenerator(7, ARGS).batch(20)
+    assert len({document["Iban"] for document in documents}) == len({document["Card_Number"] for document in documents}) == 20
+    ledgers = {document["Name"]: payments for document, payments in zip(documents, histories)}
+    for username, payments in ledgers.items():
+        assert len(payments) <= ARGS.history_max
+        assert [payment.date for payment in payments] == sorted(payment.date for payment in payments)
+        for payment in payments:
+            assert payment.sender != payment.receiver
+            assert username in (payment.sender, payment.receiver)
+            other = payment.receiver if payment.sender == username else payment.sender
+            assert payment in ledgers[other]
+    assert sum(map(len, histories)) >= 20 * ARGS.history_mean - 10
+
+def test_seeded_accounts_are_written(db):
+    documents, passwords, histories = AccountGenerator(7, ARGS).batch(10)
+    for document in documents:
+        document["Password_hash"] = "x"
+    db.add_users_bulk(list(zip(documents, histories)))
+    for document, payments in zip(documents, histories):
+        assert db.get_fields(document["Name"], ["History_seq"])["History_seq"] == len(payments)
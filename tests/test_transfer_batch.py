@@ -0,0 +1,25 @@
+import pytest
+from exceptions import AccountNotFoundError, InsufficientFundsError
+from user_management.payment_details import TransferResult
+
+def test_batch_checks_items_in_order(db, accounts, sold):
+    accounts({"alice": 100, "bob": 0, "carol": 0})
+    results = db.transfer_batch([
+        ("alice", "bob", 100, "b-1"),
+        # funded by the item before it
+        ("bob", "carol", 60, "b-2"),
+        ("bob", "carol", 60, "b-3"),
+        ("alice", "nobody", 1, None),
+    ])
+    assert isinstance(results[0], TransferResult) and isinstance(results[1], TransferResult)
+    assert isinstance(results[2], InsufficientFundsError)
+    assert isinstance(results[3], AccountNotFoundError)
+    assert (sold("alice"), sold("bob"), sold("carol")) == (0, 40, 60)
+    assert [entry["Seq"] for entry in db._ledger_entries_after("bob", 0, 10)] == [1, 2]
+    # the keys of the batch replay like single transfers
+    assert db.transfer("bob", "carol", 60, key="b-2").replayed
+
+def test_batch_size_is_limited(db, accounts):
+    accounts({"alice": 100, "bob": 0})
+    with pytest.raises(ValueError):
+        db.transfer_batch([("alice", "bob", 1, None)] * (db.transfer_batch_max + 1))
@@ -0,0 +1,49 @@
+import threading
+from exceptions import InsufficientFundsError
+from services.account_locks import AccountLocks
+from services.bank_service import BankService
+from services.transfer_executor import TransferExecutor
+from user_management.payment_details import TransferResult
+
+def test_concurrent_operations_conserve_money(db, accounts):
+    names = accounts({f"user{index}": 1_000 for index in range(6)})
+    bank = BankService(db)
+    users = {name: db.get_user(name) for name in names}
+    with TransferExecutor(bank, max_workers=8) as executor:
+        futures = [executor.transfer(names[index % 6], names[(index * 5 + 1) % 6], 7) for index in range(300)
+                   if index % 6 != (index * 5 + 1) % 6]
+        futures += [executor.add_money(users[name], 3, "card") for name in names for _ in range(10)]
+        futures += [executor.withdraw(users[name], 2) for name in names for _ in range(10)]
+        for future in futures:
+            future.result()
+        stats = executor.stats()
+    assert stats["completed"] == len(futures) and stats["failed"] == 0
+    assert stats["locked_accounts"] == 0
+    total = sum(db.get_fields(name, ["Sold"])["Sold"] for name in names)
+    assert total == 6 * 1_000 + 6 * 10 * (3 - 2)
+    assert db.audit_balances(names)["mismatches"] == []
+
+def test_run_transfers_returns_the_rejections(db, accounts):
+    accounts({"alice": 100, "bob": 0})
+    with TransferExecutor(BankService(db), max_workers=2) as executor:
+        results = executor.run_transfers([("alice", "bob", 60, "k-1"), ("alice", "bob", 500)])
+        assert executor.stats()["failed"] == 1
+    assert isinstance(results[0], TransferResult)
+    assert isinstance(results[1], InsufficientFundsError)
+
+def test_locks_are_taken_in_sorted_order():
+    locks = AccountLocks()
+    done = []
+
+    def hold(first, second):
+        for _ in range(200):
+            with locks.hold(first, second):
+                pass
+        done.append(first)
+
+    threads = [threading.Thread(target=hold, args=("a", "b")), threading.Thread(target=hold, args=("b", "a"))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert len(done) == 2 and len(locks) == 0
@@ -0,0 +1,23 @@
+import pytest
+from exceptions import TransferKeyError
+
+def test_transfer_key_replays_the_first_result(db, accounts, sold):
+    accounts({"alice": 1_000, "bob": 0})
+    first = db.transfer("alice", "bob", 300, key="payroll-1")
+    again = db.transfer("alice", "bob", 300, key="payroll-1")
+    assert again.replayed and not first.replayed
+    assert (again.sender_balance, again.receiver_balance) == (700, 300)
+    assert (sold("alice"), sold("bob")) == (700, 300)
+    assert len(db._ledger_entries_after("alice", 0, 10)) == 1
+
+def test_transfer_key_reused_for_another_transfer(db, accounts, sold):
+    accounts({"alice": 1_000, "bob": 0})
+    db.transfer("alice", "bob", 300, key="payroll-1")
+    with pytest.raises(TransferKeyError):
+        db.transfer("alice", "bob", 400, key="payroll-1")
+    assert sold("bob") == 300
+
+def test_invalid_transfer_key(db, accounts):
+    accounts({"alice": 1_000, "bob": 0})
+    with pytest.raises(ValueError):
+        db.transfer("alice", "bob", 300, key="a/b")
@@ -0,0 +1,25 @@
+import pytest
+from exceptions import *
+
+def test_transfer_moves_money_and_numbers_both_ledgers(db, accounts, sold):
+    accounts({"alice": 1_000, "bob": 0})
+    result = db.transfer("alice", "bob", 300)
+    assert (result.sender_balance, result.receiver_balance, result.replayed) == (700, 300, False)
+    db.transfer("bob", "alice", 100)
+    assert (sold("alice"), sold("bob")) == (800, 200)
+    for username in ("alice", "bob"):
+        assert [entry["Seq"] for entry in db._ledger_entries_after(username, 0, 10)] == [1, 2]
+        assert db.get_fields(username, ["History_seq"])["History_seq"] == 2
+
+@pytest.mark.parametrize("sender, receiver, amount, error", [
+    ("alice", "alice", 10, SameAccountError),
+    ("alice", "nobody", 10, AccountNotFoundError),
+    ("alice", "bob", 5_000, InsufficientFundsError),
+    ("alice", "bob", -5, NegativeAmountError),
+])
+def test_rejected_transfer_writes_nothing(db, accounts, sold, sender, receiver, amount, error):
+    accounts({"alice": 1_000, "bob": 0})
+    with pytest.raises(error):
+        db.transfer(sender, receiver, amount)
+    assert (sold("alice"), sold("bob")) == (1_000, 0)
+    assert db._ledger_entries_after("alice", 0, 10) == []
@@ -0,0 +1,76 @@
+import pytest
+from exceptions import AccountNotFoundError
+from DataBase.UserCache import UserCache, NOT_CACHED
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_entries_expire_after_their_ttl():
+    clock = Clock()
+    cache = UserCache(max_size=10, ttl=30.0, negative_ttl=5.0, clock=clock)
+    cache.put("alice", {"Sold": 1, "Iban": "RO01"})
+    cache.put("nobody", None)
+    assert cache.get("alice") == {"Sold": 1, "Iban": "RO01"}
+    assert cache.get_by_iban("RO01") == ("alice", {"Sold": 1, "Iban": "RO01"})
+    # missing accounts are remembered for the shorter negative_ttl
+    assert cache.get("nobody") is None
+    clock.now = 6.0
+    assert cache.get("nobody") is NOT_CACHED
+    assert cache.get("alice") is not NOT_CACHED
+    clock.now = 31.0
+    assert cache.get("alice") is NOT_CACHED
+    assert cache.get_by_iban("RO01") is NOT_CACHED
+
+def test_least_recently_used_entry_is_evicted():
+    cache = UserCache(max_size=2)
+    cache.put("alice", {"Sold": 1})
+    cache.put("bob", {"Sold": 2})
+    cache.get("alice")
+    cache.put("carol", {"Sold": 3})
+    assert cache.get("bob") is NOT_CACHED
+    assert cache.get("alice") is not NOT_CACHED
+    assert cache.stats()["evictions"] == 1
+
+def test_reads_older_than_an_invalidation_are_dropped():
+    cache = UserCache()
+    generation = cache.generation
+    cache.invalidate("alice")
+    cache.put("alice", {"Sold": 1}, generation)
+    assert cache.get("alice") is NOT_CACHED
+    cache.put("alice", {"Sold": 2}, cache.generation)
+    assert cache.get("alice") == {"Sold": 2}
+
+def test_refresh_moves_the_generation_only_for_new_documents():
+    cache = UserCache()
+    cache.put("alice", {"Sold": 1})
+    generation = cache.generation
+    cache.refresh("alice", {"Sold": 1})
+    assert cache.generation == generation
+    cache.refresh("alice", {"Sold": 2})
+    assert cache.generation == generation + 1 and cache.get("alice") == {"Sold": 2}
+
+def test_storage_reads_through_the_cache(db, accounts):
+    accounts({"alice": 100, "bob": 0})
+    db.get_user("alice")
+    db.get_user("alice")
+    assert db.cache.stats()["hits"] == 1
+    # a write drops the cached document
+    db.transfer("alice", "bob", 40)
+    assert db.get_user("alice").balance == 60
+    # unknown accounts are cached as missing
+    for _ in range(2):
+        with pytest.raises(AccountNotFoundError):
+            db.get_user("nobody")
+    assert db.cache.stats()["negative_hits"] == 1
+
+def test_listener_snapshots_refresh_the_cache(db, accounts):
+    accounts({"alice": 100, "bob": 0})
+    db.get_user("bob")
+    generation = db.cache.generation
+    watch = db.listen_to_user("bob", lambda *snapshot: None)
+    assert db.cache.generation == generation
+    watch.unsubscribe()
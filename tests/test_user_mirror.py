@@ -0,0 +1,45 @@
+from DataBase.UserMirror import UserMirror
+from DataBase.UserCache import NOT_CACHED
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def mirror_of(db, clock):
+    mirror = UserMirror(db, max_staleness=10.0, clock=clock)
+    db.cache = mirror
+    mirror.start()
+    return mirror
+
+def test_lookups_are_answered_from_the_replica(db, accounts):
+    accounts({"alice": 100, "bob": 0})
+    mirror = mirror_of(db, Clock())
+    iban = db.get_fields("bob", ["Iban"])["Iban"]
+    assert mirror.get("alice")["Sold"] == 100
+    assert mirror.get_by_iban(iban)[0] == "bob"
+    assert db.resolve_iban(iban) == "bob"
+    assert mirror.stats()["size"] == 2
+    mirror.stop()
+
+def test_replica_follows_the_writes(db, accounts):
+    accounts({"alice": 100, "bob": 0})
+    mirror = mirror_of(db, Clock())
+    db.transfer("alice", "bob", 30)
+    assert db.get_user("bob").balance == 30
+    assert mirror.get("bob")["Sold"] == 30
+    db.delete_user("alice")
+    assert mirror.get("alice") is NOT_CACHED
+    mirror.stop()
+
+def test_stale_replica_falls_back_to_the_database(db, accounts):
+    accounts({"alice": 100})
+    clock = Clock()
+    mirror = mirror_of(db, clock)
+    clock.now = 11.0
+    assert mirror.get("alice") is NOT_CACHED
+    assert db.get_user("alice").balance == 100
+    assert mirror.stats()["stale"] >= 1
+    mirror.stop()
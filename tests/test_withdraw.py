@@ -0,0 +1,28 @@
+import pytest
+from exceptions import InsufficientFundsError
+from services.bank_service import BankService
+from services.transfer_executor import TransferExecutor
+
+def test_withdraw_checks_the_stored_balance(db, accounts):
+    accounts({"alice": 100, "bob": 0})
+    bank = BankService(db)
+    alice = db.get_user("alice")
+    with TransferExecutor(bank, max_workers=2) as executor:
+        executor.transfer("alice", "bob", 100).result()
+    # alice.balance is still 100
+    with pytest.raises(InsufficientFundsError):
+        bank.withdraw(alice, 100)
+    assert db.get_fields("alice", ["Sold"])["Sold"] == 0
+    assert alice.balance == 100
+    assert not alice.payment_history.pending
+    assert db.audit_balances(["alice", "bob"])["mismatches"] == []
+
+def test_withdraw_within_the_stored_balance(db, accounts):
+    accounts({"alice": 100})
+    bank = BankService(db)
+    alice = db.get_user("alice")
+    bank.withdraw(alice, 60)
+    with pytest.raises(InsufficientFundsError):
+        bank.withdraw(alice, 41)
+    assert db.get_fields("alice", ["Sold"])["Sold"] == 40
+    assert alice.balance == 40
@@ -0,0 +1,39 @@
+"""
+Builds the monthly rollups (total in, total out, count, counterparties per
+account and month) of the configured storage from the existing ledger.
+New payments update the rollups as they are written; run this once for the
+history written before, while the app is stopped, or again to repair them.
+
+    python tools/backfill_rollups.py
+    python tools/backfill_rollups.py --user alice --user bob
+
+Ledger entries written before payments were timestamped have no month and are skipped.
+The backend is chosen with EDMBANK_STORAGE like for the app.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataBase.Factory import create_database
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", help="storage backend (defaults to EDMBANK_STORAGE)")
+    parser.add_argument("--user", action="append", dest="users", help="rebuild only this account (repeatable)")
+    args = parser.parse_args()
+
+    db = create_database(args.backend, cache_size=0)
+    started = time.perf_counter()
+    report = db.backfill_rollups(args.users)
+    elapsed = time.perf_counter() - started
+    print(f"accounts: {report['accounts']}")
+    print(f"payments: {report['payments']} in {elapsed:.1f} s")
+    print(f"undated entries skipped: {report['undated']}")
+    if hasattr(db, "close"):
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Advances the balance checkpoints of the configured storage and audits the
+stored balances against the ledger.
+
+Every account keeps checkpoints of its balance (Seq 0 is the opening balance).
+The balance after any ledger entry is the closest checkpoint plus the entries
+after it, so with a checkpoint every --interval entries point-in-time balances
+and audits read at most that many entries, whatever the age of the account.
+
+    python tools/compact_ledger.py
+    python tools/compact_ledger.py --audit --user alice
+
+Accounts created before checkpoints existed get their opening checkpoint on the
+first run, derived from their current balance. The ledger itself is not modified.
+The backend is chosen with EDMBANK_STORAGE like for the app.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataBase.Factory import create_database
+from DataBase.Storage import CHECKPOINT_INTERVAL
+from user_management.money import format_bani
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", help="storage backend (defaults to EDMBANK_STORAGE)")
+    parser.add_argument("--user", action="append", dest="users", help="process only this account (repeatable)")
+    parser.add_argument("--interval", type=int, default=CHECKPOINT_INTERVAL, help="ledger entries between two checkpoints")
+    parser.add_argument("--audit", action="store_true", help="also check the stored balances against the ledger")
+    args = parser.parse_args()
+
+    db = create_database(args.backend, cache_size=0)
+    started = time.perf_counter()
+    report = db.compact_ledger(args.users, args.interval)
+    elapsed = time.perf_counter() - started
+    print(f"accounts: {report['accounts']} in {elapsed:.1f} s")
+    print(f"opening checkpoints: {report['opened']}")
+    print(f"checkpoints written: {report['checkpoints']}")
+
+    failed = False
+    if args.audit:
+        started = time.perf_counter()
+        audit = db.audit_balances(args.users)
+        elapsed = time.perf_counter() - started
+        print(f"audited: {audit['accounts']} in {elapsed:.1f} s")
+        for mismatch in audit["mismatches"]:
+            print(f"  {mismatch['Name']} at seq {mismatch['Seq']}: stored {format_bani(mismatch['Stored'])}, "
+                  f"ledger {format_bani(mismatch['Ledger'])}")
+        for username in audit["unchecked"]:
+            print(f"  {username}: no checkpoint")
+        failed = bool(audit["mismatches"])
+    if hasattr(db, "close"):
+        db.close()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Runs the transfers listed in a CSV file (e.g. a payroll) through
+BankService.transfer_batch, reading the file as a stream: only one chunk of
+rows is in memory at a time, whatever the size of the file.
+
+    python tools/import_transfers.py payroll.csv --run-id payroll-2026-10
+    python tools/import_transfers.py payroll.csv --output results.csv
+
+The file has a header with the columns sender, receiver and amount (in lei,
+"1250.50" or "1.250,50"), and optionally key. Rows are applied in file order,
+so a credit earlier in the file can fund a debit later in it.
+Rows without a key get "<run id>-<line>": running the same file again with the
+same --run-id after an interruption replays the rows already committed instead
+of paying them twice. The backend is chosen with EDMBANK_STORAGE like for the app.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+import uuid
+from itertools import islice
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataBase.Factory import create_database
+from services.bank_service import BankService
+from user_management.money import parse_amount, format_bani
+
+def read_rows(file, run_id):
+    """Yields (line, item or None, error or None) for each row of the CSV file, lazily."""
+    reader = csv.DictReader(file)
+    missing = {"sender", "receiver", "amount"} - set(reader.fieldnames or [])
+    if missing:
+        raise SystemExit(f"missing columns: {', '.join(sorted(missing))}")
+    for row in reader:
+        line = reader.line_num
+        try:
+            amount = parse_amount(row["amount"] or "")
+        except ValueError as error:
+            yield line, None, error
+            continue
+        key = (row.get("key") or "").strip() or f"{run_id}-{line}"
+        yield line, ((row["sender"] or "").strip(), (row["receiver"] or "").strip(), amount, key), None
+
+def describe(error) -> str:
+    return f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV file with the columns sender, receiver, amount[, key]")
+    parser.add_argument("--backend", help="storage backend (defaults to EDMBANK_STORAGE)")
+    parser.add_argument("--run-id", help="prefix of the generated transfer keys (defaults to a random one)")
+    parser.add_argument("--chunk-size", type=int, help="transfers per atomic commit (defaults to the backend's maximum)")
+    parser.add_argument("--output", help="write the result of every row to this CSV file")
+    args = parser.parse_args()
+
+    db = create_database(args.backend, cache_size=0)
+    bank = BankService(db)
+    chunk_size = min(args.chunk_size or db.transfer_batch_max, db.transfer_batch_max)
+    run_id = args.run_id or uuid.uuid4().hex
+    counts = {"committed": 0, "replayed": 0, "rejected": 0}
+    total = 0
+    started = time.perf_counter()
+    output = open(args.output, "w", newline="") if args.output else None
+    writer = csv.writer(output) if output else None
+    if writer:
+        writer.writerow(["line", "sender", "receiver", "amount", "status", "sender_balance", "error"])
+    try:
+        with open(args.path, newline="") as file:
+            rows = read_rows(file, run_id)
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                results = iter(bank.transfer_batch([item for _, item, _ in chunk if item is not None], chunk_size))
+                for line, item, error in chunk:
+                    result = error if item is None else next(results)
+                    if isinstance(result, Exception):
+                        status = "rejected"
+                        if not writer:
+                            print(f"  line {line}: {describe(result)}")
+                    else:
+                        status = "replayed" if result.replayed else "committed"
+                        total += 0 if result.replayed else result.payment.amount
+                    counts[status] += 1
+                    if writer:
+                        sender, receiver, amount = item[:3] if item else ("", "", "")
+                        writer.writerow([line, sender, receiver, amount, status,
+                                         "" if status == "rejected" else result.sender_balance,
+                                         describe(result) if status == "rejected" else ""])
+    finally:
+        if output:
+            output.close()
+        if hasattr(db, "close"):
+            db.close()
+    elapsed = time.perf_counter() - started
+    rows = sum(counts.values())
+    print(f"rows: {rows} in {elapsed:.1f} s ({rows / elapsed if elapsed else 0:.0f} rows/s), run id {run_id}")
+    print(f"committed: {counts['committed']} ({format_bani(total)}), replayed: {counts['replayed']}, "
+          f"rejected: {counts['rejected']}")
+    sys.exit(1 if counts["rejected"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+Rewrites the ledger entries of the configured storage that are still stored as
+"sender -> amount -> receiver" strings in the packed (msgpack) format.
+Reads understand both formats, so the migration can run while the app is in use.
+
+    python tools/migrate_ledger_encoding.py
+
+The backend is chosen with EDMBANK_STORAGE like for the app.
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataBase.Factory import create_database
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", help="storage backend (defaults to EDMBANK_STORAGE)")
+    args = parser.parse_args()
+
+    db = create_database(args.backend, cache_size=0)
+    converted = db.migrate_ledger_encoding()
+    print(f"ledger entries converted: {converted}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Converts the amounts stored in Firestore from lei floats to integer bani
+(balances, balance shards, transfer records, rollups, ledger and Inbox payloads)
+and marks the database as migrated. The app refuses to start on a database
+that still stores lei. Stop the app while it runs; an interrupted run can be restarted.
+
+    python tools/migrate_money_units.py
+
+SQLite files are converted automatically when they are opened, and the
+in-memory backend has nothing to convert.
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataBase.DataBase import Database
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    db = Database(check_money_unit=False)
+    report = db.migrate_money_units()
+    if not report:
+        print("amounts are already stored in bani")
+        return
+    for collection, converted in report.items():
+        print(f"{collection}: {converted} documents converted")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Checks (and optionally repairs) the uniqueness indexes of the configured storage:
+IBAN -> username and card number -> username.
+
+    python tools/rebuild_indexes.py            # report only
+    python tools/rebuild_indexes.py --rebuild  # backfill missing entries, drop stale ones
+
+The backend is chosen with EDMBANK_STORAGE like for the app.
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataBase.Factory import create_database
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="write the missing entries and delete the stale ones")
+    parser.add_argument("--index", choices=["iban", "card", "all"], default="all")
+    parser.add_argument("--backend", help="storage backend (defaults to EDMBANK_STORAGE)")
+    args = parser.parse_args()
+
+    db = create_database(args.backend, cache_size=0)
+    indexes = {
+        "iban": (db.verify_iban_index, db.rebuild_iban_index),
+        "card": (db.verify_card_index, db.rebuild_card_index),
+    }
+    needs_repair = False
+    for name, (verify, rebuild) in indexes.items():
+        if args.index not in (name, "all"):
+            continue
+        report = rebuild() if args.rebuild else verify()
+        print(f"{name} index")
+        print(f"  missing entries: {len(report['missing'])}")
+        print(f"  stale entries:   {len(report['stale'])}")
+        print(f"  duplicates:      {len(report['duplicates'])}")
+        for key in report["duplicates"]:
+            print(f"    {key} is owned by more than one user")
+        needs_repair = needs_repair or bool(report["missing"] or report["stale"])
+
+    if args.rebuild:
+        print("indexes repaired")
+    elif needs_repair:
+        print("run again with --rebuild to repair the indexes")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Pays the scheduled and recurring payments of the configured storage when
+they are due. One such process per database is enough; the transfer key of
+every occurrence makes a second one harmless, not useful.
+
+    python tools/run_scheduler.py
+    python tools/run_scheduler.py --once
+
+--once pays what is due now and exits (for cron); otherwise the process sleeps
+until the next due payment and prints its counters every --report seconds.
+The backend is chosen with EDMBANK_STORAGE like for the app.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataBase.Factory import create_database
+from services.bank_service import BankService
+from services.payment_scheduler import PaymentScheduler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", help="storage backend (defaults to EDMBANK_STORAGE)")
+    parser.add_argument("--once", action="store_true", help="pay the due payments and exit")
+    parser.add_argument("--report", type=float, default=60.0, help="seconds between two status lines")
+    args = parser.parse_args()
+
+    db = create_database(args.backend, cache_size=0)
+    bank = BankService(db)
+    if args.once:
+        scheduler = PaymentScheduler(bank)
+        started = time.perf_counter()
+        executed = scheduler.run_due()
+        stats = scheduler.stats()
+        print(f"executed: {executed} in {time.perf_counter() - started:.1f} s "
+              f"(paid {stats['paid']}, rejected {stats['rejected']}), next run: {stats['next_run']}")
+    else:
+        scheduler = bank.start_payment_scheduler()
+        try:
+            while True:
+                time.sleep(args.report)
+                print(scheduler.stats(), flush=True)
+        except KeyboardInterrupt:
+            scheduler.stop()
+    if hasattr(db, "close"):
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Fills the configured storage with generated accounts and payment histories,
+for load testing. Replaces DataBase/CreateData.py.
+
+    python tools/seed_data.py --accounts 100000 --history-mean 20 --seed 7
+    python tools/seed_data.py --backend sqlite --accounts 1000000 --bcrypt-rounds 4 --workers 8
+
+Passwords are hashed on a process pool, with a low bcrypt cost by default
+(test data only), and accounts are written in batches with add_users_bulk.
+Seed an empty database: existing usernames, card numbers or IBANs are not checked.
+The backend is chosen with EDMBANK_STORAGE like for the app.
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+from faker import Faker
+from DataBase.Factory import create_database
+from user_management.credit_card import Card
+from user_management.payment_details import Payment
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+def history_length(rng, distribution, mean, maximum):
+    if distribution == "fixed":
+        length = mean
+    elif distribution == "uniform":
+        length = rng.randint(0, 2 * mean)
+    else:
+        # most accounts have a few payments, some have a lot
+        length = int(rng.expovariate(1 / mean)) if mean > 0 else 0
+    return min(length, maximum)
+
+class AccountGenerator:
+    """Generates account documents with unique usernames, card numbers and IBANs."""
+    def __init__(self, seed, args):
+        self.args = args
+        self.rng = random.Random(seed)
+        # Card draws from the module random generator
+        random.seed(seed)
+        self.fake = Faker()
+        self.fake.seed_instance(seed)
+        self.card_numbers = set()
+        self.ibans = set()
+        self.generated = 0
+
+    def _card(self):
+        while True:
+            card = Card.generateCard()
+            if card.number not in self.card_numbers and card.IBAN not in self.ibans:
+                self.card_numbers.add(card.number)
+                self.ibans.add(card.IBAN)
+                return card
+
+    def batch(self, size):
+        """Returns (documents without Password_hash, plain passwords, payments of each account)."""
+        documents, passwords = [], []
+        for _ in range(size):
+            # the index keeps the generated names unique
+            username = f"{self.fake.first_name()}{self.fake.last_name()}{self.generated}"
+            self.generated += 1
+            card = self._card()
+            documents.append({
+                "Name": username,
+                "Card_Number": card.number,
+                "CVV": card.cvv,
+                "Expiry_date": card.expiry_date,
+                "Sold": self.rng.randrange(100, 1_000_000),
+                "Email": f"{username.lower()}@{self.fake.free_email_domain()}",
+                "Iban": card.IBAN,
+            })
+            passwords.append(str(self.rng.randrange(10**6, 10**7)))
+
+        # payments between accounts of the same batch, so every counterpart exists;
+        # each payment is in the ledgers of both accounts, like a transfer of the app
+        usernames = [document["Name"] for document in documents]
+        slots = [username for username in usernames
+                 for _ in range(history_length(self.rng, self.args.history_distribution, self.args.history_mean, self.args.history_max))]
+        self.rng.shuffle(slots)
+        # a payment takes one slot of each of two different accounts; waiting slots all
+        # belong to the same account (any other one is paired at once), a few may be left
+        waiting = []
+        histories = {username: [] for username in usernames}
+        now = datetime.now(timezone.utc)
+        for username in slots:
+            if not waiting or waiting[-1] == username:
+                waiting.append(username)
+                continue
+            other = waiting.pop()
+            amount = self.rng.randrange(100, 50_000)
+            date = now - timedelta(seconds=self.rng.uniform(0, self.args.history_days * 86400))
+            sender, receiver = (username, other) if self.rng.random() < 0.5 else (other, username)
+            payment = Payment(amount, sender, receiver, date=date)
+            histories[username].append(payment)
+            histories[other].append(payment)
+        # in ledger order
+        histories = [sorted(histories[username], key=lambda payment: payment.date) for username in usernames]
+        return documents, passwords, histories
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", help="storage backend (defaults to EDMBANK_STORAGE)")
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--history-mean", type=int, default=20, help="average ledger entries per account")
+    parser.add_argument("--history-max", type=int, default=1000, help="ledger entries per account at most")
+    parser.add_argument("--history-distribution", choices=["exponential", "uniform", "fixed"], default="exponential")
+    parser.add_argument("--history-days", type=float, default=365, help="payments are dated over this many past days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="bcrypt cost (4 is the minimum; the app uses 12)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="password hashing processes")
+    parser.add_argument("--batch-size", type=int, default=500, help="accounts per bulk write")
+    parser.add_argument("--credentials-out", help="CSV file receiving the username,password of every account")
+    args = parser.parse_args()
+
+    db = create_database(args.backend, cache_size=0)
+    generator = AccountGenerator(args.seed, args)
+    credentials_file = open(args.credentials_out, "w", newline="") if args.credentials_out else None
+    credentials_writer = csv.writer(credentials_file) if credentials_file else None
+
+    hashing_time = writing_time = 0.0
+    payments_written = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        while generator.generated < args.accounts:
+            size = min(args.batch_size, args.accounts - generator.generated)
+            documents, passwords, histories = generator.batch(size)
+
+            start = time.perf_counter()
+            chunksize = max(1, size // (4 * (args.workers or 1)))
+            hashes = pool.map(hash_password, passwords, repeat(args.bcrypt_rounds), chunksize=chunksize)
+            for document, password_hash in zip(documents, hashes):
+                document["Password_hash"] = password_hash
+            hashing_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            db.add_users_bulk(list(zip(documents, histories)))
+            writing_time += time.perf_counter() - start
+
+            payments_written += sum(len(payments) for payments in histories)
+            if credentials_writer:
+                credentials_writer.writerows((document["Name"], password) for document, password in zip(documents, passwords))
+            elapsed = time.perf_counter() - started
+            print(f"\r{generator.generated}/{args.accounts} accounts  {generator.generated / elapsed:8.0f} accounts/s",
+                  end="", flush=True)
+
+    elapsed = time.perf_counter() - started
+    print()
+    print(f"accounts:  {generator.generated} in {elapsed:.1f} s ({generator.generated / elapsed:.0f}/s)")
+    print(f"entries:   {payments_written} ledger entries, two per payment ({payments_written / elapsed:.0f}/s)")
+    print(f"hashing:   {hashing_time:.1f} s on {args.workers} processes (bcrypt cost {args.bcrypt_rounds})")
+    print(f"writing:   {writing_time:.1f} s")
+    if credentials_file:
+        credentials_file.close()
+    if hasattr(db, "close"):
+        db.close()
+
+if __name__ == "__main__":
+    main()
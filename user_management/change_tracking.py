@@ -0,0 +1,22 @@
+class ChangeTracking:
+    """
+    Records the public attributes assigned after mark_clean() was called,
+    so the storage can write only the fields that were modified.
+    Objects that were never marked clean are not tracked and are saved whole.
+    """
+    def __setattr__(self, name, value):
+        dirty = self.__dict__.get("_dirty")
+        if dirty is not None and not name.startswith("_"):
+            dirty.add(name)
+        object.__setattr__(self, name, value)
+
+    def mark_clean(self):
+        self._dirty = set()
+
+    @property
+    def is_tracked(self) -> bool:
+        return self.__dict__.get("_dirty") is not None
+
+    @property
+    def dirty_fields(self) -> set:
+        return set(self.__dict__.get("_dirty") or ())
@@ -1,22 +1,28 @@
 import random
 from datetime import datetime
+from .change_tracking import ChangeTracking
 
-class Card :
+# Bank Code for EDM Bank
+BANK_CODE = "EDMB"
+
+class Card(ChangeTracking):
     def __init__(self, number, cvv, expiry_date, IBAN):
         self.number = number
         self.cvv = cvv
         self.expiry_date = expiry_date
         self.IBAN = IBAN
 
-    
+
     @staticmethod
-    def generateCard():
+    def generateCard(number=None, IBAN=None):
         """
         Generates a random card for the user.
-        It must be validated externally to ensure the card does not already exist in the database.
+        It must be validated externally to ensure the card does not already exist in the database,
+        unless the number and IBAN come from an IdentifierPool.
         """
         # Card number (16 digits)
-        number = random.randrange(10**15, 10**16)
+        if number is None:
+            number = Card.generate_number()
 
         # CVV (3 digits)
         cvv = random.randrange(100, 1000)
@@ -29,12 +35,53 @@ class Card :
         expiry_date = f"{rand_month:02d}/{rand_year % 100:02d}"
 
         # IBAN
-        # Generating a 24-character IBAN (RO + 2 check digits + 4 bank code + 16 account digits)
-        # Bank Code for EDM Bank: EDMB
-        check_digits = f"{random.randrange(10, 99)}"
-        account_digits = f"{random.randrange(10**15, 10**16)}" # 16 digits
-        IBAN = f"RO{check_digits}EDMB{account_digits}"
+        if IBAN is None:
+            IBAN = Card.generate_iban()
 
         return Card(number, cvv, expiry_date, IBAN)
 
-    
\ No newline at end of file
+    @staticmethod
+    def luhn_check_digit(digits: str) -> int:
+        """Returns the Luhn check digit to append to the digits."""
+        total = 0
+        for index, digit in enumerate(reversed(digits)):
+            value = int(digit)
+            # the digit next to the check digit is doubled, then every second one
+            if index % 2 == 0:
+                value *= 2
+                if value > 9:
+                    value -= 9
+            total += value
+        return (10 - total % 10) % 10
+
+    @staticmethod
+    def generate_number() -> int:
+        """Generates a random 16-digit card number with a valid Luhn check digit."""
+        digits = str(random.randrange(10**14, 10**15))
+        return int(digits + str(Card.luhn_check_digit(digits)))
+
+    @staticmethod
+    def is_valid_number(number) -> bool:
+        digits = str(number)
+        return len(digits) == 16 and digits.isdigit() and Card.luhn_check_digit(digits[:-1]) == int(digits[-1])
+
+    @staticmethod
+    def _iban_remainder(iban: str) -> int:
+        # move the country code and check digits to the end, letters become 10..35
+        rearranged = iban[4:] + iban[:4]
+        return int("".join(str(int(char, 36)) for char in rearranged)) % 97
+
+    @staticmethod
+    def generate_iban() -> str:
+        """
+        Generates a 24-character Romanian IBAN (RO + 2 check digits + 4 bank code + 16 account digits)
+        with valid ISO 13616 mod-97 check digits.
+        """
+        account_digits = f"{random.randrange(10**15, 10**16)}" # 16 digits
+        check_digits = 98 - Card._iban_remainder(f"RO00{BANK_CODE}{account_digits}")
+        return f"RO{check_digits:02d}{BANK_CODE}{account_digits}"
+
+    @staticmethod
+    def is_valid_iban(iban: str) -> bool:
+        iban = iban.replace(" ", "").upper()
+        return len(iban) == 24 and iban.startswith("RO") and iban.isalnum() and Card._iban_remainder(iban) == 1
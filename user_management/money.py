@@ -0,0 +1,61 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from exceptions import NegativeAmountError
+
+# Amounts (balances, payments, rollups) are integers of bani: 1 RON = 100 bani.
+# Conversions from lei happen only at the edges: user input, legacy data, display.
+BANI_PER_LEU = 100
+CURRENCY = "RON"
+
+def to_bani(lei) -> int:
+    """
+    Converts an amount in lei (str, int, float or Decimal) to bani, rounding half up.
+    Floats go through their shortest repr, so 0.1 gives 10 bani and not 10.000000000000002.
+    Raises ValueError if it is not a finite number.
+    """
+    if isinstance(lei, bool):
+        raise ValueError(f"Invalid amount: {lei!r}")
+    try:
+        value = Decimal(repr(lei)) if isinstance(lei, float) else Decimal(lei)
+    except (InvalidOperation, TypeError, ValueError) as error:
+        raise ValueError(f"Invalid amount: {lei!r}") from error
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {lei!r}")
+    return int((value * BANI_PER_LEU).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def to_lei(bani : int) -> Decimal:
+    """Exact amount in lei, e.g. Decimal('12.50')."""
+    return Decimal(bani).scaleb(-2)
+
+def parse_amount(text : str) -> int:
+    """
+    Parses an amount typed by the user to bani: "12", "12,5", "1250.50", "1.250,50".
+    With both separators the dot groups thousands and the comma marks the decimals.
+    Raises ValueError for anything else, including more than two decimals.
+    """
+    text = text.strip().upper().removesuffix(CURRENCY).strip().replace(" ", "")
+    if "," in text and "." in text:
+        text = text.replace(".", "")
+    text = text.replace(",", ".")
+    try:
+        value = Decimal(text)
+    except InvalidOperation as error:
+        raise ValueError(f"Invalid amount: {text!r}") from error
+    if not value.is_finite() or value.as_tuple().exponent < -2:
+        raise ValueError(f"Invalid amount: {text!r}")
+    return int(value * BANI_PER_LEU)
+
+def format_bani(bani : int, currency : str = CURRENCY) -> str:
+    """Formats bani like the app shows balances: '1.250,00 RON' (thousands dot, decimal comma)."""
+    sign = "-" if bani < 0 else ""
+    lei, rest = divmod(abs(bani), BANI_PER_LEU)
+    return f"{sign}{lei:,}".replace(",", ".") + f",{rest:02d} {currency}"
+
+def check_amount(amount):
+    """
+    Amounts given to a transfer, deposit or withdrawal must be positive integers of bani.
+    Raises TypeError for anything else than an int (a float in lei by mistake) and NegativeAmountError.
+    """
+    if not isinstance(amount, int) or isinstance(amount, bool):
+        raise TypeError(f"Amounts are integer bani, got {amount!r}; convert with to_bani or parse_amount.")
+    if amount <= 0:
+        raise NegativeAmountError
@@ -1,22 +1,101 @@
 from datetime import datetime
 
+HISTORY_PAGE_SIZE = 20
+
 class Payment:
     """
-    Contains the details of a transaction.
+    Contains the details of a transaction; the amount is in bani (see user_management.money).
     """
-    def __init__(self, amount: float, sender: str, receiver: str):
+    def __init__(self, amount: int, sender: str, receiver: str, date: datetime = None, seq: int = None):
         self.amount = amount
         self.sender = sender
         self.receiver = receiver
-        #self.date = datetime.now()
+        # set by the storage: when the payment was committed (UTC) and its
+        # position in the ledger of the account it was read from
+        self.date = date
+        self.seq = seq
+
+class TransferResult:
+    """
+    Outcome of a transfer committed by the storage.
+    """
+    def __init__(self, payment: Payment, sender_balance: int, receiver_balance: int, replayed: bool = False):
+        self.payment = payment
+        self.sender_balance = sender_balance
+        self.receiver_balance = receiver_balance
+        # True when the transfer key had already been used: nothing was executed
+        # and the balances are the ones right after the original transfer
+        self.replayed = replayed
 
 class PaymentsHistory:
     """
     Represents all the payments made by the user.
+    The payments are stored in a ledger and loaded page by page (newest first)
+    through the loader; the first page is fetched on the first access to history.
     """
-    def __init__(self):
-        self.history: list[Payment] = []
+    def __init__(self, loader=None, saved_count: int = 0):
+        # loader(before, limit) -> (payments oldest first, cursor of the next older page or None)
+        self._loader = loader
+        self._loaded: list[Payment] = []
+        self._cursor = None
+        self._started = loader is None
+        self.has_more = loader is not None and saved_count > 0
+        # payments added since the last save, written to the ledger by modify_user
+        self.pending: list[Payment] = []
+        # payments already stored in the ledger
+        self.saved_count = saved_count
+
+    @property
+    def history(self) -> list[Payment]:
+        """Loaded payments, oldest first."""
+        if not self._started:
+            self.load_more()
+        return self._loaded
+
+    @property
+    def count(self) -> int:
+        """Total number of payments, loaded or not."""
+        return self.saved_count + len(self.pending)
 
     def add_payment(self, payment: Payment):
-        self.history.append(payment)
+        self._loaded.append(payment)
+        self.pending.append(payment)
+
+    def discard_payment(self, payment: Payment):
+        """Drops a pending payment that the storage rejected."""
+        self.pending.remove(payment)
+        if payment in self._loaded:
+            self._loaded.remove(payment)
+
+    def add_saved_payment(self, payment: Payment):
+        """Adds a payment that the storage has already written to the ledger."""
+        self.saved_count += 1
+        if not self._started:
+            # the first page will contain it
+            self.has_more = True
+            return
+        self._loaded.append(payment)
+
+    def load_more(self, limit: int = HISTORY_PAGE_SIZE) -> int:
+        """
+        Loads the next older page of payments.
+        Returns the number of payments loaded.
+        """
+        if not self.has_more:
+            self._started = True
+            return 0
+
+        page, self._cursor = self._loader(self._cursor, limit)
+        if not self._started:
+            # the first page already contains every saved payment added before it
+            self._loaded = page + self.pending
+            self._started = True
+        else:
+            self._loaded = page + self._loaded
+        self.has_more = self._cursor is not None
+        return len(page)
 
+    def mark_saved(self):
+        """Called by the storage once the pending payments are written."""
+        self.saved_count += len(self.pending)
+        self.pending = []
@@ -0,0 +1,97 @@
+import calendar
+import uuid
+from datetime import datetime, timedelta
+
+# how often a scheduled payment repeats; None pays it once
+INTERVALS = (None, "daily", "weekly", "monthly")
+
+# Last_status of an occurrence that was paid, other values name the rejecting error
+PAID = "Paid"
+
+def add_months(moment: datetime, months: int) -> datetime:
+    """Same day and time months later, on the last day of shorter months (31 Jan + 1 -> 28/29 Feb)."""
+    index = moment.year * 12 + moment.month - 1 + months
+    year, month = divmod(index, 12)
+    day = min(moment.day, calendar.monthrange(year, month + 1)[1])
+    return moment.replace(year=year, month=month + 1, day=day)
+
+class ScheduledPayment:
+    """
+    A transfer paid at First_run and, for an interval, repeated after it.
+    Occurrence n is computed from First_run (not from the previous one), so
+    monthly payments on the 31st come back to the 31st after shorter months.
+    next_run is None once a one-off payment ran; amounts are in bani.
+    """
+    def __init__(self, sender: str, receiver: str, amount: int, first_run: datetime, interval: str = None,
+                 runs: int = 0, failures: int = 0, last_status: str = None, schedule_id: str = None):
+        if interval not in INTERVALS:
+            raise ValueError(f"Unknown interval: {interval!r}")
+        if first_run.tzinfo is None:
+            raise ValueError("first_run must be an aware datetime.")
+        self.sender = sender
+        self.receiver = receiver
+        self.amount = amount
+        self.first_run = first_run
+        self.interval = interval
+        # occurrences executed so far (paid or rejected)
+        self.runs = runs
+        self.failures = failures
+        self.last_status = last_status
+        self.schedule_id = schedule_id if schedule_id else uuid.uuid4().hex
+
+    def occurrence(self, index: int) -> datetime:
+        """Due time of occurrence index, 0 being first_run."""
+        if self.interval == "daily":
+            return self.first_run + timedelta(days=index)
+        if self.interval == "weekly":
+            return self.first_run + timedelta(weeks=index)
+        if self.interval == "monthly":
+            return add_months(self.first_run, index)
+        return self.first_run
+
+    @property
+    def next_run(self):
+        if self.interval is None and self.runs:
+            return None
+        return self.occurrence(self.runs)
+
+    def payment_key(self) -> str:
+        """Transfer key of the next occurrence: running it twice never pays it twice."""
+        return f"schedule-{self.schedule_id}-{self.runs}"
+
+    def record_run(self, status: str):
+        """Moves to the next occurrence after the current one was paid (PAID) or rejected."""
+        self.runs += 1
+        self.last_status = status
+        if status != PAID:
+            self.failures += 1
+
+    def to_dict(self):
+        return {
+            "Id": self.schedule_id,
+            "Sender": self.sender,
+            "Receiver": self.receiver,
+            "Amount": self.amount,
+            "First_run": self.first_run,
+            "Interval": self.interval,
+            "Runs": self.runs,
+            "Failures": self.failures,
+            "Last_status": self.last_status,
+            # stored for the due queries, ordered by (Next_run, Id)
+            "Next_run": self.next_run
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        first_run = data["First_run"]
+        return ScheduledPayment(
+            sender=data["Sender"],
+            receiver=data["Receiver"],
+            amount=data["Amount"],
+            first_run=datetime.fromisoformat(first_run) if isinstance(first_run, str) else first_run,
+            interval=data.get("Interval"),
+            runs=data.get("Runs", 0),
+            failures=data.get("Failures", 0),
+            last_status=data.get("Last_status"),
+            schedule_id=data["Id"]
+        )
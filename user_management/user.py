@@ -1,11 +1,38 @@
 from .user_credentials import UserCredentials
 from .payment_details import PaymentsHistory
 from.credit_card import Card
+from .change_tracking import ChangeTracking
 
-class User:
+class User(ChangeTracking):
     def __init__(self, credentials: UserCredentials, balance: int, payment_history: PaymentsHistory, card: Card):
         self.credentials = credentials
         self.balance = balance
         self.payment_history = payment_history
         self.card = card
-        
\ No newline at end of file
+
+    def mark_clean(self):
+        """Called by the storage after the user was loaded or saved."""
+        super().mark_clean()
+        self.credentials.mark_clean()
+        self.card.mark_clean()
+        self._saved_balance = self.balance
+
+    def balance_delta(self):
+        """Balance change since the last save, None if the balance was not modified."""
+        if "balance" not in self.dirty_fields or self.balance == self._saved_balance:
+            return None
+        return self.balance - self._saved_balance
+        
+
+    def set_synced_balance(self, balance):
+        """
+        Takes the stored balance, e.g. from a transfer result or a snapshot.
+        The change is not a modification to save: a change not saved yet is kept on top of it.
+        """
+        if not self.is_tracked:
+            self.balance = balance
+            return
+        pending = self.balance_delta() or 0
+        self._saved_balance = balance
+        # assigned without marking balance dirty, unless it already was
+        object.__setattr__(self, "balance", balance + pending)
@@ -1,6 +1,8 @@
+from .change_tracking import ChangeTracking
+
 MIN_PASS_LEN = 5
 
-class UserCredentials:
+class UserCredentials(ChangeTracking):
     """
     Represents user's credentials for registration.
     Can also be used for login.